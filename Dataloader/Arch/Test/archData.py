@@ -0,0 +1,51 @@
+import json
+import random
+
+WORDS = "图书馆 博物馆 平面图 苏州 现代 建筑 文化 教育 公园 广场 住宅 办公 立面 剖面 中国 红花 学校 医院 酒店 商业".split()
+LABELS = {"建筑类型": ["文化建筑", "教育建筑", "居住建筑"], "设计风格": ["现代主义", "古典"]}
+SUBLABELS = [None, "子类A", "子类B"]
+
+
+def label(rand, label3=None):
+    """一条随机的label数据, label4和label5总是None."""
+    label1 = rand.choice(sorted(LABELS))
+    return {"label1": label1, "label2": rand.choice(LABELS[label1]), "label3": label3,
+            "label4": None, "label5": None}
+
+
+def writeArch(path, n=300, seed=1):
+    """
+    生成一个测试用的Arch标注文件, 格式与archtectureDataset相同.
+
+    n个annotation, n // 10个project. 大约三分之二的image有两个annotation, 五分之一的context为None,
+    文本由WORDS中的词加上需要清洗的字符组成. label为两层(部分annotation有第三层).
+
+    Args:
+        path: 标注文件的位置.
+        n: annotation的数量.
+        seed: 随机数种子, 相同的seed生成相同的文件.
+
+    Return:
+        path
+    """
+    rand = random.Random(seed)
+    projects = [{"projectId": p, "projectLabels": [label(rand)], "name": "p{}".format(p)} for p in range(n // 10)]
+
+    annotations = []
+    for i in range(n):
+        annotations.append({
+            "annotationId": i,
+            "imageId": i // 2 if i % 3 else i + 100000,
+            "projectId": rand.randrange(n // 10),
+            "title": "".join(rand.choices(WORDS, k=2)),
+            "context": " ".join(rand.choices(WORDS, k=rand.randint(0, 5))) + " 2020!" if i % 5 else None,
+            "description": "".join(rand.choices(WORDS, k=3)),
+            "labels": [label(rand, rand.choice(SUBLABELS))],
+        })
+    images = [{"imageId": imageId, "targetUrl": "http://example.com/{}.jpg".format(imageId)}
+              for imageId in sorted({ann["imageId"] for ann in annotations})]
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"info": {"version": 1}, "imageAnnotations": annotations, "images": images,
+                   "projectAnnotations": projects}, f, ensure_ascii=False)
+    return path
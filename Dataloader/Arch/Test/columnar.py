@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import tempfile
+import numpy as np
+from Dataloader.Arch.arch import Arch
+from Dataloader.Arch.Test.archData import writeArch
+
+RELATIONS = ["imgToAnns", "pojToImgs", "imgCatToImgs", "pojCatToPojs"]
+
+
+def deepSize(obj, seen=None):
+    """对象以及它引用的list, tuple, dict和字符串占用的字节数(每个对象只计算一次)."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deepSize(key, seen) + deepSize(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deepSize(value, seen) for value in obj)
+    return size
+
+
+def loadArch(path):
+    arch = Arch(annotationFile=path)
+    arch.reverseCharForAllContext()
+    return arch
+
+
+def assertSameAsDicts(path):
+    """toColumnar之后的对应关系, 文本和批量查询与原来的字典相同, 派生的文本从anns中删除."""
+    arch, expected = loadArch(path), loadArch(path)
+    annIds = list(arch.anns)
+    columns = arch.toColumnar()
+    assert arch.columns is columns
+
+    for name in RELATIONS:
+        relation, dicts = getattr(arch, name), getattr(expected, name)
+        assert list(relation) == list(dicts) and len(relation) == len(dicts), name
+        for key, values in dicts.items():
+            assert key in relation, (name, key)
+            if name == "imgToAnns":
+                assert [ann["annotationId"] for ann in relation[key]] == [ann["annotationId"] for ann in values]
+                assert all(ann is arch.anns[ann["annotationId"]] for ann in relation[key])
+            else:
+                assert list(relation[key]) == values, (name, key)
+        # a missing key is empty, as in defaultdict(list), and is not added
+        assert len(relation["no such key"]) == 0 and "no such key" not in relation
+
+    assert list(columns.texts) == [expected.anns[annId]["concateText"] for annId in annIds]
+    assert list(columns.tokens) == [tuple(expected.anns[annId]["cutConcateText"]) for annId in annIds]
+    assert all("concateText" not in ann and "cutConcateText" not in ann for ann in arch.anns.values())
+    assert all(ann["title"] == expected.anns[annId]["title"] for annId, ann in arch.anns.items())
+
+    # bulk lookups by annotationId
+    order = annIds[::-1]
+    assert columns.imageIdsOf(order).tolist() == [expected.anns[annId]["imageId"] for annId in order]
+    assert columns.projectIdsOf(order).tolist() == [expected.anns[annId].get("projectId") for annId in order]
+    try:
+        columns.annRows([annIds[0], -1])
+        assert False, "a missing annotationId should raise KeyError"
+    except KeyError:
+        pass
+
+    # the label index reads the relations from the columns
+    for target in ["建筑", "文化", "古典"]:
+        result, reference = arch.filterAnnoLabel(target), expected.filterAnnoLabel(target)
+        assert list(result) == list(reference)
+        assert all(np.array_equal(result[label], reference[label]) for label in reference)
+        assert np.array_equal(arch.filterProjectLabel(target, merge=True), expected.filterProjectLabel(target, merge=True))
+    return arch, expected
+
+
+def test_columnar_same_as_dicts():
+    """
+    生成的数据集(包括缺少的, 为None的和字符串的projectId): 列式表示的结果与字典相同, 并且占用的内存
+    比它代替的字典, 列表和文本少.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        path = writeArch(os.path.join(root, "arch.json"), n=3000)
+        arch, expected = assertSameAsDicts(path)
+
+        replaced = [getattr(expected, name) for name in RELATIONS]
+        replaced += [[ann["concateText"], ann["cutConcateText"]] for ann in expected.anns.values()]
+        columnBytes = arch.columns.nbytes() + deepSize(arch.columns.tokenTable.strings)
+        print("columns: {} bytes, replaced dicts and texts: {} bytes".format(columnBytes, deepSize(replaced)))
+        assert columnBytes < deepSize(replaced) / 2
+
+        with open(path, encoding="utf-8") as f:
+            dataset = json.load(f)
+        for i, ann in enumerate(dataset["imageAnnotations"]):
+            if i % 4 == 0:
+                del ann["projectId"]
+            elif i % 4 == 1:
+                ann["projectId"] = None
+            elif i % 4 == 2:
+                ann["projectId"] = "p{}".format(ann["projectId"])
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dataset, f, ensure_ascii=False)
+        assertSameAsDicts(path)
+
+
+if __name__ == "__main__":
+    # 与字典逐个比较, 再把一部分projectId改为缺少, None和字符串
+    test_columnar_same_as_dicts()
+    print("columnar store == dicts")
@@ -0,0 +1,61 @@
+import os
+import logging
+import tempfile
+from Dataloader.Arch.arch import Arch
+from Dataloader.Arch.Test.archData import writeArch
+import Dataloader.Arch.corpusRegistry as registry
+
+
+def test_registry_shares_frozen_corpus():
+    """
+    同一个数据集只加载一次: 分好词和未分词的文本是archDataset.columns中只读的序列, anns中不再保存;
+    workers或cachePath不同的请求返回同一个语料并记录warning, 文件改变后重新加载并删除旧版本的语料.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        path = writeArch(os.path.join(root, "arch.json"))
+        registry.releaseCorpora()
+
+        corpus = registry.getCorpus(path)
+        expected = Arch(annotationFile=path)
+        expected.reverseCharForAllContext()
+        assert corpus.columns is corpus.archDataset.columns
+        assert corpus.corporaList is corpus.columns.tokens and corpus.notCutCorporaList is corpus.columns.texts
+        assert isinstance(corpus.annIdList, tuple) and corpus.annIdList == tuple(expected.anns)
+        assert all(isinstance(tokens, tuple) for tokens in corpus.corporaList)
+        assert list(corpus.corporaList) == [tuple(ann["cutConcateText"]) for ann in expected.anns.values()]
+        assert list(corpus.notCutCorporaList) == [ann["concateText"] for ann in expected.anns.values()]
+        assert all("cutConcateText" not in ann for ann in corpus.archDataset.anns.values())
+        for texts in [corpus.corporaList, corpus.notCutCorporaList]:
+            try:
+                texts[0] = None
+                assert False, "the texts should be read-only"
+            except TypeError:
+                pass
+
+        # a cut corpus also serves cut=False, a different cachePath only logs a warning
+        assert registry.getCorpus(path, cut=False) is corpus
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        registry.logger.addHandler(handler)
+        try:
+            assert registry.getCorpus(path, workers=1) is corpus and len(records) == 0
+            assert registry.getCorpus(path, workers=2, cachePath=os.path.join(root, "seg.sqlite")) is corpus
+            assert len(records) == 1 and records[0].levelno == logging.WARNING
+        finally:
+            registry.logger.removeHandler(handler)
+
+        # a changed file is a new key, the old version is evicted
+        writeArch(path, n=200)
+        changed = registry.getCorpus(path)
+        assert changed is not corpus and len(changed.annIdList) == 200
+        assert list(registry._corpora.values()) == [changed]
+        other = registry.getCorpus(writeArch(os.path.join(root, "other.json"), n=50), cut=False)
+        assert registry.getCorpus(path) is changed and len(registry._corpora) == 2 and other.corporaList is None
+        registry.releaseCorpora()
+
+
+if __name__ == "__main__":
+    # 生成的数据集, 加载两次(第二次修改文件)
+    test_registry_shares_frozen_corpus()
+    print("shared corpus is frozen and reused")
@@ -0,0 +1,86 @@
+import os
+import json
+import tempfile
+import jieba
+import numpy as np
+from Dataloader.Arch.Test.archData import writeArch
+from TestModel.archLmirBm25Model import archLmirBm25Model
+import Dataloader.Arch.corpusRegistry as registry
+
+
+def test_filtered_scores_equal_unfiltered():
+    """
+    给出docs(docFilter)时, forward和forwardWords的分数与不过滤时对应文档的分数相同(一个词和多个词);
+    searchSentence和searchWords的结果是不过滤时的排序中被允许的文档, sortedResult按被允许的文档归一化.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        model = archLmirBm25Model(writeArch(os.path.join(root, "arch.json")))
+    facets = model.facets
+    for docFilter in [facets.label("文化建筑"), facets.label("教育建筑") & ~facets.projectLabel("古典")]:
+        docs = docFilter.indices()
+        assert 0 < len(docs) < len(model.annIdList)
+
+        for query in [["图书馆"], ["苏州", "现代", "建筑"], ["not_in_vocab"]]:
+            expected = model.model.forward(query)
+            result = model.model.forward(query, docs=docs)
+            for name in expected:
+                assert np.allclose(result[name], expected[name][docs], rtol=1e-12, atol=1e-12), (query, name)
+
+            weights = [1.0 / len(query)] * len(query)
+            expected = model.model.forwardWords(query, weights)
+            result = model.model.forwardWords(query, weights, docs=docs)
+            for name in expected:
+                assert np.allclose(result[name], expected[name][docs], rtol=1e-12, atol=1e-12), (query, name)
+
+        words = ["苏州图书馆"]
+        cutWords, weights = model.cut_words(words, ["1"])
+        for search, args, scores in [(model.searchSentence, (words,), model.model.forward(list(jieba.cut(words[0], True)))),
+                                     (model.searchWords, (words, ["1"]), model.model.forwardWords(cutWords, weights))]:
+            _, fullIndex, _, _, _ = search(*args)
+            sortedResult, index, copora, annoId, imageId = search(*args, top_k=10, docFilter=docFilter)
+            assert np.array_equal(index, fullIndex[docFilter.mask[fullIndex]][:10])
+            assert annoId == [model.annIdList[i] for i in index]
+
+            # min-max over the allowed documents, see ranking.topK
+            allowed = scores["ALL"][docs]
+            assert np.allclose(sortedResult, (scores["ALL"][index] - allowed.min()) / (allowed.max() - allowed.min()))
+
+
+def test_project_groups_with_missing_ids():
+    """
+    annotation没有projectId(或者为None), 以及projectId不是int时也能建立共享的语料: 相同projectId的文档
+    属于同一个group, 没有projectId的文档各自是一个group.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        path = writeArch(os.path.join(root, "arch.json"), n=100)
+        with open(path, encoding="utf-8") as f:
+            dataset = json.load(f)
+        for i, ann in enumerate(dataset["imageAnnotations"]):
+            if i % 4 == 0:
+                del ann["projectId"]
+            elif i % 4 == 1:
+                ann["projectId"] = None
+            elif i % 4 == 2:
+                ann["projectId"] = "p{}".format(ann["projectId"])
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dataset, f, ensure_ascii=False)
+
+        registry.releaseCorpora()
+        corpus = registry.getCorpus(path)
+        registry.releaseCorpora()
+
+    projectIds = [corpus.archDataset.anns[annId].get("projectId") for annId in corpus.annIdList]
+    groups = corpus.facets.groups("project")
+    for i in range(len(projectIds)):
+        for j in range(len(projectIds)):
+            same = projectIds[i] is not None and projectIds[i] == projectIds[j]
+            assert (groups[i] == groups[j]) == (same or i == j), (projectIds[i], projectIds[j])
+
+
+if __name__ == "__main__":
+    # 生成的数据集, 一个label和组合的过滤条件
+    test_filtered_scores_equal_unfiltered()
+    print("filtered scores == unfiltered scores[docs]")
+    # 缺少的, 为None的和字符串的projectId
+    test_project_groups_with_missing_ids()
+    print("project groups with missing ids")
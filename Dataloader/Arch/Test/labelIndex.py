@@ -0,0 +1,41 @@
+import random
+import numpy as np
+from Dataloader.Arch.labelIndex import LabelIndex
+
+
+def bruteFilter(labelToIds, targetString):
+    """逐个检查所有label的子串过滤, 作为参考结果."""
+    return {label: np.unique(ids) for label, ids in labelToIds.items() if targetString in label}
+
+
+def test_label_index_equals_scan():
+    """
+    LabelIndex的filter和filterIds与遍历所有label的子串查询结果相同: 包括label的所有子串, 空字符串,
+    单个字, 不存在的字, 以及bigram都存在但顺序不同的查询.
+    """
+    rand = random.Random(0)
+    chars = "文化建筑教育居住现代古典"
+    labelToIds = {}
+    while len(labelToIds) < 200:
+        label = "".join(rand.choices(chars, k=rand.randint(1, 6)))
+        labelToIds[label] = [rand.randrange(1000) for _ in range(rand.randint(1, 20))]
+    index = LabelIndex(labelToIds)
+
+    queries = {"", "无", "化文化", "建筑建"}
+    for label in labelToIds:
+        queries.update(label[i:j] for i in range(len(label)) for j in range(i + 1, len(label) + 1))
+    queries.update("".join(rand.choices(chars, k=rand.randint(2, 5))) for _ in range(500))
+
+    for targetString in sorted(queries):
+        expected = bruteFilter(labelToIds, targetString)
+        result = index.filter(targetString)
+        assert list(result) == list(expected), targetString
+        assert all(np.array_equal(result[label], expected[label]) for label in expected), targetString
+        merged = np.unique(np.concatenate(list(expected.values()))) if expected else np.zeros(0)
+        assert np.array_equal(index.filterIds(targetString), merged), targetString
+
+
+if __name__ == "__main__":
+    # 200个由12个字组成的随机label
+    test_label_index_equals_scan()
+    print("label index == substring scan")
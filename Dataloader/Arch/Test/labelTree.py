@@ -0,0 +1,48 @@
+import os
+import tempfile
+import numpy as np
+from Dataloader.Arch.Test.archData import writeArch
+from Dataloader.Arch.arch import Arch
+from Dataloader.Arch.labelTree import labelPath
+
+
+def bruteIds(items, labelKey, idKey, path):
+    """遍历所有标注, 任意一条label路径以path开头的标注的id, 作为参考结果."""
+    path = tuple(path)
+    return np.unique(np.array([item[idKey] for item in items
+                               if any(labelPath(label)[:len(path)] == path for label in item[labelKey] or [])], dtype=np.int64))
+
+
+def test_label_tree_equals_scan():
+    """
+    labelTree和projectLabelTree中每个节点(以及不存在的路径)的imageIds, projectIds和childCounts
+    与遍历所有annotation(project)的结果相同.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        arch = Arch(writeArch(os.path.join(root, "arch.json")))
+    anns, pojs = list(arch.anns.values()), list(arch.pojs.values())
+
+    paths = {(), ("建筑类型", "不存在"), ("不存在",)}
+    for item in anns:
+        for label in item["labels"]:
+            path = labelPath(label)
+            paths.update(path[:i] for i in range(1, len(path) + 1))
+
+    for path in sorted(paths):
+        imageIds = bruteIds(anns, "labels", "imageId", path)
+        assert np.array_equal(arch.labelTree.imageIds(path), imageIds), path
+        assert np.array_equal(arch.labelTree.imageIds(" > ".join(path)), imageIds), path
+        assert np.array_equal(arch.labelTree.projectIds(path), bruteIds(anns, "labels", "projectId", path)), path
+        assert np.array_equal(arch.projectLabelTree.projectIds(path), bruteIds(pojs, "projectLabels", "projectId", path)), path
+
+        counts = arch.labelTree.childCounts(path)
+        assert counts == {label: len(bruteIds(anns, "labels", "imageId", path + (label,))) for label in arch.labelTree.children(path)}, path
+        children = {labelPath(label)[len(path)] for item in anns for label in item["labels"]
+                    if labelPath(label)[:len(path)] == path and len(labelPath(label)) > len(path)}
+        assert set(counts) == children, path
+
+
+if __name__ == "__main__":
+    # 生成的数据集, 两层或三层的label
+    test_label_tree_equals_scan()
+    print("label tree == annotation scan")
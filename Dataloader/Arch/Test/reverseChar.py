@@ -0,0 +1,45 @@
+import os
+import tempfile
+from Dataloader.Arch.Test.archData import writeArch
+from Dataloader.Arch.arch import Arch
+from Dataloader.Arch.segmentCache import SegmentCache
+
+FIELDS = ["title", "context", "description", "concateText", "cutConcateText"]
+
+
+def cleaned(path, **kwargs):
+    """加载数据集并调用reverseCharForAllContext, 返回allContext和每个annotation清洗后的字段."""
+    arch = Arch(path)
+    allContext = arch.reverseCharForAllContext(**kwargs)
+    return allContext, [[ann.get(field) for field in FIELDS] for ann in arch.anns.values()]
+
+
+def test_parallel_cached_equals_serial():
+    """
+    多进程, 使用分词缓存(第一次为空, 第二次全部命中)以及cut=False时, reverseCharForAllContext的
+    返回值和annotation中的字段与单进程, 不使用缓存时相同.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        path = writeArch(os.path.join(root, "arch.json"))
+        cachePath = os.path.join(root, "segments.sqlite")
+        expected = cleaned(path)
+
+        assert cleaned(path, workers=2) == expected
+        assert cleaned(path, workers=2, cachePath=cachePath) == expected
+        texts = {text for _, _, _, text, _ in expected[1]}
+        cache = SegmentCache(cachePath)
+        assert len(cache.getMany(list(texts))) == len(texts)
+        cache.close()
+        assert cleaned(path, workers=2, cachePath=cachePath) == expected
+        assert cleaned(path, cachePath=cachePath) == expected
+
+        # without cutting only the cleaned text is stored
+        allContext, fields = cleaned(path, cut=False, workers=2)
+        assert allContext == [text + "\n" for _, _, _, text, _ in expected[1]]
+        assert fields == [values[:4] + [None] for values in expected[1]]
+
+
+if __name__ == "__main__":
+    # 2个进程, 冷缓存和热缓存
+    test_parallel_cached_equals_serial()
+    print("parallel + cached == serial")
@@ -0,0 +1,126 @@
+import io
+import os
+import json
+import tempfile
+from Dataloader.Arch.Test.archData import writeArch
+from Dataloader.Arch.arch import Arch, STREAM_KEYS, _iterJson
+
+INDEXES = ["anns", "imgs", "pojs", "imgToAnns", "pojToImgs", "imgCatToImgs", "pojCatToPojs"]
+
+
+def treeItems(tree):
+    """层级树中每个节点的(路径, imageIds, projectIds), 用于比较两棵树."""
+    items, stack = [], [((), tree.root)]
+    while stack:
+        path, node = stack.pop()
+        items.append((path, node.imageIds.tolist(), node.projectIds.tolist()))
+        stack.extend((path + (label,), child) for label, child in node.children.items())
+    return sorted(items)
+
+
+def assertSameIndex(streamed, loaded):
+    for name in INDEXES:
+        assert getattr(streamed, name) == getattr(loaded, name), name
+    withoutArrays = [{key: value for key, value in arch.dataset.items() if key not in STREAM_KEYS} for arch in [streamed, loaded]]
+    assert withoutArrays[0] == withoutArrays[1]
+    assert treeItems(streamed.labelTree) == treeItems(loaded.labelTree)
+    assert treeItems(streamed.projectLabelTree) == treeItems(loaded.projectLabelTree)
+
+
+def test_streaming_equals_json_load():
+    """
+    边读取边建立的index与json.load之后调用createIndex的结果相同, 包括空数组, 缺少的键, 以及
+    值跨越读取缓冲区边界的情况.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        path = writeArch(os.path.join(root, "arch.json"))
+        assertSameIndex(Arch(path), Arch(path, streaming=False))
+
+        with open(path, encoding="utf-8") as f:
+            dataset = json.load(f)
+        for extra in [{}, {"imageAnnotations": []}, {"projectAnnotations": [], "info": [1.5, -2e3]}]:
+            partial = {"info": dataset["info"], "imageAnnotations": dataset["imageAnnotations"][:20]}
+            partial.update(extra)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(partial, f, ensure_ascii=False, indent=1)
+            assertSameIndex(Arch(path), Arch(path, streaming=False))
+
+    # tiny buffers split every key, string and number
+    with tempfile.TemporaryDirectory() as root:
+        path = writeArch(os.path.join(root, "arch.json"), n=50)
+        with open(path, encoding="utf-8") as f:
+            dataset = json.load(f)
+        for bufferSize in [1, 5, 64]:
+            rebuilt = {key: [] for key in STREAM_KEYS}
+            with open(path, encoding="utf-8") as f:
+                for key, value, isElement in _iterJson(f, STREAM_KEYS, bufferSize=bufferSize):
+                    if isElement:
+                        rebuilt[key].append(value)
+                    elif key not in STREAM_KEYS:
+                        rebuilt[key] = value
+            assert rebuilt == dataset, bufferSize
+
+    text = json.dumps({"info": {"n": 12345}, "images": [{"imageId": 1}, {"imageId": 23}], "x": -0.125, "projectAnnotations": []})
+    for bufferSize in [1, 2, 3, 7]:
+        items = list(_iterJson(io.StringIO(text), STREAM_KEYS, bufferSize=bufferSize))
+        assert items == [("info", {"n": 12345}, False), ("images", {"imageId": 1}, True), ("images", {"imageId": 23}, True),
+                         ("images", None, False), ("x", -0.125, False), ("projectAnnotations", None, False)], bufferSize
+
+
+
+def load(path, streaming):
+    """加载数据集, 返回Arch或者抛出的错误的类型."""
+    try:
+        return Arch(path, streaming=streaming)
+    except Exception as e:
+        return type(e)
+
+
+def test_malformed_files_equal_json_load():
+    """
+    不完整或者格式错误的文件: 两种加载方式得到相同的index, 或者抛出相同类型的错误. 包括没有project的
+    文件, 没有projectId的annotation, 重复的键, 顶层对象之后的内容, 不是对象的顶层, 以及语法错误.
+    """
+    ann = {"annotationId": 1, "imageId": 7, "projectId": 3, "title": "t", "context": None, "description": "d",
+           "labels": [{"label1": "建筑类型", "label2": "文化建筑", "label3": None, "label4": None, "label5": None}]}
+    noProject = {key: value for key, value in ann.items() if key != "projectId"}
+    poj = {"projectId": 3, "projectLabels": [{"label1": "设计风格", "label2": "古典"}]}
+    files = [
+        json.dumps({"imageAnnotations": [ann, dict(noProject, annotationId=2)]}),
+        json.dumps({"imageAnnotations": [ann, dict(noProject, annotationId=2), dict(ann, annotationId=3, projectId=None)],
+                    "projectAnnotations": [poj]}),
+        json.dumps({"imageAnnotations": [noProject], "images": [], "projectAnnotations": []}),
+        '{"info": 1, "images": [{"imageId": 1}], "info": 2}',
+        '{"images": [{"imageId": 1}], "images": [{"imageId": 2}]}',
+        '{"images": [{"imageId": 1}]} \n\t ',
+        '{"images": [{"imageId": 1}]} {}',
+        '{"images": null}',
+        '{"images": [1, 2]}',
+        '{"imageAnnotations": [{"imageId": 1}]}',
+        '{"images": [{"imageId": 1}], }',
+        '{"images": [{"imageId": 1}',
+        '{1: 2}',
+        '\ufeff{}',
+        '[]',
+        '{}',
+        '',
+    ]
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "arch.json")
+        for text in files:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            streamed, loaded = load(path, True), load(path, False)
+            if isinstance(loaded, type):
+                assert streamed is loaded, (text, streamed, loaded)
+            else:
+                assert isinstance(streamed, Arch), (text, streamed)
+                assertSameIndex(streamed, loaded)
+
+
+if __name__ == "__main__":
+    # 生成的数据集, 部分键缺少或为空的数据集, 以及很小的读取缓冲区
+    test_streaming_equals_json_load()
+    # 不完整和格式错误的文件
+    test_malformed_files_equal_json_load()
+    print("streaming index == json.load + createIndex")
@@ -9,8 +9,14 @@ import itertools
 
 import os
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import sys
 
+from Dataloader.Arch.columnar import ArchColumns
+from Dataloader.Arch.labelIndex import LabelIndex
+from Dataloader.Arch.labelTree import LabelTree, labelPath
+from Dataloader.Arch.segmentCache import SegmentCache
+
 PYTHON_VERSION = sys.version_info[0]
 if PYTHON_VERSION == 2:
     from urllib import urlretrieve
@@ -24,28 +30,50 @@ def _isArrayLike(obj):
     return hasattr(obj, '__iter__') and hasattr(obj, '__len__')
 
 
+# top level arrays of the annotation file that are indexed one element at a time
+STREAM_KEYS = ("imageAnnotations", "images", "projectAnnotations")
+
+# characters that can continue a JSON number, a complete value is never followed by one of them
+NUMBER_CHARS = frozenset("0123456789+-.eE")
+
+
 class Arch:
-    def __init__(self, annotationFile=None, imageFolder=None):
+    def __init__(self, annotationFile=None, imageFolder=None, streaming=True):
         """
         Constructor of Architecture dataset helper class for reading and visualizing annotations.
 
         Args:
             annotationFile (str): location of annotation file
             imageFolder (str): location to the folder that hosts images.
+            streaming (bool): 逐条读取"imageAnnotations", "images", "projectAnnotations"并同时建立索引(默认),
+                不保留整个文件的解析树. 为False时使用json.load一次读入整个文件. 两种方式的结果(包括不完整
+                或者格式错误的文件抛出的错误)相同, 参考createIndexStreaming.
         Return:
             None
         """
         # load dataset
         self.dataset,self.anns,self.pojs,self.imgs = dict(),dict(),dict(),dict()
         self.imgToAnns, self.pojToImgs, self.imgCatToImgs, self.pojCatToPojs = defaultdict(list),defaultdict(list),defaultdict(list),defaultdict(list)
-        if not annotationFile == None:
-            print('loading annotations into memory...')
+        self.annoLabelIndex, self.projectLabelIndex = None, None
+        self.labelTree, self.projectLabelTree = LabelTree(), LabelTree()
+        self.columns = None
+        if not annotationFile == None and streaming:
+            print('loading annotations and creating index (streaming)...')
             tic = time.time()
-            dataset = json.load(open(annotationFile, 'r', encoding='utf-8'))
-            assert type(dataset)==dict, 'annotation file format {} not supported'.format(type(dataset))
+            self.createIndexStreaming(annotationFile)
             print('Done (t={:0.2f}s)'.format(time.time()- tic))
-            self.dataset = dataset
-            self.createIndex()
+        elif not annotationFile == None:
+            self.loadIndex(annotationFile)
+
+    def loadIndex(self, annotationFile):
+        """使用json.load一次读入整个文件, 然后调用createIndex."""
+        print('loading annotations into memory...')
+        tic = time.time()
+        dataset = json.load(open(annotationFile, 'r', encoding='utf-8'))
+        assert type(dataset)==dict, 'annotation file format {} not supported'.format(type(dataset))
+        print('Done (t={:0.2f}s)'.format(time.time()- tic))
+        self.dataset = dataset
+        self.createIndex()
 
     def createIndex(self):
         """生成需要的index
@@ -55,18 +83,23 @@ class Arch:
         生成img到project, img到annotation, project到image.
 
         生成根据标注的映射.
+
+        生成label的层级树: labelTree (annotation的labels, 保存imageId和projectId) 和
+        projectLabelTree (project的projectLabels, 保存projectId), 参考labelTree.LabelTree.
         
         """
         # create index
         print('creating index...')
         anns, pojs, imgs = {}, {}, {}
         imgToAnns,pojToImgs,imgCatToImgs,pojCatToPojs = defaultdict(list),defaultdict(list),defaultdict(list),defaultdict(list)
+        labelTree, projectLabelTree = LabelTree(), LabelTree()
         if 'imageAnnotations' in self.dataset:
             for ann in self.dataset['imageAnnotations']:
                 imgToAnns[ann['imageId']].append(ann)
                 anns[ann['annotationId']] = ann
                 for label in self.extractAllLabel(ann["labels"]):
                     imgCatToImgs[label].append(ann['imageId'])
+                self.addToLabelTree(labelTree, ann["labels"], imageId=ann['imageId'], projectId=ann.get('projectId'))
 
         if 'images' in self.dataset:
             for img in self.dataset['images']:
@@ -77,10 +110,13 @@ class Arch:
                 pojs[poj['projectId']] = poj
                 for label in self.extractLastLabel(poj["projectLabels"]):
                     pojCatToPojs[label].append(poj['projectId'])
+                self.addToLabelTree(projectLabelTree, poj["projectLabels"], projectId=poj['projectId'])
 
+        # annotations without a projectId do not belong to any project
         if 'imageAnnotations' in self.dataset and 'projectAnnotations' in self.dataset:
             for ann in self.dataset['imageAnnotations']:
-                pojToImgs[ann['projectId']].append(ann['imageId'])
+                if ann.get('projectId') is not None:
+                    pojToImgs[ann['projectId']].append(ann['imageId'])
 
 
         print('index created!')
@@ -93,6 +129,90 @@ class Arch:
         self.pojCatToPojs = pojCatToPojs
         self.imgs = imgs
         self.pojs = pojs
+        self.annoLabelIndex, self.projectLabelIndex = None, None
+        self.columns = None
+        labelTree.freeze()
+        projectLabelTree.freeze()
+        self.labelTree, self.projectLabelTree = labelTree, projectLabelTree
+
+    def createIndexStreaming(self, annotationFile):
+        """边读取边生成index, 结果与json.load之后调用createIndex相同.
+
+        STREAM_KEYS中的数组逐个元素解析并立即加入index, 解析完的元素只被index引用, 整个文件的解析树
+        和原始文本都不会同时保存在内存中. 其它顶层的值(例如"info")保存在self.dataset中.
+
+        _iterJson只接受它能够与json.load得到相同结果的文件. 其它情况(JSON语法错误, 顶层不是对象,
+        STREAM_KEYS的值不是数组或者出现了两次, 顶层对象之后还有内容)时抛出ValueError, 这里改用
+        loadIndex(json.load + createIndex)重新加载, 所以结果(包括抛出的错误)总是与streaming=False相同.
+
+        Args:
+            annotationFile: 标注文件的位置.
+        """
+        anns, pojs, imgs = {}, {}, {}
+        imgToAnns,pojToImgs,imgCatToImgs,pojCatToPojs = defaultdict(list),defaultdict(list),defaultdict(list),defaultdict(list)
+        labelTree, projectLabelTree = LabelTree(), LabelTree()
+        dataset = {}
+
+        try:
+            with open(annotationFile, 'r', encoding='utf-8') as f:
+                for key, value, isElement in _iterJson(f, STREAM_KEYS):
+                    if not isElement:
+                        dataset[key] = value
+                    elif key == 'imageAnnotations':
+                        imgToAnns[value['imageId']].append(value)
+                        anns[value['annotationId']] = value
+                        for label in self.extractAllLabel(value["labels"]):
+                            imgCatToImgs[label].append(value['imageId'])
+                        # only kept when the file has projects, see below
+                        if value.get('projectId') is not None:
+                            pojToImgs[value['projectId']].append(value['imageId'])
+                        self.addToLabelTree(labelTree, value["labels"], imageId=value['imageId'], projectId=value.get('projectId'))
+                    elif key == 'images':
+                        imgs[value['imageId']] = value
+                    else:
+                        pojs[value['projectId']] = value
+                        for label in self.extractLastLabel(value["projectLabels"]):
+                            pojCatToPojs[label].append(value['projectId'])
+                        self.addToLabelTree(projectLabelTree, value["projectLabels"], projectId=value['projectId'])
+        except ValueError as e:
+            print('streaming failed ({}), falling back to json.load'.format(e))
+            self.loadIndex(annotationFile)
+            return
+
+        # keys present in the file, as createIndex checks them
+        streamed = {key for key in STREAM_KEYS if key in dataset}
+        if not ('imageAnnotations' in streamed and 'projectAnnotations' in streamed):
+            pojToImgs = defaultdict(list)
+
+        # create class members, the raw arrays are not kept
+        self.dataset = {key: value for key, value in dataset.items() if key not in STREAM_KEYS}
+        self.anns = anns
+        self.imgToAnns = imgToAnns
+        self.pojToImgs = pojToImgs
+        self.imgCatToImgs = imgCatToImgs
+        self.pojCatToPojs = pojCatToPojs
+        self.imgs = imgs
+        self.pojs = pojs
+        self.annoLabelIndex, self.projectLabelIndex = None, None
+        self.columns = None
+        labelTree.freeze()
+        projectLabelTree.freeze()
+        self.labelTree, self.projectLabelTree = labelTree, projectLabelTree
+
+    def addToLabelTree(self, tree, labels, imageId=None, projectId=None):
+        """把一条标注的每个label路径(label1 > label2 > ...)加入层级树.
+
+        Args:
+            tree: LabelTree.
+            labels: label数据, 格式与extractAllLabel相同, 可以为None.
+            imageId, projectId: 需要记录在路径上每个节点中的id.
+        """
+        if labels is None:
+            return
+        for label in labels:
+            path = labelPath(label)
+            if len(path) != 0:
+                tree.add(path, imageId=imageId, projectId=projectId)
 
     def extractLastLabel(self, labels):
         """获得最后的一个label
@@ -169,68 +289,120 @@ class Arch:
                         continue
         return lastLabels
 
-    def filterAnnoLabel(self, targetString):
+    def filterAnnoLabel(self, targetString, merge=False):
         """过滤需要的label, 只要包含都提取出来
 
+        使用label的字符n-gram索引(LabelIndex), 只检查候选的label. 索引在第一次调用时建立.
+
         Args:
             targetString: 要用作搜索的String
+            merge: 为True时把所有匹配的label的img合并为一个数组
 
         Return:
-            所有包含这一标签的img.
+            所有包含这一标签的img: {label: 排好序的不重复imageId数组}, merge为True时为一个
+            排好序的不重复imageId数组.
         """
-        result = {}
-        for cat, imgs in self.imgCatToImgs.items():
-            if targetString in cat:
-                result[cat] = imgs
-        return result
+        if self.annoLabelIndex is None:
+            self.annoLabelIndex = LabelIndex(self.imgCatToImgs)
+        if merge:
+            return self.annoLabelIndex.filterIds(targetString)
+        return self.annoLabelIndex.filter(targetString)
     
 
-    def filterProjectLabel(self, targetString):
+    def filterProjectLabel(self, targetString, merge=False):
         """过滤需要的label, 只要包含都提取出来
 
+        使用label的字符n-gram索引(LabelIndex), 只检查候选的label. 索引在第一次调用时建立.
+
         Args:
             targetString: 要用作搜索的String
+            merge: 为True时把所有匹配的label的project合并为一个数组
 
         Return:
-            所有包含这一标签的project.
+            所有包含这一标签的project: {label: 排好序的不重复projectId数组}, merge为True时为一个
+            排好序的不重复projectId数组.
         """
-        result = {}
-        for cat, projects in self.pojCatToPojs.items():
-            if targetString in cat:
-                result[cat] = projects
-        return result
+        if self.projectLabelIndex is None:
+            self.projectLabelIndex = LabelIndex(self.pojCatToPojs)
+        if merge:
+            return self.projectLabelIndex.filterIds(targetString)
+        return self.projectLabelIndex.filter(targetString)
 
-    def reverseCharForAllContext(self):
+    def toColumnar(self):
+        """
+        把annotation的id, 派生的文本以及imgToAnns, pojToImgs, imgCatToImgs, pojCatToPojs转换为列式表示
+        (参考columnar.ArchColumns), 保存为self.columns. 在reverseCharForAllContext之后调用.
+
+        之后这四个对应关系是ArchColumns中只读的CsrRelation(访问方式与原来的字典相同), 原来的defaultdict
+        被释放; concateText和cutConcateText只保存在self.columns中(texts, tokens), 从anns中删除. anns中
+        的其它字段不变. 再次调用reverseCharForAllContext不会更新self.columns.
+
+        Return:
+            ArchColumns
+        """
+        columns = ArchColumns(self)
+        for ann in self.anns.values():
+            if columns.texts is not None:
+                del ann["concateText"]
+            if columns.tokens is not None:
+                del ann["cutConcateText"]
+
+        self.imgToAnns = columns.imgToAnns
+        self.pojToImgs = columns.pojToImgs
+        self.imgCatToImgs = columns.imgCatToImgs
+        self.pojCatToPojs = columns.pojCatToPojs
+        self.columns = columns
+        return columns
+
+    def reverseCharForAllContext(self, cut=True, workers=1, cachePath=None):
         """
         remove all character except english, chinese for "title", "context", "description".
         Store the concate text into dataset.
 
+        Args:
+            cut: 是否使用jieba对拼接后的文本分词(cutConcateText). 从索引快照加载模型时不需要分词,
+                设为False可以跳过最耗时的分词步骤.
+            workers: 清洗和分词使用的进程数, 默认为1(单进程), None为CPU的数量. annotation按顺序
+                切分后在ProcessPoolExecutor中处理, 结果与单进程完全相同.
+            cachePath: 分词缓存(sqlite文件, 参考segmentCache.SegmentCache)的位置, 默认为None(不使用).
+                清洗后相同的文本只分词一次, 使用缓存时上一次运行已经分过的文本也不再分词.
+
         Return:
             allContext
         """
-        allContext = []
-        cop = re.compile("[^\u4e00-\u9fa5^a-z^A-Z]")
-
-        for k, v in self.anns.items():
-            titleRawText = v["title"] if v["title"] is not None else ""
-            contextRawText = v["context"] if v["context"] is not None else ""
-            descriptionRawText = v["description"] if v["description"] is not None else ""
-
-            titleCleanText = cop.sub(" ", titleRawText)
-            contextCleanText = cop.sub(" ", contextRawText)
-            descriptionCleanText = cop.sub(" ", descriptionRawText)
-
-            v["title"] = " ".join(titleCleanText.split())
-            v["context"] = " ".join(contextCleanText.split())
-            v["description"] = " ".join(descriptionCleanText.split())
+        rawTexts = [(v["title"], v["context"], v["description"]) for v in self.anns.values()]
+
+        workers = os.cpu_count() if workers is None else workers
+        cleanTexts = _mapChunks(_cleanContext, rawTexts, workers)
+
+        # segment every distinct text once: the cache first, then the process pool
+        segments = {}
+        if cut:
+            texts = list(dict.fromkeys(concateText for _, _, _, concateText in cleanTexts))
+            cache = SegmentCache(cachePath) if cachePath is not None else None
+            if cache is not None:
+                segments = cache.getMany(texts)
+                texts = [text for text in texts if text not in segments]
+
+            newSegments = _mapChunks(_cutTexts, texts, workers)
+            segments.update(zip(texts, newSegments))
+            if cache is not None:
+                cache.putMany(zip(texts, newSegments))
+                cache.close()
 
-            concateText = " ".join((titleCleanText+" "+contextCleanText+" "+descriptionCleanText+"\n").split())
+        allContext = []
+        for v, (title, context, description, concateText) in zip(self.anns.values(), cleanTexts):
+            v["title"] = title
+            v["context"] = context
+            v["description"] = description
             v["concateText"] = concateText
 
-            # cut all by jieba
-            fileSeg = jieba.cut(concateText, cut_all=True)
-            fileSeg = list(fileSeg)
-            
+            if not cut:
+                allContext.append(concateText + "\n")
+                continue
+
+            # every annotation owns its token list
+            fileSeg = list(segments[concateText])
             v["cutConcateText"] = fileSeg
             fileSeg.append("\n")
                 
@@ -239,6 +411,162 @@ class Arch:
         return allContext
 
 
+def _mapChunks(function, items, workers, *args):
+    """
+    按顺序把items切分为若干块, 在ProcessPoolExecutor中对每一块调用function(chunk, *args), 并按顺序
+    拼接结果. workers不超过1时直接在当前进程中调用.
+    """
+    if workers <= 1 or len(items) <= 1:
+        return function(items, *args)
+
+    chunkSize = -(-len(items) // (workers * 4))
+    chunks = [items[i:i + chunkSize] for i in range(0, len(items), chunkSize)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(itertools.chain.from_iterable(
+            executor.map(function, chunks, *[itertools.repeat(arg) for arg in args])))
+
+
+def _cutTexts(texts):
+    """使用jieba的全模式对一组文本分词, 定义在模块级别, 可以在子进程中执行."""
+    return [list(jieba.cut(text, cut_all=True)) for text in texts]
+
+
+def _iterJson(f, streamKeys, bufferSize=1 << 20):
+    """
+    增量解析一个顶层为JSON对象的文件, 使用json.JSONDecoder.raw_decode每次只解析一个值.
+
+    json.load在一次解析中会复用相同的键字符串, raw_decode每次调用都会重新创建, 所以这里用
+    object_pairs_hook让所有对象共享同一份键字符串, 否则几十万个标注的键会占用大量内存.
+
+    Args:
+        f: 以文本模式打开的文件.
+        streamKeys: 需要逐个元素返回的顶层数组的键.
+        bufferSize: 每次读取的字符数, 单个值比缓冲区大时缓冲区会自动变大.
+
+    Return:
+        生成器, 依次返回(key, value, isElement):
+            streamKeys中的数组: 每个元素返回一次, isElement为True. 数组本身(包括空数组)在结束时以
+                (key, None, False)返回一次, 表示这个键存在.
+            其它的键: 整个值返回一次, isElement为False. 重复的键依次返回, 最后一个有效(与json.load相同).
+
+    Raise:
+        ValueError: 不是合法的JSON(json.JSONDecodeError), 顶层不是对象, streamKeys中的键的值不是数组
+            或者出现了两次(json.load只保留最后一个, 已经返回的元素无法撤回), 或者顶层对象之后还有内容.
+    """
+    keys = {}
+    decoder = json.JSONDecoder(object_pairs_hook=lambda pairs: {keys.setdefault(k, k): v for k, v in pairs})
+    whitespace = re.compile(r"[ \t\n\r]*")
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        # keep the unparsed tail and read at least as much again, so large values stay linear
+        nonlocal buf, pos, eof
+        chunk = f.read(max(bufferSize, len(buf) - pos))
+        buf, pos, eof = buf[pos:] + chunk, 0, chunk == ""
+
+    def take(expected):
+        nonlocal pos
+        while True:
+            pos = whitespace.match(buf, pos).end()
+            if pos < len(buf) or eof:
+                break
+            fill()
+        char = buf[pos] if pos < len(buf) else ""
+        if char == "" or char not in expected:
+            raise ValueError("annotation file: expected {!r} but got {!r}".format(expected, char))
+        pos += 1
+        return char
+
+    def decode():
+        nonlocal pos
+        while True:
+            pos = whitespace.match(buf, pos).end()
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # a number may continue in the next chunk, "1." or "1e" decodes as 1 before the end
+                if eof or (end < len(buf) and buf[end] not in NUMBER_CHARS):
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+
+    def finish():
+        # json.load rejects anything but whitespace after the top level object
+        nonlocal pos
+        while True:
+            pos = whitespace.match(buf, pos).end()
+            if pos < len(buf):
+                raise ValueError("annotation file: extra data after the top level object")
+            if eof:
+                return
+            fill()
+
+    take("{")
+    if take('"}') == "}":
+        finish()
+        return
+    pos -= 1
+    streamed = set()
+    while True:
+        key = decode()
+        if not isinstance(key, str):
+            raise ValueError("annotation file: expected a string key but got {!r}".format(key))
+        take(":")
+        if key in streamKeys:
+            if key in streamed:
+                raise ValueError("annotation file: duplicate key {!r}".format(key))
+            streamed.add(key)
+            take("[")
+            if take("]{[\"-0123456789tfn") != "]":
+                pos -= 1
+                while True:
+                    yield key, decode(), True
+                    if take(",]") == "]":
+                        break
+            yield key, None, False
+        else:
+            yield key, decode(), False
+        if take(",}") == "}":
+            finish()
+            return
+
+
+def _cleanContext(rawTexts):
+    """
+    清洗一组annotation的"title", "context", "description", 供reverseCharForAllContext使用. 分词在
+    去重之后由_cutTexts完成.
+
+    定义在模块级别, 可以在ProcessPoolExecutor的子进程中执行.
+
+    Args:
+        rawTexts: (title, context, description)组成的列表, 值可以为None.
+
+    Return:
+        (title, context, description, concateText)组成的列表.
+    """
+    result = []
+    cop = re.compile("[^\u4e00-\u9fa5^a-z^A-Z]")
+
+    for titleRawText, contextRawText, descriptionRawText in rawTexts:
+        titleRawText = titleRawText if titleRawText is not None else ""
+        contextRawText = contextRawText if contextRawText is not None else ""
+        descriptionRawText = descriptionRawText if descriptionRawText is not None else ""
+
+        titleCleanText = cop.sub(" ", titleRawText)
+        contextCleanText = cop.sub(" ", contextRawText)
+        descriptionCleanText = cop.sub(" ", descriptionRawText)
+
+        concateText = " ".join((titleCleanText+" "+contextCleanText+" "+descriptionCleanText+"\n").split())
+
+        result.append((" ".join(titleCleanText.split()),
+                       " ".join(contextCleanText.split()),
+                       " ".join(descriptionCleanText.split()),
+                       concateText))
+    return result
+
+
 # Test
 if __name__ == "__main__":
     # how to use
@@ -0,0 +1,300 @@
+from collections.abc import Mapping, Sequence
+import numpy as np
+
+
+def idArray(ids):
+    """
+    id组成的numpy数组. id都是int时为int64数组, 其它的id(例如字符串或者None的projectId)为object数组.
+    """
+    ids = list(ids)
+    if all(isinstance(i, (int, np.integer)) for i in ids):
+        return np.array(ids, dtype=np.int64)
+    array = np.empty(len(ids), dtype=object)
+    array[:] = ids
+    return array
+
+
+class IdLookup:
+    def __init__(self, ids):
+        """
+        id到行号的查找表. id都是int时使用排好序的int64数组和np.searchsorted(可以按数组批量查找),
+        否则使用字典.
+
+        Args:
+            ids: 每一行的id, 为numpy数组(参考idArray), 不能重复.
+        """
+        self.isInt = ids.dtype == np.int64
+        if self.isInt:
+            self.order = np.argsort(ids, kind="stable")
+            self.sortedIds = ids[self.order]
+        else:
+            self.rowOf = {value: row for row, value in enumerate(ids.tolist())}
+
+    def rows(self, ids):
+        """一组id的行号, 为int64数组, 不存在的id为-1."""
+        if not self.isInt:
+            return np.array([self.rowOf.get(value, -1) for value in ids], dtype=np.int64)
+        ids = np.asarray(ids)
+        if ids.dtype.kind not in "iu":
+            return np.array([self.row(value) for value in ids.tolist()], dtype=np.int64)
+        ids = ids.astype(np.int64)
+        if len(self.sortedIds) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.sortedIds, ids), len(self.sortedIds) - 1)
+        return np.where(self.sortedIds[pos] == ids, self.order[pos], -1)
+
+    def row(self, value):
+        """一个id的行号, 不存在时为-1."""
+        if not self.isInt:
+            try:
+                return self.rowOf.get(value, -1)
+            except TypeError:
+                return -1
+        if not isinstance(value, (int, np.integer)):
+            return -1
+        pos = int(np.searchsorted(self.sortedIds, value))
+        if pos < len(self.sortedIds) and self.sortedIds[pos] == value:
+            return int(self.order[pos])
+        return -1
+
+
+class StringTable:
+    def __init__(self):
+        """
+        字符串表: 相同的字符串只保存一次, 其它地方只保存int32编号. None的编号为-1.
+
+        建立时使用intern(s)得到编号, 之后调用freeze(). compact为True时所有字符串被编码为一整块UTF-8
+        字节, 每个字符串只占用一个偏移量, 不再是独立的Python对象(适合几乎不重复的长文本); 为False时
+        保留每个不重复的字符串(适合重复很多, 读取频繁的词).
+        """
+        self.codes = {}
+        self.strings = []
+        self.blob = None
+        self.offsets = None
+
+    def intern(self, s):
+        """返回字符串s的编号, 第一次出现时加入字符串表."""
+        if s is None:
+            return -1
+        code = self.codes.get(s)
+        if code is None:
+            code = self.codes[s] = len(self.strings)
+            self.strings.append(s)
+        return code
+
+    def freeze(self, compact=True):
+        """释放建立时使用的字典, compact为True时把字符串编码为一整块UTF-8字节."""
+        if compact:
+            encoded = [s.encode("utf-8") for s in self.strings]
+            self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(b) for b in encoded], out=self.offsets[1:])
+            self.blob = b"".join(encoded)
+            self.strings = None
+        else:
+            self.strings = tuple(self.strings)
+        self.codes = None
+
+    def __len__(self):
+        return len(self.offsets) - 1 if self.blob is not None else len(self.strings)
+
+    def get(self, code):
+        """返回编号对应的字符串, -1为None."""
+        if code < 0:
+            return None
+        if self.blob is None:
+            return self.strings[code]
+        return self.blob[self.offsets[code]:self.offsets[code + 1]].decode("utf-8")
+
+    def getMany(self, codes):
+        """返回一组编号对应的字符串组成的tuple."""
+        if self.blob is None:
+            strings = self.strings
+            return tuple(strings[code] if code >= 0 else None for code in codes.tolist())
+        return tuple(self.get(code) for code in codes.tolist())
+
+    def nbytes(self):
+        """offsets和字节块占用的字节数(compact为False时不包括字符串对象本身)."""
+        return self.offsets.nbytes + len(self.blob) if self.blob is not None else 0
+
+
+class CsrRelation(Mapping):
+    def __init__(self, relation, valueOf=None, wrap=None):
+        """
+        只读的 key -> [value, ...] 对应关系, 保存为CSR格式的邻接数组, 用来代替Arch中的defaultdict(list).
+
+        key按原来字典的顺序保存, 每个key的value保持原来的顺序. 与defaultdict(list)相同, 不存在的key
+        返回空的结果(但是不会加入这个key).
+
+        Args:
+            relation: key到value列表的字典, 例如Arch.pojToImgs.
+            valueOf: 保存value之前的转换, 例如imgToAnns保存annotation的annotationId, 默认不转换.
+            wrap: 读取时对一个key的value数组的转换, 例如把annotationId转换回annotation, 默认直接返回
+                只读的numpy数组.
+        """
+        self.keyArray = idArray(relation)
+        self.lookup = IdLookup(self.keyArray)
+        self.offsets = np.zeros(len(self.keyArray) + 1, dtype=np.int64)
+        np.cumsum([len(values) for values in relation.values()], out=self.offsets[1:])
+        self.valueArray = idArray(value if valueOf is None else valueOf(value)
+                               for values in relation.values() for value in values)
+        self.valueArray.flags.writeable = False
+        self.wrap = wrap
+
+    def __getitem__(self, key):
+        row = self.lookup.row(key)
+        values = self.valueArray[self.offsets[row]:self.offsets[row + 1]] if row >= 0 else self.valueArray[:0]
+        return values if self.wrap is None else self.wrap(values)
+
+    def __contains__(self, key):
+        return self.lookup.row(key) >= 0
+
+    def __iter__(self):
+        return iter(self.keyArray.tolist())
+
+    def __len__(self):
+        return len(self.keyArray)
+
+    def nbytes(self):
+        """keys, offsets和values数组占用的字节数(object数组只计算指针)."""
+        return self.keyArray.nbytes + self.offsets.nbytes + self.valueArray.nbytes
+
+
+class TextColumn(Sequence):
+    def __init__(self, table, codes):
+        """
+        只读的文本序列, 第i个元素为第i行的文本(字符串表中的编号为codes[i]), 读取时才解码.
+
+        Args:
+            table: StringTable.
+            codes: 每一行文本的编号, 为int32数组.
+        """
+        self.table = table
+        self.codes = codes
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.table.get(code) for code in self.codes[i].tolist()]
+        return self.table.get(int(self.codes[i]))
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class TokenColumn(Sequence):
+    def __init__(self, table, offsets, codes):
+        """
+        只读的分词结果序列, 第i个元素为第i行的词组成的tuple, 保存为CSR格式的词编号.
+
+        Args:
+            table: 词的StringTable.
+            offsets: 第i行的词为 codes[offsets[i]:offsets[i+1]].
+            codes: 所有行的词在字符串表中的编号, 为int32数组.
+        """
+        self.table = table
+        self.offsets = offsets
+        self.codes = codes
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[row] for row in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("row {} out of range".format(i))
+        return self.table.getMany(self.codes[self.offsets[i]:self.offsets[i + 1]])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+class ArchColumns:
+    def __init__(self, arch):
+        """
+        Arch的列式(columnar)表示, 由Arch.toColumnar()生成, 之后Arch的对应关系和派生的文本从这里读取.
+
+        每一个annotation是若干个numpy数组中的一行(行的顺序与Arch.anns相同), 而不是字典中的字段:
+
+            annIds, annImageIds, annProjectIds: 每个annotation的id, 所属的image和project(参考idArray,
+                没有projectId时为None)
+            texts: reverseCharForAllContext拼接的文本(concateText), 保存为字符串表中的int32编号
+            tokens: cutConcateText的词, 保存为词表中的int32编号(CSR格式), 没有分词时为None
+
+        Arch中defaultdict(list)的对应关系保存为CSR格式的邻接数组(CsrRelation), 访问方式与原来的字典相同:
+
+            ArchColumns.imgToAnns[imageId]          image中的annotation(字典)
+            ArchColumns.pojToImgs[projectId]        project中annotation的imageId(可能重复)
+            ArchColumns.imgCatToImgs[label]         带有这个label的annotation的imageId
+            ArchColumns.pojCatToPojs[label]         带有这个label的projectId
+
+        以及按行号或者id数组批量查询的:
+
+            ArchColumns.annRows(annIds)             annotationId在列中的行号
+            ArchColumns.imageIdsOf(annIds)          annotation所属的imageId
+            ArchColumns.projectIdsOf(annIds)        annotation所属的projectId
+            ArchColumns.texts                       每一行的concateText, 只读序列(TextColumn)
+            ArchColumns.tokens                      每一行的cutConcateText, 只读序列(TokenColumn), 没有分词时为None
+
+        Input:
+            arch: 已经建立好index的Arch, 调用过reverseCharForAllContext时同时保存拼接和分好词的文本.
+                只读取anns中的id, concateText和cutConcateText字段以及上面几个对应关系, 其它字段
+                (例如title, labels)仍然保存在Arch.anns中.
+        """
+        anns = list(arch.anns.values())
+
+        # annotation columns, rows in the order of Arch.anns
+        self.annIds = idArray(ann["annotationId"] for ann in anns)
+        self.annImageIds = idArray(ann["imageId"] for ann in anns)
+        self.annProjectIds = idArray(ann.get("projectId") for ann in anns)
+        self.annLookup = IdLookup(self.annIds)
+
+        # texts are nearly unique, tokens repeat: one compact table each
+        self.textTable, self.tokenTable = StringTable(), StringTable()
+        self.texts, self.tokens = None, None
+        if all("concateText" in ann for ann in anns):
+            codes = np.array([self.textTable.intern(ann["concateText"]) for ann in anns], dtype=np.int32)
+            self.texts = TextColumn(self.textTable, codes)
+        if all("cutConcateText" in ann for ann in anns):
+            offsets = np.zeros(len(anns) + 1, dtype=np.int64)
+            np.cumsum([len(ann["cutConcateText"]) for ann in anns], out=offsets[1:])
+            codes = np.array([self.tokenTable.intern(token) for ann in anns for token in ann["cutConcateText"]],
+                             dtype=np.int32)
+            self.tokens = TokenColumn(self.tokenTable, offsets, codes)
+        self.textTable.freeze(compact=True)
+        self.tokenTable.freeze(compact=False)
+
+        # relations, annotations are stored by annotationId and read back from Arch.anns
+        archAnns = arch.anns
+        self.imgToAnns = CsrRelation(arch.imgToAnns, valueOf=lambda ann: ann["annotationId"],
+                                     wrap=lambda annIds: [archAnns[annId] for annId in annIds.tolist()])
+        self.pojToImgs = CsrRelation(arch.pojToImgs)
+        self.imgCatToImgs = CsrRelation(arch.imgCatToImgs)
+        self.pojCatToPojs = CsrRelation(arch.pojCatToPojs)
+
+    # ------------------Bulk lookups by id arrays---------------------
+
+    def annRows(self, annIds):
+        """annotationId(数组)在列中的行号, 不存在的id会抛出KeyError."""
+        rows = self.annLookup.rows(annIds)
+        if np.any(rows < 0):
+            raise KeyError("annotationId not found")
+        return rows
+
+    def imageIdsOf(self, annIds):
+        """annotation所属的imageId, 为numpy数组."""
+        return self.annImageIds[self.annRows(annIds)]
+
+    def projectIdsOf(self, annIds):
+        """annotation所属的projectId, 为numpy数组."""
+        return self.annProjectIds[self.annRows(annIds)]
+
+    def nbytes(self):
+        """所有数组和文本字节块占用的字节数(不包括词表中不重复的词)."""
+        arrays = [self.annIds, self.annImageIds, self.annProjectIds]
+        if self.annLookup.isInt:
+            arrays += [self.annLookup.order, self.annLookup.sortedIds]
+        if self.texts is not None:
+            arrays.append(self.texts.codes)
+        if self.tokens is not None:
+            arrays += [self.tokens.offsets, self.tokens.codes]
+        relations = [self.imgToAnns, self.pojToImgs, self.imgCatToImgs, self.pojCatToPojs]
+        return sum(a.nbytes for a in arrays) + self.textTable.nbytes() + sum(r.nbytes() for r in relations)
@@ -0,0 +1,109 @@
+import os
+import logging
+import threading
+
+from Dataloader.Arch.arch import Arch
+from Dataloader.Arch.facets import FacetIndex
+from Dataloader.Arch.segmentCache import tokenizerConfig
+
+logger = logging.getLogger(__name__)
+
+# process-wide prepared corpora, key -> ArchCorpus
+_corpora = {}
+_lock = threading.Lock()
+
+
+class ArchCorpus:
+    def __init__(self, archPath, cut=True, workers=1, cachePath=None):
+        """
+        加载并预处理好的Arch语料, 由getCorpus在同一个进程中的所有模型之间共享.
+
+            archDataset: 已经调用过reverseCharForAllContext和toColumnar的Arch
+            columns: archDataset.columns, 文档的id, 文本和对应关系的列式表示(参考columnar.ArchColumns)
+            annIdList: 每个文档的annotationId, 为tuple
+            corporaList: 每个文档分好词的文本(cutConcateText), 为只读序列(columns.tokens, 每个元素是tuple),
+                cut为False时为None
+            notCutCorporaList: 每个文档未分词的文本(concateText), 为只读序列(columns.texts)
+            facets: 文档的过滤条件和折叠使用的group数组, 参考facets.FacetIndex
+            workers, cachePath: 加载时使用的分词进程数和分词缓存
+
+        第i个文档是columns的第i行. 分好词和未分词的文本只保存在columns中(词和文本为int32编号), 不再是
+        每个文档一个Python对象, annotation的字典中也不再有concateText和cutConcateText. annIdList是tuple,
+        corporaList和notCutCorporaList是只读的序列, 都不能被修改. archDataset中的对应关系(imgToAnns等)
+        是只读的CsrRelation; anns和imgs仍然是普通的dict, 模型只能读取, 不能修改, 否则会影响共享这个语料
+        的其它模型.
+
+        Args:
+            archPath: archtectureDataset的数据位置.
+            cut: 是否分词, 参考Arch.reverseCharForAllContext.
+            workers: 分词使用的进程数.
+            cachePath: 分词缓存的位置.
+        """
+        self.archPath = archPath
+        self.cut = cut
+        self.workers = workers
+        self.cachePath = cachePath
+        self.archDataset = Arch(annotationFile=archPath)
+        self.archDataset.reverseCharForAllContext(cut=cut, workers=workers, cachePath=cachePath)
+
+        # the texts move into read-only columns, shared by the dataset and every model
+        self.columns = self.archDataset.toColumnar()
+        self.annIdList = tuple(self.columns.annIds.tolist())
+        self.corporaList = self.columns.tokens if cut else None
+        self.notCutCorporaList = self.columns.texts
+        self.facets = FacetIndex(self.archDataset, self.annIdList)
+
+
+def corpusKey(archPath, cut=True):
+    """
+    语料在注册表中的键: 数据集的绝对路径, 文件的修改时间和大小(文件改变后重新加载), 以及分词器配置
+    (cut为False时为None).
+    """
+    path = os.path.abspath(archPath)
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size, tokenizerConfig() if cut else None
+
+
+def getCorpus(archPath, cut=True, workers=1, cachePath=None):
+    """
+    返回archPath对应的共享语料, 同一个进程中第一次请求时加载和分词, 之后直接返回同一个ArchCorpus.
+
+    cut为False时如果已经有分好词的语料, 直接返回分好词的语料.
+
+    数据集文件改变(修改时间或者大小不同)后重新加载, 同一个文件的旧版本的语料从注册表中删除.
+
+    workers和cachePath只影响加载的速度, 不影响分词的结果, 所以不是键的一部分: 命中时如果与第一次
+    加载时不同, 只记录一条warning日志, 返回已经加载的语料.
+
+    Args:
+        archPath: archtectureDataset的数据位置.
+        cut: 是否需要分好词的文本.
+        workers: 第一次加载时分词使用的进程数, 不影响键.
+        cachePath: 第一次加载时使用的分词缓存, 不影响键.
+
+    Return:
+        ArchCorpus, 只读.
+    """
+    with _lock:
+        keys = [corpusKey(archPath, cut=True)] if cut else [corpusKey(archPath, cut=True), corpusKey(archPath, cut=False)]
+        for key in keys:
+            if key in _corpora:
+                corpus = _corpora[key]
+                if (corpus.workers, corpus.cachePath) != (workers, cachePath):
+                    logger.warning("corpus %s was loaded with workers=%s, cachePath=%s; reusing it for workers=%s, cachePath=%s",
+                                   corpus.archPath, corpus.workers, corpus.cachePath, workers, cachePath)
+                return corpus
+        corpus = ArchCorpus(archPath, cut=cut, workers=workers, cachePath=cachePath)
+
+        # the file changed: drop the corpora of its old versions, models holding them keep working
+        path, mtime, size, _ = keys[-1]
+        for key in [key for key in _corpora if key[0] == path and key[1:3] != (mtime, size)]:
+            del _corpora[key]
+        _corpora[keys[-1]] = corpus
+        return corpus
+
+
+def releaseCorpora():
+    """清空注册表, 已经持有语料的模型不受影响."""
+    with _lock:
+        _corpora.clear()
@@ -0,0 +1,148 @@
+import numpy as np
+
+
+class Facet:
+    def __init__(self, mask):
+        """
+        文档的过滤条件, 保存为长度为N的bool数组(bitset), 第i位表示第i个文档是否被允许.
+
+        过滤条件之间可以用 & (AND), | (OR), ~ (NOT) 和 - (AND NOT) 组合, 例如:
+
+            facets.label("文化建筑") & ~facets.projectLabel("现代主义")
+
+        Facet可以直接作为searchSentence/searchWords的docFilter, 也可以用np.asarray转换为bool数组.
+
+        Args:
+            mask: 长度为N的bool数组.
+        """
+        self.mask = np.asarray(mask, dtype=bool)
+
+    def __and__(self, other):
+        return Facet(self.mask & np.asarray(other, dtype=bool))
+
+    def __or__(self, other):
+        return Facet(self.mask | np.asarray(other, dtype=bool))
+
+    def __sub__(self, other):
+        return Facet(self.mask & ~np.asarray(other, dtype=bool))
+
+    def __invert__(self):
+        return Facet(~self.mask)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.mask if dtype is None else self.mask.astype(dtype)
+
+    def __len__(self):
+        return len(self.mask)
+
+    def count(self):
+        """被允许的文档数量."""
+        return int(np.count_nonzero(self.mask))
+
+    def indices(self):
+        """被允许的文档的位置, 为排好序的numpy数组."""
+        return np.flatnonzero(self.mask)
+
+
+def groupCodes(ids):
+    """
+    把每个文档的id转换为0开始的连续编号, 相同的id编号相同. id可以是任意可以hash的值(不一定是int),
+    为None(例如annotation没有projectId)的文档不属于任何group, 各自使用一个编号.
+
+    Args:
+        ids: 每个文档的id组成的列表.
+
+    Return:
+        长度为N的int32数组.
+    """
+    codes = {}
+    return np.array([codes.setdefault(("doc", i) if value is None else ("id", value), len(codes)) for i, value in enumerate(ids)],
+                    dtype=np.int32)
+
+
+class FacetIndex:
+    def __init__(self, arch, annIdList):
+        """
+        根据Arch的对应关系生成文档的过滤条件(Facet), 文档的顺序为annIdList.
+
+            FacetIndex.label(label)             imgCatToImgs[label]中的image的文档
+            FacetIndex.projectLabel(label)      pojCatToPojs[label]中的project(通过pojToImgs)的文档
+            FacetIndex.project(projectId)       pojToImgs[projectId]中的image的文档
+            FacetIndex.labelPath(path)          labelTree中path子树的image的文档, 例如 "建筑类型 > 文化建筑"
+            FacetIndex.all()                    所有的文档
+
+        label和projectLabel的bitset在第一次使用时生成并缓存, 之后的查询只是bool数组的位运算.
+
+        同时保存每个文档所属的image和project的编号(0开始的连续int), 用于折叠结果:
+
+            FacetIndex.groups("image")          每个文档的imageId编号
+            FacetIndex.groups("project")        每个文档的projectId编号, 没有projectId的文档各自是一个group
+
+        Args:
+            arch: 已经建立好index的Arch. 调用过toColumnar时从arch.columns批量读取文档的id.
+            annIdList: 模型中文档对应的annotationId, 第i个文档为annIdList[i].
+        """
+        self.arch = arch
+        self.N = len(annIdList)
+        if arch.columns is not None:
+            # bulk lookups in the columns, see Arch.toColumnar
+            rows = arch.columns.annRows(annIdList)
+            self.docImageIds = arch.columns.annImageIds[rows].astype(np.int64)
+            projectIds = arch.columns.annProjectIds[rows].tolist()
+        else:
+            self.docImageIds = np.array([arch.anns[annId]["imageId"] for annId in annIdList], dtype=np.int64)
+            projectIds = [arch.anns[annId].get("projectId") for annId in annIdList]
+        self.imageGroups = np.unique(self.docImageIds, return_inverse=True)[1].astype(np.int32)
+        self.projectGroups = groupCodes(projectIds)
+        self.labelCache = {}
+        self.projectLabelCache = {}
+
+    def imagesFacet(self, imageIds):
+        """imageId在imageIds中的文档."""
+        imageIds = np.unique(np.asarray(imageIds, dtype=np.int64))
+        return Facet(np.isin(self.docImageIds, imageIds, assume_unique=False))
+
+    def groups(self, collapse):
+        """
+        折叠结果使用的group数组.
+
+        Args:
+            collapse: "image", "project" 或者 None(不折叠).
+
+        Return:
+            长度为N的int32数组, collapse为None时返回None.
+        """
+        if collapse is None:
+            return None
+        if collapse == "image":
+            return self.imageGroups
+        if collapse == "project":
+            return self.projectGroups
+        raise ValueError("collapse {} not supported, use 'image' or 'project'".format(collapse))
+
+    def all(self):
+        return Facet(np.ones(self.N, dtype=bool))
+
+    def label(self, label):
+        """带有这个label(任意层级)的image的文档."""
+        facet = self.labelCache.get(label)
+        if facet is None:
+            facet = self.labelCache[label] = self.imagesFacet(self.arch.imgCatToImgs.get(label, []))
+        return facet
+
+    def projectLabel(self, label):
+        """带有这个projectLabel的project中的image的文档."""
+        facet = self.projectLabelCache.get(label)
+        if facet is None:
+            imageIds = [imageId for projectId in self.arch.pojCatToPojs.get(label, [])
+                        for imageId in self.arch.pojToImgs.get(projectId, [])]
+            facet = self.projectLabelCache[label] = self.imagesFacet(imageIds)
+        return facet
+
+    def project(self, projectId):
+        """属于这个project的image的文档."""
+        return self.imagesFacet(self.arch.pojToImgs.get(projectId, []))
+
+    def labelPath(self, path):
+        """labelTree中path子树的image的文档, path参考LabelTree.splitPath."""
+        return self.imagesFacet(self.arch.labelTree.imageIds(path))
@@ -0,0 +1,80 @@
+import numpy as np
+
+
+class LabelIndex:
+    def __init__(self, labelToIds):
+        """
+        label的子串查询索引(字符n-gram, n为1和2).
+
+        每个字和每两个相邻的字(bigram)记录包含它的label编号. 查询时只取出查询串中所有bigram都出现的
+        label作为候选, 再用 targetString in label 确认, 不需要遍历所有的label.
+
+            LabelIndex.search(targetString)       包含targetString的label编号
+            LabelIndex.filter(targetString)       {label: 排好序的不重复id数组}
+            LabelIndex.filterIds(targetString)    所有匹配label的id合并后排好序的不重复id数组
+
+        Args:
+            labelToIds: label到id列表的字典, 例如Arch.imgCatToImgs. 结果中label的顺序与字典相同.
+        """
+        self.labels = list(labelToIds)
+        self.ids = [np.unique(np.asarray(ids)) for ids in labelToIds.values()]
+
+        grams = {}
+        for code, label in enumerate(self.labels):
+            for gram in set(label) | {label[i:i + 2] for i in range(len(label) - 1)}:
+                grams.setdefault(gram, []).append(code)
+        self.grams = {gram: np.array(codes, dtype=np.int64) for gram, codes in grams.items()}
+
+    def search(self, targetString):
+        """
+        包含targetString的label编号, 按label在字典中的顺序.
+
+        Args:
+            targetString: 要用作搜索的String, 空字符串匹配所有的label.
+
+        Return:
+            label编号, 为numpy数组.
+        """
+        if len(targetString) == 0:
+            return np.arange(len(self.labels))
+        if len(targetString) == 1:
+            return self.grams.get(targetString, np.zeros(0, dtype=np.int64))
+
+        # intersect the shortest postings first
+        postings = []
+        for gram in {targetString[i:i + 2] for i in range(len(targetString) - 1)}:
+            if gram not in self.grams:
+                return np.zeros(0, dtype=np.int64)
+            postings.append(self.grams[gram])
+        postings.sort(key=len)
+        candidates = postings[0]
+        for posting in postings[1:]:
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+            if len(candidates) == 0:
+                return candidates
+
+        # bigrams of a longer string may appear in a different order
+        if len(targetString) == 2:
+            return candidates
+        return np.array([code for code in candidates.tolist() if targetString in self.labels[code]], dtype=np.int64)
+
+    def filter(self, targetString):
+        """
+        过滤需要的label, 只要包含都提取出来.
+
+        Return:
+            dict{label: 排好序的不重复id数组}
+        """
+        return {self.labels[code]: self.ids[code] for code in self.search(targetString).tolist()}
+
+    def filterIds(self, targetString):
+        """
+        所有包含targetString的label的id, 合并后去重并排序.
+
+        Return:
+            id的numpy数组.
+        """
+        codes = self.search(targetString).tolist()
+        if len(codes) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate([self.ids[code] for code in codes]))
@@ -0,0 +1,139 @@
+import numpy as np
+
+# depth of the label hierarchy: label1 ... label5
+LABEL_LEVELS = 5
+
+
+def labelPath(label):
+    """
+    一条label数据对应的层级路径, 从label1开始, 到第一个为None的层级为止.
+
+    Args:
+        label: {"label1": ..., "label2": ..., ..., "label5": ...}
+
+    Return:
+        label组成的元组, 例如 ("建筑类型", "文化建筑").
+    """
+    path = []
+    for i in range(1, LABEL_LEVELS + 1):
+        labelContent = label.get("label{}".format(i))
+        if labelContent is None:
+            break
+        path.append(labelContent)
+    return tuple(path)
+
+
+def uniqueIds(ids):
+    """
+    排好序的不重复id数组. id都是int时为int64数组; 其它的id(例如字符串的projectId)为object数组,
+    按(类型名, 值)排序.
+    """
+    if all(isinstance(i, (int, np.integer)) for i in ids):
+        return np.unique(np.asarray(ids, dtype=np.int64))
+    return np.array(sorted(set(ids), key=lambda i: (type(i).__name__, i)), dtype=object)
+
+
+class LabelNode:
+    def __init__(self, label, level):
+        self.label = label
+        self.level = level
+        self.children = {}
+        self.imageIds = []
+        self.projectIds = []
+
+
+class LabelTree:
+    def __init__(self):
+        """
+        label1 ... label5 的层级树(trie), 每个节点保存子树中所有的imageId和projectId.
+
+        建立时对每一条label路径调用add, 路径上的每个节点都记录这个id; 全部加入之后调用freeze,
+        每个节点的id被转换为排好序的不重复numpy数组. 查询时不需要再遍历annotation:
+
+            LabelTree.imageIds(path)            子树中所有的imageId
+            LabelTree.projectIds(path)          子树中所有的projectId
+            LabelTree.children(path)            下一层的label
+            LabelTree.childCounts(path)         每个下一层label的子树中imageId(或projectId)的数量
+
+        path可以是label的列表, 例如 ["建筑类型", "文化建筑"], 也可以是用">"分隔的字符串
+        "建筑类型 > 文化建筑". 空路径表示根节点(所有的id).
+        """
+        self.root = LabelNode(None, 0)
+        self.frozen = False
+
+    def add(self, path, imageId=None, projectId=None):
+        """把一个id加入路径上的每个节点(包括根节点)."""
+        node = self.root
+        nodes = [node]
+        for label in path:
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = LabelNode(label, node.level + 1)
+            node = child
+            nodes.append(node)
+        for node in nodes:
+            if imageId is not None:
+                node.imageIds.append(imageId)
+            if projectId is not None:
+                node.projectIds.append(projectId)
+
+    def freeze(self):
+        """把每个节点的id列表转换为排好序的不重复numpy数组(参考uniqueIds)."""
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            node.imageIds = uniqueIds(node.imageIds)
+            node.projectIds = uniqueIds(node.projectIds)
+            stack.extend(node.children.values())
+        self.frozen = True
+
+    @staticmethod
+    def splitPath(path):
+        if isinstance(path, str):
+            return [label.strip() for label in path.split(">") if label.strip()]
+        return list(path)
+
+    def find(self, path):
+        """路径对应的节点, 不存在时返回None."""
+        node = self.root
+        for label in self.splitPath(path):
+            node = node.children.get(label)
+            if node is None:
+                return None
+        return node
+
+    def imageIds(self, path):
+        """子树中所有的imageId, 为排好序的不重复numpy数组, 路径不存在时为空数组."""
+        assert self.frozen, 'call freeze() before querying'
+        node = self.find(path)
+        return node.imageIds if node is not None else np.zeros(0, dtype=np.int64)
+
+    def projectIds(self, path):
+        """子树中所有的projectId, 为排好序的不重复numpy数组, 路径不存在时为空数组."""
+        assert self.frozen, 'call freeze() before querying'
+        node = self.find(path)
+        return node.projectIds if node is not None else np.zeros(0, dtype=np.int64)
+
+    def children(self, path):
+        """下一层的label, 按第一次出现的顺序."""
+        node = self.find(path)
+        return list(node.children) if node is not None else []
+
+    def childCounts(self, path, kind="image"):
+        """
+        每个下一层label的子树中id的数量, 用于分面导航.
+
+        Args:
+            path: 父节点的路径.
+            kind: "image" 统计imageId, "project" 统计projectId.
+
+        Return:
+            dict{下一层label: 数量}
+        """
+        assert self.frozen, 'call freeze() before querying'
+        assert kind in ("image", "project"), 'kind {} not supported'.format(kind)
+        node = self.find(path)
+        if node is None:
+            return {}
+        return {label: len(child.imageIds if kind == "image" else child.projectIds)
+                for label, child in node.children.items()}
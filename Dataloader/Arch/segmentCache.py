@@ -0,0 +1,92 @@
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+
+import jieba
+
+
+def tokenizerConfig(cutAll=True):
+    """
+    分词器的配置, 作为缓存键的一部分. jieba的版本, 词典或者分词模式改变时缓存自动失效.
+
+    Return:
+        描述分词器配置的字符串.
+    """
+    return "jieba {} cut_all={} dictionary={}".format(jieba.__version__, cutAll, jieba.dt.dictionary)
+
+
+class SegmentCache:
+    def __init__(self, path, config=None):
+        """
+        持久化的分词缓存, 保存在一个sqlite文件中.
+
+        键为 sha1(分词器配置 + 清洗后的文本), 值为分好的词. 相同的文本(同一次运行中重复的, 或者上一次
+        运行已经分过的)不会被再次分词.
+
+            SegmentCache.getMany(texts)     返回已经缓存的 {文本: 分好的词}
+            SegmentCache.putMany(pairs)     保存 (文本, 分好的词) 对
+            SegmentCache.close()            关闭数据库
+
+        Args:
+            path: sqlite文件的位置, 所在的目录不存在时自动创建.
+            config: 分词器的配置字符串, 默认为tokenizerConfig().
+        """
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.config = tokenizerConfig() if config is None else config
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS segments (key TEXT PRIMARY KEY, tokens TEXT NOT NULL)")
+        self.db.commit()
+
+    def key(self, text):
+        """文本在当前分词器配置下的缓存键."""
+        return hashlib.sha1((self.config + "\x00" + text).encode("utf-8")).hexdigest()
+
+    def getMany(self, texts, batchSize=500):
+        """
+        查询一组文本的缓存.
+
+        Args:
+            texts: 清洗后的文本, 为Python列表(不需要去重).
+
+        Return:
+            dict{文本: 分好的词(list)}, 只包含已经缓存的文本.
+        """
+        keys = {}
+        for text in texts:
+            keys.setdefault(self.key(text), text)
+        keyList = list(keys)
+
+        result = {}
+        with self.lock:
+            for start in range(0, len(keyList), batchSize):
+                batch = keyList[start:start + batchSize]
+                rows = self.db.execute("SELECT key, tokens FROM segments WHERE key IN ({})".format(",".join("?" * len(batch))),
+                                       batch).fetchall()
+                for key, tokens in rows:
+                    result[keys[key]] = json.loads(tokens)
+        return result
+
+    def putMany(self, pairs):
+        """
+        保存分词结果.
+
+        Args:
+            pairs: (文本, 分好的词) 组成的列表.
+        """
+        rows = [(self.key(text), json.dumps(tokens, ensure_ascii=False)) for text, tokens in pairs]
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO segments (key, tokens) VALUES (?, ?)", rows)
+            self.db.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
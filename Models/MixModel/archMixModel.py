@@ -1,7 +1,8 @@
 import jieba
 import numpy as np
 from numpy.core.records import array
-from Dataloader.Arch.arch import Arch
+from Dataloader.Arch.corpusRegistry import getCorpus
+from utils.Ranking.ranking import topK
 from Models.Bm25LMIR.lmirBm25Model import lmirBm25Model
 from Models.Doc2Vec.doc2vecModel import doc2vecModel
 
@@ -18,17 +19,20 @@ class archMixModel():
             modelWeight: list of model weight[staticModel, featureModel]
     
         """
-        self.archDataset = Arch(annotationFile=archPath)
-        self.archDataset.reverseCharForAllContext()
-
-        # generate annotation and corpora list
-        self.annIdList = []
-        self.corporaList = []
-        self.notCutCorporaList = []
-        for annotation, content in self.archDataset.anns.items():
-            self.annIdList.append(annotation)
-            self.corporaList.append(content["cutConcateText"])
-            self.notCutCorporaList.append(content["concateText"])
+        # the dataset and its tokens are shared with the other models of this process
+        corpus = getCorpus(archPath)
+        self.archDataset = corpus.archDataset
+
+        # ids and texts of the documents, the i'th document is the i'th row
+        self.columns = corpus.columns
+
+        # annotation and corpora list, read-only
+        self.annIdList = corpus.annIdList
+        self.corporaList = corpus.corporaList
+        self.notCutCorporaList = corpus.notCutCorporaList
+
+        # label / project filters over the documents, see searchSentence(docFilter=...)
+        self.facets = corpus.facets
 
         # model weight [staticModel, featureModel]
         self.model_weight = model_weight
@@ -95,12 +99,15 @@ class archMixModel():
         """
         raise NotImplementedError
 
-    def searchSentence(self, listWords):
+    def searchSentence(self, listWords, top_k=0, docFilter=None, collapse=None):
         """
         Search a sentence contains keyword
 
         Input:
             listWords: 未分好词的查询部分, 是一个或几个字符串的数组
+            top_k: 只返回最相似的top_k个结果, 0表示返回全部结果
+            docFilter: 只在被允许的文档中排序, 为self.facets生成的Facet(可以用 & | ~ 组合)或者长度为N的bool数组.
+            collapse: "image" 或 "project", 每个image(project)只返回分数最高的annotation, 默认为None(不折叠).
         """
         # cut words
         to_search = []
@@ -110,27 +117,28 @@ class archMixModel():
         # search
         result = self.forward(to_search)
 
-        # get index
-        index = np.argsort(result["ALL"])[::-1]
-        sortedResult = self.standardization(np.sort(result["ALL"])[::-1])
+        # get top k index, only the winners are sorted
+        sortedResult, index = topK(result["ALL"], top_k, mask=docFilter, groups=self.facets.groups(collapse))
         
         # result
-        imageId = []
+        imageId = self.columns.annImageIds[index].tolist()
         annoId = []
         copora = []
         for i in index:
             annoId.append(self.annIdList[i])
             copora.append(self.notCutCorporaList[i])
-            imageId.append(self.archDataset.anns[self.annIdList[i]]["imageId"])
 
         return sortedResult, index, copora, annoId, imageId
 
-    def searchWords(self, listWords, weights):
+    def searchWords(self, listWords, weights, top_k=0, docFilter=None, collapse=None):
         """
         Search a list of keyword
 
         Input:
             listWords: 未分好词的查询部分, 是一个或几个字符串的数组
+            top_k: 只返回最相似的top_k个结果, 0表示返回全部结果
+            docFilter: 只在被允许的文档中排序, 参考searchSentence.
+            collapse: "image" 或 "project", 参考searchSentence.
         """
         # cut words
         to_search = []
@@ -140,18 +148,16 @@ class archMixModel():
         # search
         result = self.forwardWords(to_search, weights)
 
-        # get index
-        index = np.argsort(result["ALL"])[::-1]
-        sortedResult = self.standardization(np.sort(result["ALL"])[::-1])
+        # get top k index, only the winners are sorted
+        sortedResult, index = topK(result["ALL"], top_k, mask=docFilter, groups=self.facets.groups(collapse))
         
         # result
-        imageId = []
+        imageId = self.columns.annImageIds[index].tolist()
         annoId = []
         copora = []
         for i in index:
             annoId.append(self.annIdList[i])
             copora.append(self.notCutCorporaList[i])
-            imageId.append(self.archDataset.anns[self.annIdList[i]]["imageId"])
 
         # result
         return sortedResult, index, copora, annoId, imageId
@@ -0,0 +1,51 @@
+import numpy as np
+import Models.StatisticModel.source.inverted_index as ii
+from Models.StatisticModel.source.lmir_bm25 import BM25_LMIR
+from Models.StatisticModel.source.Test.corpus import ZipfCorpus
+from TestModel.lmirBm25Model import lmirBm25Model
+
+
+def test_adaptive_selection():
+    """检查adaptiveWeight按查询长度和词频选出的模型, 以及只算被选中的模型后forward的结果."""
+    corpus = ZipfCorpus(1000)
+    corpora = corpus.docs
+    reference = BM25_LMIR(corpora)
+
+    model = lmirBm25Model(corpora, adaptive=True)
+    assert model.adaptiveWeight(["w1", "w1", "not_in_vocab"]) == [0.25, 0, 0.25, 0]
+    assert model.adaptiveWeight(["w1", "w2", "w3"]) == [0.25, 0.25, 0, 0]
+    assert model.adaptiveWeight(["not_in_vocab"]) == [0.25, 0.25, 0.25, 0.25]
+
+    for _ in range(20):
+        query = corpus.query()
+        weight = model.adaptiveWeight(query)
+        expected = ii.combine_scores(reference.fused_scores(query), weight)["ALL"]
+        assert np.allclose(model.forward(query)["ALL"], expected), query
+
+    # skipped models are not computed at all
+    scores = reference.fused_scores(["w1", "w2"], models=[True, False, True, False])
+    assert not scores[1].any() and not scores[3].any()
+    assert np.array_equal(scores[[0, 2]], reference.fused_scores(["w1", "w2"])[[0, 2]])
+
+    # single words and forwardWords only compute the selected models, cached under the model mask
+    single = model.forward(["w5"])
+    assert not single["JM"].any() and not single["ABS"].any()
+    assert ("w5", (True, False, True, False)) in model.termCache.entries and "w5" not in model.termCache.entries
+    words, wordWeight = ["w1", "w2", "w3"], [0.5, 0.3, 0.2]
+    result = model.forwardWords(words, wordWeight)
+    plain = lmirBm25Model(corpora, modelWeight=[0.25, 0.25, 0, 0]).forwardWords(words, wordWeight)
+    assert not result["DIR"].any() and not result["ABS"].any()
+    for name in ["BM25", "JM", "ALL"]:
+        assert np.allclose(result[name], plain[name]), name
+
+    # rare query terms only use BM25, a selection without weight falls back to modelWeight
+    rare = lmirBm25Model(corpora, adaptive=True, adaptivePolicy={"rareDf": 10 ** 9})
+    assert rare.adaptiveWeight(["w1", "w2", "w3"]) == [0.25, 0, 0, 0]
+    fallback = lmirBm25Model(corpora, modelWeight=[0, 0, 0, 1], adaptive=True)
+    assert fallback.adaptiveWeight(["w1"]) == [0, 0, 0, 1]
+
+
+if __name__ == "__main__":
+    # 默认策略, rareDf策略和没有权重时的回退
+    test_adaptive_selection()
+    print("adaptive forward == full forward with the selected weights")
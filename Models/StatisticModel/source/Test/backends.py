@@ -0,0 +1,72 @@
+import numpy as np
+from Models.StatisticModel.source.lmir_bm25 import BM25_LMIR
+from Models.StatisticModel.source.Test.corpus import ZipfCorpus
+
+MODELS = ["BM25", "jelinek_mercer", "dirichlet", "absolute_discount"]
+
+# idf and tp are stored as float32 arrays, the dict backend keeps python floats
+RTOL = 1e-6
+
+
+def backend_queries(corpus):
+    """随机查询, 以及包含重复的词和不在词表中的词的查询."""
+    return corpus.queries(20) + [["w0", "w0", "w3"], ["w5", "not_in_vocab"], ["not_in_vocab"]]
+
+
+def check_backend(backend, corpus, **hyper):
+    """backend的四个模型和fused与dict后端(原来的list of float实现)的结果相同, 返回值为float64的numpy数组."""
+    model = BM25_LMIR(corpus.docs, backend=backend, **hyper)
+    reference = BM25_LMIR(corpus.docs, backend="dict", **hyper)
+    for query in backend_queries(corpus):
+        for name in MODELS:
+            result, expected = getattr(model, name)(query), getattr(reference, name)(query)
+            assert isinstance(expected, list) and isinstance(result, np.ndarray), (query, name)
+            assert result.dtype == np.float64 and result.shape == (len(corpus.docs),), (query, name)
+            assert np.allclose(result, expected, rtol=RTOL, atol=RTOL), (query, name)
+
+        result, expected = model.fused(query), reference.fused(query)
+        for name in expected:
+            assert np.allclose(result[name], expected[name], rtol=RTOL, atol=RTOL), (query, name)
+
+
+def test_sparse_equals_dict():
+    """sparse后端与dict后端的结果相同, 包括不同的超参数."""
+    corpus = ZipfCorpus(400)
+    check_backend("sparse", corpus)
+    check_backend("sparse", corpus, k1=2.0, b=0.3, lamb=0.5, mu=100, delta=0.3, epsilon=0.1)
+
+
+
+def test_index_equals_dict():
+    """
+    index后端的整数词编号和CSR数组与dict后端的词频字典一致: 词编号按第一次出现的顺序, 每个文档的
+    (词编号, 词频)与corpus_tf相同, 倒排表的文档频率与idf的输入相同; 打分结果与dict后端相同.
+    """
+    corpus = ZipfCorpus(400)
+    model = BM25_LMIR(corpus.docs)
+    reference = BM25_LMIR(corpus.docs, backend="dict")
+
+    first_seen = list(dict.fromkeys(token for doc in corpus.docs for token in doc))
+    assert list(model.vocab) == first_seen and list(model.vocab.values()) == list(range(len(first_seen)))
+    assert model.doc_terms.dtype == np.int32 and model.doc_counts.dtype == np.int32
+    assert np.array_equal(model.doc_length, reference.corpus_length)
+    tokens = np.array(first_seen, dtype=object)
+    for i, tf in enumerate(reference.corpus_tf):
+        start, end = model.doc_offsets[i], model.doc_offsets[i + 1]
+        assert dict(zip(tokens[model.doc_terms[start:end]], model.doc_counts[start:end].tolist())) == tf, i
+
+    df = np.diff(model.inverted_index[0])
+    assert df.tolist() == [sum(token in tf for tf in reference.corpus_tf) for token in first_seen]
+    assert np.allclose(model.idf, [reference.all_idf[token] for token in first_seen], rtol=RTOL)
+    assert np.allclose(model.tp, [reference.all_tp[token] for token in first_seen], rtol=RTOL)
+
+    check_backend("index", corpus)
+    check_backend("index", corpus, k1=2.0, b=0.3, lamb=0.5, mu=100, delta=0.3, epsilon=0.1)
+
+
+if __name__ == "__main__":
+    # 默认的和其它的超参数
+    test_sparse_equals_dict()
+    print("sparse backend == dict backend")
+    test_index_equals_dict()
+    print("index backend == dict backend")
@@ -0,0 +1,43 @@
+import numpy as np
+from Models.StatisticModel.source.lmir_bm25 import BM25_LMIR
+from Models.StatisticModel.source.Test.corpus import ZipfCorpus
+
+
+def check_batch(model, queries, model_weight):
+    for all_models in [False, True]:
+        result = model.fused_batch(queries, model_weight, all_models=all_models)
+        for i, query in enumerate(queries):
+            expected = model.fused(query, model_weight)
+            for name in result:
+                assert np.allclose(result[name][i], expected[name], atol=1e-9), (query, name, all_models)
+
+
+def test_batch_same_as_fused():
+    """
+    fused_batch按词展开方差, 常数列(所有文档分数相同)时各项几乎完全抵消: 这些情况下结果也必须等于
+    逐个查询的fused, 即整行相同而不是被放大的舍入误差.
+    """
+    model_weight = [0.4, 0.3, 0.2, 0.1]
+    degenerate = [
+        # every document is the same, every model is constant
+        ([["a", "b"]] * 50, [["a"], ["a", "b"], ["b", "b"]]),
+        # one different document among 49 identical ones
+        ([["a", "b"]] * 49 + [["c", "a", "a"]], [["a"], ["b"], ["a", "b"], ["c"], ["c", "a"]]),
+    ]
+    for corpora, queries in degenerate:
+        model = BM25_LMIR(corpora)
+        check_batch(model, queries + [["not_in_vocab"], []], model_weight)
+    uniform = BM25_LMIR([["a", "b"]] * 50).fused_batch([["a"]], model_weight)["ALL"]
+    assert np.ptp(uniform) < 1e-12
+
+    corpus = ZipfCorpus(1000)
+    model = BM25_LMIR(corpus.docs)
+    # more queries than one block of fused_batch
+    queries = corpus.queries(100) + [["w0", "w0", "w1"], ["not_in_vocab"], []]
+    check_batch(model, queries, model_weight)
+
+
+if __name__ == "__main__":
+    # 包括常数列的语料, 以及超过一个block的随机查询
+    test_batch_same_as_fused()
+    print("fused_batch == fused")
@@ -0,0 +1,44 @@
+import numpy as np
+from Models.StatisticModel.source.lmir_bm25 import BM25_LMIR
+from Models.StatisticModel.source.Test.corpus import ZipfCorpus
+from TestModel.lmirBm25Model import lmirBm25Model
+
+
+def test_cache_same_as_uncached():
+    """
+    缓存只放得下3个词, 反复查询6个常见词会不断命中和淘汰: 每次的结果都要与cacheBytes=0的模型逐位
+    相等, 统计的条目数和字节数不能超过上限.
+    """
+    corpus = ZipfCorpus(1000)
+    corpora, rand, vocab = corpus.docs, corpus.rand, corpus.vocab
+
+    # room for three words (4 x N float64 each)
+    cached = lmirBm25Model(corpora, cacheBytes=3 * 4 * 8 * len(corpora))
+    uncached = lmirBm25Model(corpora, cacheBytes=0)
+    reference = BM25_LMIR(corpora)
+
+    for _ in range(30):
+        words = rand.choices(vocab[:6], k=rand.randint(1, 4)) + ["not_in_vocab"]
+        wordWeight = [rand.random() for _ in words]
+        result = cached.forwardWords(words, wordWeight)
+        expected = uncached.forwardWords(words, wordWeight)
+        for name in expected:
+            assert np.array_equal(result[name], expected[name]), (words, name)
+
+        # a single word forward is served from the same cache
+        single = cached.forward(words[:1])
+        fused = reference.fused(words[:1], cached.modelWeight)
+        for name in fused:
+            assert np.array_equal(single[name], fused[name]), (words, name)
+
+    stats = cached.cacheStats()
+    assert stats["hits"] > 0 and stats["evictions"] > 0
+    assert stats["entries"] <= 3 and stats["bytes"] <= stats["max_bytes"]
+    assert uncached.cacheStats()["entries"] == 0
+    return stats
+
+
+if __name__ == "__main__":
+    # 打印命中/淘汰统计
+    print(test_cache_same_as_uncached())
+    print("cached forwardWords == uncached forwardWords")
@@ -0,0 +1,33 @@
+import random
+
+
+class ZipfCorpus:
+    def __init__(self, n_docs, vocab_size=300, max_length=30, seed=0):
+        """
+        测试用的随机语料: 词表为 w0, w1, ..., 词频近似zipf分布(w0最常见), 所以一部分词的倒排表很长.
+
+        同一个seed生成的语料和查询完全相同, 测试的结果可以复现.
+
+        Args:
+            n_docs: 文档数量.
+            vocab_size: 词表大小.
+            max_length: 每个文档的最大长度, 文档长度在1到max_length之间均匀分布.
+            seed: 随机数种子.
+        """
+        self.rand = random.Random(seed)
+        self.vocab = ["w{}".format(i) for i in range(vocab_size)]
+        self.weights = [1 / (i + 1) for i in range(vocab_size)]
+        self.max_length = max_length
+        self.docs = [self.doc() for _ in range(n_docs)]
+
+    def doc(self):
+        """一个新的随机文档."""
+        return self.rand.choices(self.vocab, self.weights, k=self.rand.randint(1, self.max_length))
+
+    def query(self, max_length=6):
+        """一个随机查询, 长度在1到max_length之间."""
+        return self.rand.choices(self.vocab, self.weights, k=self.rand.randint(1, max_length))
+
+    def queries(self, n, max_length=6):
+        """n个随机查询."""
+        return [self.query(max_length) for _ in range(n)]
@@ -0,0 +1,36 @@
+import numpy as np
+import Models.StatisticModel.source.inverted_index as ii
+from Models.StatisticModel.source.lmir_bm25 import BM25_LMIR
+from Models.StatisticModel.source.Test.corpus import ZipfCorpus
+
+
+def test_parallel_build_equals_serial():
+    """
+    多进程建立的词表, 文档的CSR数组, 倒排索引和统计量与单进程完全相同(包括词的编号), 所以打分结果也相同.
+    块的大小为1, 不能整除文档数量, 以及包含空文档时词表和数组都要相同.
+    """
+    corpus = ZipfCorpus(700)
+    docs = corpus.docs + [[]] + corpus.docs[:3]
+    expected = ii.cal_vocab_and_counts(docs)
+    for chunk_size in [None, 1, 9, 700, 10000]:
+        result = ii.cal_vocab_and_counts_parallel(docs, workers=2, chunk_size=chunk_size)
+        assert list(result[0].items()) == list(expected[0].items()), chunk_size
+        for array, expected_array in zip(result[1:], expected[1:]):
+            assert array.dtype == expected_array.dtype and np.array_equal(array, expected_array), chunk_size
+
+    # an empty document makes the LMIR scores nan, the models are compared without it
+    serial, parallel = BM25_LMIR(corpus.docs), BM25_LMIR(corpus.docs, workers=2)
+    for a, b in zip(parallel.inverted_index, serial.inverted_index):
+        assert np.array_equal(a, b)
+    assert np.array_equal(parallel.idf, serial.idf) and np.array_equal(parallel.tp, serial.tp)
+    for query in corpus.queries(10):
+        expected_scores = serial.fused(query)
+        result = parallel.fused(query)
+        for name in expected_scores:
+            assert np.array_equal(result[name], expected_scores[name]), (query, name)
+
+
+if __name__ == "__main__":
+    # 2个进程, 不同的块大小
+    test_parallel_build_equals_serial()
+    print("parallel build == serial build")
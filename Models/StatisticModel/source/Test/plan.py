@@ -0,0 +1,36 @@
+import numpy as np
+import Models.StatisticModel.source.inverted_index as ii
+from Models.StatisticModel.source.lmir_bm25 import BM25_LMIR
+from Models.StatisticModel.source.Test.corpus import ZipfCorpus
+
+
+def test_plan_same_as_repeated_terms():
+    """查询计划合并重复的词, 丢掉不在词表中的词并按idf排序; 打分不能因此改变."""
+    corpus = ZipfCorpus(1000)
+    rand, vocab = corpus.rand, corpus.vocab
+    model = BM25_LMIR(corpus.docs)
+
+    plan = model.plan(["w3", "oov", "w0", "w3", "w250", "oov", "w3"])
+    assert plan["terms"][0] == "w250" and sorted(plan["terms"]) == ["w0", "w250", "w3"]
+    assert dict(zip(plan["terms"], plan["counts"].tolist())) == {"w250": 1, "w3": 3, "w0": 1}
+    assert plan["dropped"] == ["oov", "oov"]
+    assert np.all(np.diff(plan["idf"]) <= 0)
+    assert plan["df"].tolist() == [len(ii.postings(model.inverted_index, t)[0]) for t in plan["term_ids"]]
+
+    for _ in range(20):
+        query = rand.choices(vocab[:20], k=rand.randint(1, 8)) + ["oov"] * rand.randint(0, 2)
+        rand.shuffle(query)
+        unplanned = ii.fused_scores(model.query_ids(query), model.N, model.idf, model.tp,
+                                    model.inverted_index, model.doc_length, model.doc_unique,
+                                    model.dir_doc_norm, model.abs_doc_norm, model.avg_doc_length)
+        assert np.allclose(model.fused_scores(query), unplanned), query
+
+    # nothing left to score
+    empty = model.plan(["oov"])
+    assert len(empty["term_ids"]) == 0 and not model.fused_scores(["oov"]).any()
+
+
+if __name__ == "__main__":
+    # 打乱顺序并混入不在词表中的词
+    test_plan_same_as_repeated_terms()
+    print("planned scores == unplanned scores")
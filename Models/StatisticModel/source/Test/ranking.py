@@ -0,0 +1,45 @@
+import numpy as np
+from Models.StatisticModel.source.Test.corpus import ZipfCorpus
+from TestModel.lmirBm25Model import lmirBm25Model
+from utils.Ranking.ranking import topK, topKIndex
+
+
+def test_top_k_is_prefix():
+    """
+    分数有大量重复(例如不包含查询词的文档)时, topK和forward_batch的前k个结果必须是全部结果的前缀,
+    并且与按(-分数, 位置)排序的结果相同.
+    """
+    rand = np.random.default_rng(0)
+    for scores in [rand.integers(0, 5, 1000).astype(np.float64), np.zeros(50), rand.random(300)]:
+        full = np.lexsort((np.arange(len(scores)), -scores))
+        assert np.array_equal(topKIndex(scores), full)
+        for k in [1, 3, 10, 49, 50, 51, len(scores) - 1, len(scores)]:
+            assert np.array_equal(topKIndex(scores, k), full[:k]), k
+            sortedResult, index = topK(scores, k)
+            assert np.array_equal(index, full[:k]), k
+            mask = scores > 0
+            _, masked = topK(scores, k, mask=mask)
+            assert np.array_equal(masked, full[mask[full]][:k]), k
+
+    # rare words: most documents share the same (lowest) score
+    corpus = ZipfCorpus(500)
+    model = lmirBm25Model(corpus.docs)
+    queries = [["w250"], ["w299", "w298"], ["w0", "w1"], ["not_in_vocab"]]
+    batch = model.forward_batch(queries, top_k=20)
+    for i, query in enumerate(queries):
+        expected = model.forwardTopK(query, 20)
+        assert np.array_equal(batch["index"][i], expected["index"]), query
+        assert np.allclose(batch["score"][i], expected["score"]), query
+
+    # a limit above N still returns the top-k shape, with all N documents
+    for top_k in [len(corpus.docs), len(corpus.docs) + 1, 10 ** 6]:
+        batch = model.forward_batch(queries, top_k=top_k)
+        assert batch["index"].shape == batch["score"].shape == (len(queries), len(corpus.docs)), top_k
+        for i, query in enumerate(queries):
+            assert np.array_equal(batch["index"][i], model.forwardTopK(query, top_k)["index"]), query
+
+
+if __name__ == "__main__":
+    # 随机的重复分数, 全部相同的分数, 以及稀有词查询
+    test_top_k_is_prefix()
+    print("top k == prefix of the full ranking")
@@ -0,0 +1,130 @@
+import numpy as np
+from Models.StatisticModel.source.Test.corpus import ZipfCorpus
+from Models.StatisticModel.source.lmir_bm25 import BM25_LMIR
+from Models.StatisticModel.source.segment_index import SegmentIndex
+from TestModel.lmirBm25Model import lmirBm25Model
+from TestModel.segmentLmirBm25Model import segmentLmirBm25Model
+
+
+def test_segment_same_as_rebuild():
+    """随机地新增, 更新和删除文档20轮, 分段索引的分数始终等于只用剩下的文档重新建立的BM25_LMIR."""
+    corpus = ZipfCorpus(500)
+    rand, new_doc = corpus.rand, corpus.doc
+    docs = dict(enumerate(corpus.docs))
+    index = SegmentIndex(list(docs), list(docs.values()), merge_factor=4, background_merge=False)
+
+    next_key = len(docs)
+    for step in range(20):
+        # new annotations, updates of existing ones and removals
+        added = {next_key + i: new_doc() for i in range(rand.randint(1, 40))}
+        next_key += len(added)
+        added.update({key: new_doc() for key in rand.sample(sorted(docs), 5)})
+        removed = rand.sample(sorted(docs), 10)
+
+        index.add(list(added), list(added.values()))
+        docs.update(added)
+        index.remove(removed)
+        for key in removed:
+            docs.pop(key)
+
+        keys, result = index.fused(corpus.query(3) + ["not_in_vocab"])
+        model = BM25_LMIR([docs[key] for key in keys.tolist()])
+        assert sorted(keys.tolist()) == sorted(docs), step
+        # synchronous merges leave no full tier behind
+        assert index.pick_merge() is None, step
+
+    for query in [["w0", "w1"], ["w3", "w200", "w3"], ["not_in_vocab"]]:
+        keys, result = index.fused(query, [0.4, 0.3, 0.2, 0.1])
+        expected = model.fused(query, [0.4, 0.3, 0.2, 0.1])
+        for name in expected:
+            assert np.allclose(result[name], expected[name]), (query, name)
+
+    # a full merge collapses the segments into one
+    index.merge()
+    assert len(index.segments) == 1
+    keys, result = index.fused(["w0", "w1"])
+    assert np.allclose(result["ALL"], model.fused(["w0", "w1"])["ALL"])
+
+
+def test_segment_model_same_as_rebuilt():
+    """模型层的包装: 增删文档之后forward, forwardWords和forwardTopK与用剩下的文档重新建立的lmirBm25Model相同."""
+    corpus = ZipfCorpus(300, seed=2)
+    rand = corpus.rand
+    docs = dict(enumerate(corpus.docs))
+    model = segmentLmirBm25Model(list(docs), list(docs.values()), modelWeight=[0.4, 0.3, 0.2, 0.1], mergeFactor=4)
+
+    next_key = len(docs)
+    for step in range(5):
+        added = {next_key + i: corpus.doc() for i in range(rand.randint(1, 30))}
+        next_key += len(added)
+        added.update({key: corpus.doc() for key in rand.sample(sorted(docs), 5)})
+        removed = rand.sample(sorted(docs), 10)
+        model.add(list(added), list(added.values()))
+        docs.update(added)
+        model.remove(removed)
+        for key in removed:
+            docs.pop(key)
+
+        query = corpus.query(3) + ["not_in_vocab"]
+        keys, result = model.forward(query)
+        assert sorted(keys.tolist()) == sorted(docs), step
+        rebuilt = lmirBm25Model([docs[key] for key in keys.tolist()], modelWeight=[0.4, 0.3, 0.2, 0.1])
+
+        expected = rebuilt.forward(query)
+        for name in expected:
+            assert np.allclose(result[name], expected[name]), (step, name)
+
+        words, weight = query[:2], [0.7, 0.3]
+        wordKeys, result = model.forwardWords(words, weight)
+        expected = rebuilt.forwardWords(words, weight)
+        assert np.array_equal(wordKeys, keys), step
+        for name in expected:
+            assert np.allclose(result[name], expected[name]), (step, name)
+
+        top = model.forwardTopK(query, 10)
+        expected = rebuilt.forwardTopK(query, 10)
+        assert np.array_equal(top["keys"], keys[expected["index"]]), step
+        assert np.allclose(top["score"], expected["score"]), step
+
+    model.close()
+
+    # every document removed: empty results instead of errors
+    empty = segmentLmirBm25Model(["a"], [["w0"]], backgroundMerge=False)
+    empty.remove(["a"])
+    keys, result = empty.forward(["w0"])
+    assert len(keys) == 0 and len(result["ALL"]) == 0
+    assert len(empty.forwardWords(["w0"], [1])[1]["ALL"]) == 0
+    assert len(empty.forwardTopK(["w0"], 10)["keys"]) == 0
+
+
+def test_size_tiered_merge():
+    """单个文档逐个写入时只合并同一层的小段, 初始的大段不会被重写."""
+    corpus = ZipfCorpus(1000, seed=1)
+    index = SegmentIndex(list(range(1000)), corpus.docs, merge_factor=4, background_merge=False)
+    base = index.segments[0]
+    for key in range(1000, 1063):
+        index.add([key], [corpus.doc()])
+        tiers = [index.tier(segment) for segment in index.segments]
+        assert all(tiers.count(tier) < 4 for tier in tiers), tiers
+    # 63 = 333 in base 4: three segments in each of the tiers 0, 1 and 2
+    assert index.segments[0] is base
+    assert sorted(len(segment.keys) for segment in index.segments[1:]) == [1, 1, 1, 4, 4, 4, 16, 16, 16]
+
+    # the background thread keeps the same invariant
+    background = SegmentIndex(list(range(1000)), corpus.docs, merge_factor=4)
+    base = background.segments[0]
+    for key in range(1000, 1063):
+        background.add([key], [corpus.doc()])
+    background.close()
+    assert background.segments[0] is base
+    assert sorted(background.locations) == list(range(1063))
+    assert sum(int(np.sum(segment.live)) for segment in background.segments) == 1063
+
+
+if __name__ == "__main__":
+    # 增删之后merge, 分数不变
+    test_segment_same_as_rebuild()
+    test_size_tiered_merge()
+    # 模型层的包装: 增删文档之后的三种查询
+    test_segment_model_same_as_rebuilt()
+    print("segment index == rebuilt index")
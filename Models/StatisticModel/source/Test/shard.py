@@ -0,0 +1,86 @@
+import os
+import time
+import signal
+import tempfile
+import numpy as np
+from Models.StatisticModel.source.lmir_bm25 import BM25_LMIR
+from Models.StatisticModel.source.shard_index import save_shards, ShardCoordinator, ShardError
+from Models.StatisticModel.source.Test.corpus import ZipfCorpus
+from TestModel.lmirBm25Model import lmirBm25Model
+
+
+def check_shards(root, corpora, queries, model_weight, **hyper_parameter):
+    unsharded = lmirBm25Model(corpora, modelWeight=model_weight, **hyper_parameter)
+    coordinator = ShardCoordinator(root, model_weight=model_weight, **hyper_parameter)
+    for query in queries:
+        for k in [1, 10, 100]:
+            expected = unsharded.forwardTopK(query, k)
+            result = coordinator.search(query, k)
+            assert np.array_equal(result["index"], expected["index"]), (query, k, hyper_parameter)
+            assert np.allclose(result["score"], expected["score"]), (query, k, hyper_parameter)
+
+    # k = 0 returns every document
+    result = coordinator.search(queries[0])
+    assert np.allclose(result["score"], np.sort(unsharded.forward(queries[0])["ALL"])[::-1])
+    coordinator.close()
+
+
+def test_shard_same_as_unsharded():
+    """
+    三个分片各自打分再合并, 下标与lmirBm25Model.forwardTopK一致, 分数在浮点误差内一致.
+    分片按默认超参数保存, 再用另外的epsilon, k1, b加载: idf必须仍然是全局的.
+    """
+    corpus = ZipfCorpus(2000, vocab_size=500)
+    corpora = corpus.docs
+    model_weight = [0.4, 0.3, 0.2, 0.1]
+    queries = corpus.queries(20)
+    queries += [["w0", "w0", "w1"], ["not_in_vocab", "w7"]]
+
+    with tempfile.TemporaryDirectory() as root:
+        save_shards(BM25_LMIR(corpora), root, 3)
+        check_shards(root, corpora, queries, model_weight)
+        # w0 and w1 appear in most documents, so epsilon changes their idf
+        check_shards(root, corpora, queries, model_weight, epsilon=0.5, k1=2.0, b=0.5)
+
+
+def expect_shard_error(coordinator, query, seconds):
+    """查询必须在seconds秒之内抛出ShardError, 之后的查询也抛出ShardError."""
+    tic = time.time()
+    for _ in range(2):
+        try:
+            coordinator.search(query, 10)
+            assert False, "search succeeded with a broken shard"
+        except ShardError:
+            pass
+    assert time.time() - tic < seconds
+    coordinator.close()
+
+
+def test_shard_worker_failure():
+    """
+    一个分片的工作进程退出时查询抛出ShardError而不是一直等待; 工作进程停止响应时, 给出timeout的
+    协调进程同样抛出ShardError.
+    """
+    corpus = ZipfCorpus(300)
+    with tempfile.TemporaryDirectory() as root:
+        save_shards(BM25_LMIR(corpus.docs), root, 3)
+
+        coordinator = ShardCoordinator(root)
+        coordinator.search(["w0"], 10)
+        coordinator.workers[1].kill()
+        coordinator.workers[1].join()
+        expect_shard_error(coordinator, ["w0"], 10)
+
+        coordinator = ShardCoordinator(root, timeout=1)
+        coordinator.search(["w0"], 10)
+        os.kill(coordinator.workers[2].pid, signal.SIGSTOP)
+        expect_shard_error(coordinator, ["w0"], 10)
+
+
+if __name__ == "__main__":
+    # 在临时目录中保存3个分片并启动各分片的进程
+    test_shard_same_as_unsharded()
+    print("sharded top-k == unsharded top-k")
+    # 杀死或者暂停一个分片的工作进程
+    test_shard_worker_failure()
+    print("a failed shard raises ShardError")
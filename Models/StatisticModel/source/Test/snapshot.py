@@ -0,0 +1,62 @@
+import os
+import tempfile
+import multiprocessing
+import numpy as np
+import Models.StatisticModel.source.snapshot as ss
+from Models.StatisticModel.source.lmir_bm25 import BM25_LMIR
+from Models.StatisticModel.source.Test.corpus import ZipfCorpus
+
+
+def hold_version(root, version, loaded, done):
+    """在另一个进程中映射一个版本, 直到done被设置."""
+    ss.load_snapshot(root, version)
+    loaded.set()
+    done.wait()
+
+
+def test_snapshot_load_and_prune():
+    """
+    从快照加载的模型与原模型的结果相同; 每次保存后只保留最新的keep个版本, 但是本进程或者其它进程
+    仍然映射着的旧版本不会被删除, 释放之后下一次保存时才删除.
+    """
+    corpus = ZipfCorpus(500)
+    model = BM25_LMIR(corpus.docs)
+    with tempfile.TemporaryDirectory() as root:
+        model.save_snapshot(root, keep=None)
+        loaded = BM25_LMIR(None, snapshot=ss.load_snapshot(root))
+        for query in corpus.queries(10) + [["not_in_vocab"]]:
+            expected = model.fused(query)
+            result = loaded.fused(query)
+            for name in expected:
+                assert np.array_equal(result[name], expected[name]), (query, name)
+
+        # version 00001 is mapped by this process, 00002 by another one
+        model.save_snapshot(root, keep=None)
+        event, done = multiprocessing.Event(), multiprocessing.Event()
+        holder = multiprocessing.Process(target=hold_version, args=(root, "00002", event, done))
+        holder.start()
+        event.wait()
+
+        for _ in range(3):
+            model.save_snapshot(root, keep=2)
+        assert sorted(name for name in os.listdir(root) if name.isdigit()) == ["00001", "00002", "00004", "00005"]
+
+        done.set()
+        holder.join()
+        # an int version (or another spelling of root) releases the same lease
+        ss.release_snapshot(root + os.sep, 1)
+        model.save_snapshot(root, keep=2)
+        assert sorted(name for name in os.listdir(root) if name.isdigit()) == ["00005", "00006"]
+        assert ss.load_snapshot(root)[2]["version"] == "00006"
+        ss.release_snapshot(root, "00006")
+        try:
+            ss.release_snapshot(root, "latest")
+            assert False, "invalid version accepted"
+        except ValueError:
+            pass
+
+
+if __name__ == "__main__":
+    # 本进程和子进程分别映射一个旧版本
+    test_snapshot_load_and_prune()
+    print("snapshot == model, old unmapped versions pruned")
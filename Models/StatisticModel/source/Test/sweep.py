@@ -0,0 +1,54 @@
+import numpy as np
+from Models.StatisticModel.source.lmir_bm25 import BM25_LMIR
+from Models.StatisticModel.source.sweep import cal_grid, sweep, format_table
+from Models.StatisticModel.source.Test.corpus import ZipfCorpus
+from TestModel.lmirBm25Model import lmirBm25Model
+
+
+def test_sweep_same_as_rebuild():
+    """
+    16个参数组合(2个进程, 每块3个查询)的top_k, MRR和Recall@10, 逐行与用这一行的参数重新建立的
+    lmirBm25Model对照. 网格中没有给出的参数使用模型自己的超参数.
+    """
+    corpus = ZipfCorpus(500)
+    corpora, rand = corpus.docs, corpus.rand
+    queries = corpus.queries(8, max_length=5)
+    queries += [["w0", "w0", "w1"], ["not_in_vocab"]]
+    relevant = [set(rand.sample(range(len(corpora)), 5)) for _ in queries]
+    model_weight = [0.4, 0.3, 0.2, 0.1]
+
+    grid = {"k1": [1.2, 2.0], "b": [0.5, 0.75], "mu": [100, 2000], "delta": [0.5], "epsilon": [0.1, 0.25]}
+    model = BM25_LMIR(corpora)
+    table = sweep(model, queries, grid, model_weight=model_weight, k=10, relevant=relevant, workers=2, chunk_size=3)
+    assert len(table) == len(cal_grid(grid)) == 16
+
+    for row in table:
+        setting = {name: row[name] for name in ["k1", "b", "lamb", "mu", "delta", "epsilon"]}
+        rebuilt = lmirBm25Model(corpora, modelWeight=model_weight, **setting)
+        rr, recall = [], []
+        for query, top_k, rel in zip(queries, row["top_k"], relevant):
+            expected = rebuilt.forwardTopK(query, 10)["index"]
+            assert np.array_equal(top_k, expected), (setting, query)
+
+            ranking = np.argsort(-rebuilt.forward(query)["ALL"], kind="stable").tolist()
+            rr.append(1 / (1 + min(ranking.index(doc) for doc in rel)))
+            recall.append(len(rel.intersection(expected.tolist())) / len(rel))
+        assert np.isclose(row["MRR"], np.mean(rr)) and np.isclose(row["Recall@10"], np.mean(recall)), setting
+
+    print(format_table(table, sort_by="MRR"))
+
+    # parameters missing from the grid come from the model, not from SWEEP_DEFAULTS
+    configured = {"k1": 2.0, "b": 0.3, "lamb": 0.5, "delta": 0.5, "epsilon": 0.1}
+    tuned = lmirBm25Model(corpora, modelWeight=model_weight, **configured)
+    table, _ = tuned.sweep(queries, {"mu": [100, 2000]}, k=10)
+    for row in table:
+        assert {name: row[name] for name in configured} == configured, row
+        rebuilt = lmirBm25Model(corpora, modelWeight=model_weight, mu=row["mu"], **configured)
+        for query, top_k in zip(queries, row["top_k"]):
+            assert np.array_equal(top_k, rebuilt.forwardTopK(query, 10)["index"]), (row["mu"], query)
+
+
+if __name__ == "__main__":
+    # 打印按MRR排序的结果表
+    test_sweep_same_as_rebuild()
+    print("sweep == rebuilt models")
@@ -0,0 +1,70 @@
+import time
+import numpy as np
+from Models.StatisticModel.source.Test.corpus import ZipfCorpus
+from Models.StatisticModel.source.lmir_bm25 import BM25_LMIR
+from TestModel.lmirBm25Model import lmirBm25Model
+
+
+def test_wand_same_as_exhaustive():
+    """剪枝只跳过不可能进入前k个的文档, 返回的下标和分数都不应该有任何差别."""
+    corpus = ZipfCorpus(1000, vocab_size=500)
+    model = BM25_LMIR(corpus.docs)
+    queries = corpus.queries(50)
+    queries += [["w0", "w0", "w1"], ["not_in_vocab"], []]
+
+    for query in queries:
+        for k in [0, 1, 10, 100, 2000]:
+            wandIndex, wandScore = model.BM25_topk(query, k, ranking="wand")
+            index, score = model.BM25_topk(query, k, ranking="exhaustive")
+            assert np.array_equal(wandIndex, index), (query, k)
+            assert np.array_equal(wandScore, score), (query, k)
+
+
+def best_time(fn, repeat=3):
+    """重复repeat次, 返回最快一次的耗时(秒)."""
+    times = []
+    for _ in range(repeat):
+        tic = time.time()
+        fn()
+        times.append(time.time() - tic)
+    return min(times)
+
+
+def test_wand_faster_than_exhaustive():
+    """在较大的zipf语料上, 剪枝只对候选文档打分和排序, 应该比对全部N个分数排序更快, 并且结果相同."""
+    corpus = ZipfCorpus(20000, vocab_size=2000)
+    model = BM25_LMIR(corpus.docs)
+    queries = corpus.queries(50)
+
+    for k in [10, 100]:
+        for query in queries:
+            wandIndex, wandScore = model.BM25_topk(query, k, ranking="wand")
+            index, score = model.BM25_topk(query, k, ranking="exhaustive")
+            assert np.array_equal(wandIndex, index) and np.array_equal(wandScore, score), (query, k)
+
+        wandTime = best_time(lambda: [model.BM25_topk(query, k, ranking="wand") for query in queries])
+        exhaustiveTime = best_time(lambda: [model.BM25_topk(query, k, ranking="exhaustive") for query in queries])
+        print("k={}: wand {:.3f}s, exhaustive {:.3f}s".format(k, wandTime, exhaustiveTime))
+        assert wandTime < exhaustiveTime, (k, wandTime, exhaustiveTime)
+
+
+def test_wand_forward_top_k_scale():
+    """只使用BM25时, forwardTopK走WAND得到的分数与exhaustive一样是forward的"ALL", 而不是BM25的原始分数."""
+    corpus = ZipfCorpus(1000, vocab_size=500)
+    wand = lmirBm25Model(corpus.docs, modelWeight=[1, 0, 0, 0], ranking="wand")
+    exhaustive = lmirBm25Model(corpus.docs, modelWeight=[1, 0, 0, 0])
+    for query in corpus.queries(20) + [["w0", "w0", "w1"], ["not_in_vocab"]]:
+        for k in [1, 10, 2000]:
+            result = wand.forwardTopK(query, k)
+            expected = exhaustive.forwardTopK(query, k)
+            assert np.array_equal(result["index"], expected["index"]), (query, k)
+            assert np.allclose(result["score"], expected["score"]), (query, k)
+
+
+if __name__ == "__main__":
+    # k取1到超过文档数, 与exhaustive逐个比较
+    test_wand_same_as_exhaustive()
+    test_wand_forward_top_k_scale()
+    # 2万个文档上与exhaustive比较耗时
+    test_wand_faster_than_exhaustive()
+    print("WAND top-k == exhaustive top-k")
@@ -0,0 +1,779 @@
+import os
+from array import array
+from math import log
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# ------------------Vocabulary & corpus statistics (Preprocessing)---------------------
+# 所有的词语都映射为整数编号(term id), 语料库的统计量全部保存为扁平的numpy数组:
+#
+#     文档 -> 词:  doc_offsets, doc_terms, doc_counts   (CSR, 每个文档一行)
+#     词 -> 文档:  term_offsets, post_docs, post_tfs    (倒排索引, 每个词一行)
+#     idf, tp:     按词编号排列的float32数组
+#
+# 相比每个文档一个Python字典(键为重复的字符串), 内存占用只和(文档, 词)对的数量成正比.
+
+def cal_vocab_and_counts(corpora, vocab=None):
+    """为语料库建立词表, 并统计每个文档中每个词的词频.
+
+    词的编号按照在语料库中第一次出现的顺序分配, 每个文档内的词也按照第一次出现的顺序排列
+    (与freq_feature.cal_corpus_tf生成的字典的顺序一致).
+
+    Args:
+        corpora: 多个语料组成的列表, 应该是一个嵌套Python列表. For example:
+
+            [["There", "is", "a", "cat"],
+            ["There", "is", "a", "dog"],
+            ["There", "is", "a", "wolf"]]
+
+        vocab: 已有的词表, 新的词语会在这个词表上继续编号(原地修改). 默认为None, 建立新的词表.
+
+    Return:
+        函数返回值, 分别对应:
+
+        vocab: 词语到词编号的映射, 为Python字典. For example:
+
+            {"There": 0, "is": 1, "a": 2, "cat": 3, "dog": 4, "wolf": 5}
+
+        doc_offsets: 每个文档在doc_terms中的起止位置, 长度为N+1的int64数组.
+        doc_terms: 每个文档中出现的词的编号, 为int32数组.
+        doc_counts: 对应doc_terms的词频, 为int32数组.
+        doc_length: 每个文档的长度, 为float64数组.
+    """
+    # typed arrays instead of lists, so the counts are not kept as python ints while building
+    vocab = {} if vocab is None else vocab
+    doc_offsets = array("q", [0])
+    doc_terms = array("i")
+    doc_counts = array("i")
+    doc_length = array("d")
+
+    for corpus in corpora:
+        tf = {}
+        for token in corpus:
+            term_id = vocab.setdefault(token, len(vocab))
+            tf[term_id] = tf.get(term_id, 0) + 1
+        doc_terms.extend(tf.keys())
+        doc_counts.extend(tf.values())
+        doc_offsets.append(len(doc_terms))
+        doc_length.append(len(corpus))
+
+    return vocab, \
+           np.frombuffer(doc_offsets, dtype=np.int64), \
+           np.frombuffer(doc_terms, dtype=np.int32), \
+           np.frombuffer(doc_counts, dtype=np.int32), \
+           np.frombuffer(doc_length, dtype=np.float64)
+
+
+def cal_vocab_and_counts_parallel(corpora, workers=None, chunk_size=None):
+    """多进程版本的cal_vocab_and_counts, 结果与单进程完全相同.
+
+    语料库按顺序切分为若干块, 每一块在ProcessPoolExecutor中独立建立局部词表并统计词频,
+    然后按块的顺序合并(参考merge_vocab_and_counts).
+
+    Args:
+        corpora: 多个语料组成的列表, 应该是一个嵌套Python列表.
+        workers: 进程数量, 默认为CPU的数量. 不超过1时直接使用单进程的cal_vocab_and_counts.
+        chunk_size: 每一块的文档数量, 默认把语料库平均分给每个进程的4块.
+
+    Return:
+        与cal_vocab_and_counts的返回值相同.
+    """
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1 or len(corpora) == 0:
+        return cal_vocab_and_counts(corpora)
+
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(corpora) // (workers * 4)))
+    chunks = [corpora[start:start + chunk_size] for start in range(0, len(corpora), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parts = list(executor.map(cal_vocab_and_counts, chunks))
+
+    return merge_vocab_and_counts(parts)
+
+
+def merge_vocab_and_counts(parts):
+    """按顺序合并多个cal_vocab_and_counts的结果.
+
+    依次遍历每一块的局部词表(局部词表本身按第一次出现的顺序编号), 没有见过的词追加到全局词表中,
+    所以全局词表的编号仍然是整个语料库中第一次出现的顺序. 每一块的局部词编号通过一个映射数组
+    转换为全局词编号.
+
+    Args:
+        parts: cal_vocab_and_counts返回值组成的列表, 顺序与语料库的顺序一致.
+
+    Return:
+        与cal_vocab_and_counts的返回值相同.
+    """
+    vocab = {}
+    doc_offsets, doc_terms, doc_counts, doc_length = [np.zeros(1, dtype=np.int64)], [], [], []
+    for part_vocab, part_offsets, part_terms, part_counts, part_length in parts:
+        mapping = np.array([vocab.setdefault(token, len(vocab)) for token in part_vocab], dtype=np.int32)
+        doc_offsets.append(part_offsets[1:] + doc_offsets[-1][-1])
+        doc_terms.append(mapping[part_terms])
+        doc_counts.append(part_counts)
+        doc_length.append(part_length)
+
+    return vocab, \
+           np.concatenate(doc_offsets), \
+           np.concatenate(doc_terms).astype(np.int32), \
+           np.concatenate(doc_counts).astype(np.int32), \
+           np.concatenate(doc_length).astype(np.float64)
+
+
+def cal_inverted_index(V, doc_offsets, doc_terms, doc_counts):
+    """根据文档的CSR词频数组生成倒排索引(即词频矩阵的转置).
+
+    倒排表中的文档编号按照从小到大排列.
+
+    Args:
+        V: 词表的大小, 为int.
+        doc_offsets, doc_terms, doc_counts: cal_vocab_and_counts生成的文档词频数组.
+
+    Return:
+        倒排索引, 为(term_offsets, post_docs, post_tfs)组成的元组. 第t个词的倒排表为:
+
+            post_docs[term_offsets[t]:term_offsets[t + 1]]  (文档编号, int32数组)
+            post_tfs[term_offsets[t]:term_offsets[t + 1]]   (词频, int32数组)
+    """
+    doc_ids = np.repeat(np.arange(len(doc_offsets) - 1, dtype=np.int32), np.diff(doc_offsets))
+
+    # stable sort keeps doc ids ascending inside every term
+    order = np.argsort(doc_terms, kind="stable")
+    term_offsets = np.zeros(V + 1, dtype=np.int64)
+    np.cumsum(np.bincount(doc_terms, minlength=V), out=term_offsets[1:])
+
+    return term_offsets, doc_ids[order], doc_counts[order]
+
+
+def postings(inverted_index, term_id):
+    """取出一个词的倒排表.
+
+    Return:
+        doc_ids: 包含该词的文档编号.
+        tf: 该词在这些文档中的词频.
+    """
+    term_offsets, post_docs, post_tfs = inverted_index
+    if term_id >= len(term_offsets) - 1:
+        # term added to a shared vocabulary after this index was built
+        return post_docs[:0], post_tfs[:0]
+    start, end = term_offsets[term_id], term_offsets[term_id + 1]
+    return post_docs[start:end], post_tfs[start:end]
+
+
+def cal_term_statistics(N, inverted_index, epsilon=0.25):
+    """计算每个词的出现概率(LMIR)和idf(BM25).
+
+    与freq_feature.cal_corpus_tp和freq_feature.cal_idf_BM25的计算方式一致, 只是按照词编号保存
+    为float32数组.
+
+    Args:
+        N: 语料库中的语句条目数, 为int.
+        inverted_index: cal_inverted_index生成的倒排索引.
+        epsilon: 用来决定idf的最小值, 默认为0.25.
+
+    Return:
+        tp: 每个词在所有语料中的出现概率, 为float32数组.
+        idf: 每个词的idf值, 为float32数组.
+    """
+    term_offsets, _, post_tfs = inverted_index
+    V = len(term_offsets) - 1
+
+    # term frequence in all corpus (LMIR) & document frequence (BM25)
+    term_ids = np.repeat(np.arange(V), np.diff(term_offsets))
+    cf = np.bincount(term_ids, weights=post_tfs, minlength=V)
+    df = np.diff(term_offsets)
+
+    return cal_term_statistics_from_counts(N, df, cf, epsilon=epsilon)
+
+
+def cal_term_statistics_from_counts(N, df, cf, epsilon=0.25):
+    """根据每个词的文档频率和总词频计算出现概率和idf.
+
+    df为0的词(例如对应的文档都已经被删除)不属于词表, 它们的tp和idf为0, 也不参与平均idf的计算.
+
+    Args:
+        N: 语料库中的语句条目数, 为int.
+        df: 每个词出现在多少个文档中, 为numpy数组.
+        cf: 每个词在所有语料中出现的次数, 为numpy数组.
+        epsilon: 用来决定idf的最小值, 默认为0.25.
+
+    Return:
+        tp: 每个词在所有语料中的出现概率, 为float32数组.
+        idf: 每个词的idf值, 为float32数组.
+    """
+    V = len(df)
+    tp, idf = np.zeros(V, dtype=np.float32), np.zeros(V, dtype=np.float32)
+    in_vocab = df > 0
+    if not np.any(in_vocab):
+        return tp, idf
+
+    df = df[in_vocab].astype(np.float64)
+    idf64 = np.log(N - df + 0.5) - np.log(df + 0.5)
+    idf64[idf64 < 0] = epsilon * (np.sum(idf64) / len(df))
+
+    tp[in_vocab] = cf[in_vocab] / np.sum(cf)
+    idf[in_vocab] = idf64
+    return tp, idf
+
+
+# ------------------Statistical feature cal (BM25, term-at-a-time)---------------------
+# 与freq_feature.BM25的公式完全一致, 只是按照查询词逐个遍历倒排表进行累加.
+# 以下函数的query_ids为查询词的编号, 不在词表中的词应当已经去掉(它们在原始实现中的贡献为0).
+
+def BM25(query_ids, N, idf, inverted_index, doc_length, avg_doc_length, k1=1.5, b=0.75):
+    """基于倒排索引的BM25算法(term-at-a-time).
+
+    计算公式请参考freq_feature.BM25, 不包含查询词的文档分数为0. 查询的复杂度只和查询词
+    的倒排表长度有关, 而不是语料库的大小N.
+
+    Args:
+        query_ids: 查询词的编号, 为Python列表. 重复的查询词会被重复计算. For example:
+
+                [3, 0, 3]
+
+        N: 语料库中的语句条目数, 为int.
+        idf: 每个词的idf值, 为numpy数组.
+        inverted_index: cal_inverted_index生成的倒排索引.
+        doc_length: 语料库各个句子的长度, 为numpy数组.
+        avg_doc_length: 语料库的平均文档长度, 公式为: 文本长度总量/语料库总长度
+        k1: 计算时公式参数, 默认为: 1.5
+        b: 计算时公式参数, 默认为: 0.75
+
+    Return:
+        返回对每一个句子的BM25查询值, 为长度为N的numpy数组. 格式如下:
+
+        array([0., 0., 0.])
+    """
+    scores = np.zeros(N)
+    for term_id in query_ids:
+        doc_ids, q_freq = postings(inverted_index, term_id)
+        doc_len = doc_length[doc_ids]
+        scores[doc_ids] += float(idf[term_id]) * (q_freq * (k1 + 1) /
+                                                  (q_freq + k1 * (1 - b + b * doc_len / avg_doc_length)))
+
+    return scores
+
+
+def BM25_moments(query_ids, N, idf, inverted_index, doc_length, avg_doc_length, k1=1.5, b=0.75):
+    """BM25(...)的分数在全部N个文档上的均值和标准差, 只遍历查询词的倒排表, 不生成长度为N的数组.
+
+    不包含查询词的文档分数为0, 方差按中心化的平方和计算, 用于把WAND得到的原始分数标准化.
+
+    Return:
+        mean, sigma: 均值和标准差, 为float.
+    """
+    doc_ids, contributions = [], []
+    for term_id in query_ids:
+        docs, q_freq = postings(inverted_index, term_id)
+        doc_len = doc_length[docs]
+        doc_ids.append(docs)
+        contributions.append(float(idf[term_id]) * (q_freq * (k1 + 1) /
+                                                    (q_freq + k1 * (1 - b + b * doc_len / avg_doc_length))))
+    if N == 0 or sum(len(docs) for docs in doc_ids) == 0:
+        return 0.0, 0.0
+
+    # scores of the documents containing a query term, the others are 0
+    touched, inverse = np.unique(np.concatenate(doc_ids), return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate(contributions), minlength=len(touched))
+    mean = np.sum(scores) / N
+    square = np.sum((scores - mean) ** 2) + (N - len(touched)) * mean * mean
+    return float(mean), float(np.sqrt(square / N))
+
+
+def cal_bm25_contribution(idf, inverted_index, doc_length, avg_doc_length, k1=1.5, b=0.75):
+    """计算倒排索引中每一项(词, 文档)的BM25贡献.
+
+    Return:
+        float64数组, 与倒排索引的post_docs一一对应.
+    """
+    term_offsets, post_docs, post_tfs = inverted_index
+    term_idf = np.repeat(idf.astype(np.float64), np.diff(term_offsets))
+    doc_len = doc_length[post_docs]
+    return term_idf * (post_tfs * (k1 + 1) / (post_tfs + k1 * (1 - b + b * doc_len / avg_doc_length)))
+
+
+# ------------------Impact index (BM25, precomputed)---------------------
+# BM25中每个(词, 文档)的贡献 idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len / avg_doc_length))
+# 只和语料有关, 与查询无关, 所以可以在建立索引时预先计算好. 倒排表按照贡献从大到小排列
+# (impact-ordered), 可以选择量化为uint8/uint16并为每个词保存一个缩放系数, 查询时只需要累加.
+
+IMPACT_DTYPES = {
+    "float": np.float64,
+    "uint16": np.uint16,
+    "uint8": np.uint8,
+}
+
+
+def cal_bm25_impact_index(idf, inverted_index, doc_length, avg_doc_length, k1=1.5, b=0.75, impact="float"):
+    """预先计算每个倒排表项的BM25贡献.
+
+    Args:
+        idf: 每个词的idf值, 为numpy数组.
+        inverted_index: cal_inverted_index生成的倒排索引.
+        doc_length: 每个文档的长度, 为numpy数组.
+        avg_doc_length: 语料库的平均文档长度.
+        k1: 计算时公式参数, 默认为: 1.5
+        b: 计算时公式参数, 默认为: 0.75
+        impact: 贡献的保存类型, "float"为不量化的float64, "uint16"/"uint8"为量化后的整数.
+
+    Return:
+        impact索引, 为(term_offsets, impact_docs, impacts, scales)组成的元组, 每个词的倒排表按
+        贡献从大到小排列. 第t个词在文档impact_docs[i]上的真实贡献为: impacts[i] * scales[t].
+    """
+    dtype = IMPACT_DTYPES[impact]
+    term_offsets, post_docs, _ = inverted_index
+    V = len(term_offsets) - 1
+    term_ids = np.repeat(np.arange(V), np.diff(term_offsets))
+    impacts = cal_bm25_contribution(idf, inverted_index, doc_length, avg_doc_length, k1=k1, b=b)
+
+    # impact-ordered postings inside every term, ties keep doc id order
+    order = np.lexsort((-np.abs(impacts), term_ids))
+    impact_docs = post_docs[order].astype(np.int32)
+    impacts = impacts[order]
+
+    if impact == "float":
+        return term_offsets, impact_docs, impacts, np.ones(V)
+
+    # impacts of one term share the sign of its idf, the first one has the largest magnitude
+    scales = np.zeros(V)
+    not_empty = np.diff(term_offsets) > 0
+    scales[not_empty] = impacts[term_offsets[:-1][not_empty]] / np.iinfo(dtype).max
+    term_scales = scales[term_ids]
+    quantized = np.rint(np.divide(impacts, term_scales, out=np.zeros_like(impacts), where=term_scales != 0))
+    return term_offsets, impact_docs, quantized.astype(dtype), scales
+
+
+def BM25_impact(query_ids, N, impact_index):
+    """基于impact索引的BM25, 查询时只需要把倒排表上预先算好的贡献累加起来.
+
+    Args:
+        query_ids: 查询词的编号, 为Python列表.
+        N: 语料库中的语句条目数, 为int.
+        impact_index: cal_bm25_impact_index生成的impact索引.
+
+    Return:
+        返回对每一个句子的BM25查询值, 为长度为N的numpy数组. 不量化时与BM25(...)完全相同,
+        量化时每个贡献的误差不超过缩放系数的一半.
+    """
+    term_offsets, impact_docs, impacts, scales = impact_index
+    scores = np.zeros(N)
+    for term_id in query_ids:
+        start, end = term_offsets[term_id], term_offsets[term_id + 1]
+        if impacts.dtype == np.float64:
+            scores[impact_docs[start:end]] += impacts[start:end]
+        else:
+            scores[impact_docs[start:end]] += impacts[start:end] * scales[term_id]
+
+    return scores
+
+
+# ------------------Dynamic pruning (BM25, MaxScore/WAND)---------------------
+# 参考: Turtle & Flood, Query Evaluation: Strategies and Optimizations (MaxScore);
+#       Broder et al., Efficient Query Evaluation using a Two-Level Retrieval Process (WAND).
+# 每个词预先计算在所有文档中的BM25最大贡献(上界). 查询时先用上界最大的词自己的贡献得到第k名分数的
+# 下界, 把查询词按上界从小到大排列, 上界之和仍然小于这个下界的词为"非必要词": 只包含非必要词的文档
+# 不可能进入前k个, 不需要打分. 候选文档只来自必要词的倒排表, 非必要词只在候选文档上累加.
+# 整个过程按词向量化(term-at-a-time), 并且只对候选文档排序, 而不是对全部N个分数排序.
+
+WAND_SLACK = 1e-9  # 上界和阈值比较时留出的相对误差, 避免浮点求和顺序不同导致误剪
+
+
+def cal_bm25_upper_bound(idf, inverted_index, doc_length, avg_doc_length, k1=1.5, b=0.75):
+    """计算每个词在所有文档中的BM25贡献的最大值.
+
+    Args:
+        idf: 每个词的idf值, 为numpy数组.
+        inverted_index: cal_inverted_index生成的倒排索引.
+        doc_length: 每个文档的长度, 为numpy数组.
+        avg_doc_length: 语料库的平均文档长度.
+        k1: 计算时公式参数, 默认为: 1.5
+        b: 计算时公式参数, 默认为: 0.75
+
+    Return:
+        每个词的BM25贡献上界, 为按词编号排列的float64数组.
+    """
+    term_offsets = inverted_index[0]
+    upper_bound = np.zeros(len(term_offsets) - 1)
+    not_empty = np.diff(term_offsets) > 0
+    if np.any(not_empty):
+        contribution = cal_bm25_contribution(idf, inverted_index, doc_length, avg_doc_length, k1=k1, b=b)
+        upper_bound[not_empty] = np.maximum.reduceat(contribution, term_offsets[:-1][not_empty])
+    return upper_bound
+
+
+def rank_top_k(scores, k):
+    """对全部分数进行排序, 取前k个(分数从大到小, 分数相同时文档编号小的在前).
+
+    Return:
+        index: 前k个文档的编号, 为numpy数组.
+        scores: 前k个文档的分数, 为numpy数组.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    index = np.lexsort((np.arange(len(scores)), -scores))[:k]
+    return index, scores[index]
+
+
+def BM25_wand(query_ids, k, N, idf, inverted_index, doc_length, avg_doc_length,
+              upper_bound, k1=1.5, b=0.75):
+    """使用MaxScore/WAND动态剪枝计算BM25的前k个结果.
+
+    结果与对BM25(...)的全部分数排序后取前k个完全相同(分数相同时文档编号小的在前), 包括分数为0
+    的文档不够k个时的补齐, 分数按查询词的顺序累加, 与BM25(...)逐位相同. 如果某个查询词的上界不为正
+    (idf不为正), 剪枝不再成立, 退回到全部打分.
+
+    Args:
+        query_ids: 查询词的编号, 为Python列表.
+        k: 需要返回的结果数量.
+        N: 语料库中的语句条目数, 为int.
+        idf: 每个词的idf值, 为numpy数组.
+        inverted_index: cal_inverted_index生成的倒排索引.
+        doc_length: 每个文档的长度, 为numpy数组.
+        avg_doc_length: 语料库的平均文档长度.
+        upper_bound: cal_bm25_upper_bound生成的每个词的上界.
+        k1: 计算时公式参数, 默认为: 1.5
+        b: 计算时公式参数, 默认为: 0.75
+
+    Return:
+        index: 前k个文档的编号, 为numpy数组.
+        scores: 前k个文档的BM25分数, 为numpy数组.
+    """
+    query_ids = list(query_ids)
+    k = min(k, N)
+    terms = list(dict.fromkeys(query_ids))
+
+    if any(upper_bound[term_id] <= 0 for term_id in terms):
+        return rank_top_k(BM25(query_ids, N, idf, inverted_index,
+                               doc_length, avg_doc_length, k1=k1, b=b), k)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    def contribution(term_id, doc_ids, q_freq):
+        doc_len = doc_length[doc_ids]
+        return float(idf[term_id]) * (q_freq * (k1 + 1) / (q_freq + k1 * (1 - b + b * doc_len / avg_doc_length)))
+
+    # repeated query tokens count repeatedly, as in BM25(...)
+    term_count = {term_id: query_ids.count(term_id) for term_id in terms}
+    terms.sort(key=lambda term_id: upper_bound[term_id] * term_count[term_id])
+    term_postings = {term_id: postings(inverted_index, term_id) for term_id in terms}
+
+    # lower bound of the k'th score: the k'th largest contribution of the term with the largest bound
+    threshold = float("-inf")
+    if terms and len(term_postings[terms[-1]][0]) >= k:
+        doc_ids, q_freq = term_postings[terms[-1]]
+        seed_scores = term_count[terms[-1]] * contribution(terms[-1], doc_ids, q_freq)
+        threshold = np.partition(seed_scores, len(seed_scores) - k)[len(seed_scores) - k] * (1 - WAND_SLACK)
+
+    # docs that only contain the non-essential terms cannot reach the threshold
+    bounds = np.cumsum([upper_bound[term_id] * term_count[term_id] for term_id in terms]) * (1 + WAND_SLACK)
+    essential = set(terms[int(np.sum(bounds < threshold)):])
+    candidate = np.zeros(N, dtype=bool)
+    for term_id in essential:
+        candidate[term_postings[term_id][0]] = True
+    doc_ids = np.flatnonzero(candidate)
+    slot = np.empty(N, dtype=np.int64)
+    slot[doc_ids] = np.arange(len(doc_ids))
+
+    term_contribution = {}
+    for term_id in terms:
+        post_docs, post_tfs = term_postings[term_id]
+        if term_id not in essential:
+            keep = candidate[post_docs]
+            post_docs, post_tfs = post_docs[keep], post_tfs[keep]
+        term_contribution[term_id] = slot[post_docs], contribution(term_id, post_docs, post_tfs)
+
+    # sum in query order like BM25(...), so the scores are bitwise the same
+    scores = np.zeros(len(doc_ids))
+    for term_id in query_ids:
+        local, value = term_contribution[term_id]
+        scores[local] += value
+
+    # only the candidates tied with or above the k'th score need the full sort
+    if len(doc_ids) > k:
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        keep = scores >= kth
+        doc_ids, scores = doc_ids[keep], scores[keep]
+    order = np.lexsort((doc_ids, -scores))[:k]
+    index, scores = doc_ids[order], scores[order]
+
+    # not enough matching docs: pad with zero score docs in doc id order
+    if len(index) < k:
+        extra = np.flatnonzero(~candidate)[:k - len(index)]
+        index = np.concatenate((index, extra))
+        scores = np.concatenate((scores, np.zeros(len(extra))))
+
+    return index.astype(np.int64), scores.astype(np.float64)
+
+
+# ------------------Statistical feature cal (LMIR, background + correction)---------------------
+# 对于不包含查询词q的文档, LMIR的平滑项只和文档长度以及不重复词数有关, 因此可以写成闭式的"背景分数":
+#
+#     JM:  -log(lamb * p(q|C))
+#     DIR: -log(mu * p(q|C)) + log(doc_len + mu)
+#     ABS: -log(delta * p(q|C)) - log(d_u / doc_len)
+#
+# 包含查询词的文档只需要在背景分数的基础上加一个修正项, 修正项只在倒排表上计算:
+#
+#     JM:  -log(1 + (1 - lamb) * f(q, d) / (doc_len * lamb * p(q|C)))
+#     DIR: -log(1 + f(q, d) / (mu * p(q|C)))
+#     ABS: -log(1 + max(f(q, d) - delta, 0) / (delta * d_u * p(q|C)))
+#
+# 背景分数与修正项相加后与freq_feature中的原始公式完全等价.
+
+def cal_lmir_doc_norm(doc_length, doc_unique, mu=2000):
+    """预先计算LMIR背景分数中只和文档相关的部分.
+
+    Args:
+        doc_length: 每个文档的长度, 为numpy数组.
+        doc_unique: 每个文档中不重复词语的数量, 为numpy数组.
+        mu: LMIR.DIR的超参数, 默认值为2000.
+
+    Return:
+        dir_doc_norm: log(doc_len + mu), 为numpy数组.
+        abs_doc_norm: log(d_u / doc_len), 为numpy数组(空文档为nan, 与原始实现不能计算空文档一致).
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dir_doc_norm = np.log(doc_length + mu)
+        abs_doc_norm = np.log(doc_unique / doc_length)
+    return dir_doc_norm, abs_doc_norm
+
+
+def jelinek_mercer(query_ids, N, tp, inverted_index, doc_length, lamb=0.1):
+    """基于背景分数和倒排表修正项的LMIR.JM, 公式参考freq_feature.jelinek_mercer.
+
+    Args:
+        query_ids: 查询词的编号, 为Python列表.
+        N: 语料库中的语句条目数, 为int.
+        tp: 每个词在所有语料中的出现概率, 为numpy数组.
+        inverted_index: cal_inverted_index生成的倒排索引.
+        doc_length: 每个文档的长度, 为numpy数组.
+        lamb: 在计算LMIR.JM特征的超参数, 默认值为0.1.
+
+    Return:
+        返回对每一个句子的LMIR.JM查询值, 为长度为N的numpy数组.
+    """
+    scores = np.zeros(N)
+    background = 0
+    for term_id in query_ids:
+        p = float(tp[term_id])
+        background -= log(lamb * p)
+
+        doc_ids, tf = postings(inverted_index, term_id)
+        scores[doc_ids] -= np.log1p((1 - lamb) * tf / (doc_length[doc_ids] * lamb * p))
+
+    return scores + background
+
+
+def dirichlet(query_ids, N, tp, inverted_index, dir_doc_norm, mu=2000):
+    """基于背景分数和倒排表修正项的LMIR.DIR, 公式参考freq_feature.dirichlet.
+
+    Args:
+        query_ids: 查询词的编号, 为Python列表.
+        N: 语料库中的语句条目数, 为int.
+        tp: 每个词在所有语料中的出现概率, 为numpy数组.
+        inverted_index: cal_inverted_index生成的倒排索引.
+        dir_doc_norm: cal_lmir_doc_norm生成的log(doc_len + mu), 为numpy数组.
+        mu: 在计算LMIR.DIR特征的超参数, 默认值为2000.
+
+    Return:
+        返回对每一个句子的LMIR.DIR查询值, 为长度为N的numpy数组.
+    """
+    scores = np.zeros(N)
+    if len(query_ids) == 0:
+        return scores
+
+    background = 0
+    for term_id in query_ids:
+        p = float(tp[term_id])
+        background -= log(mu * p)
+
+        doc_ids, tf = postings(inverted_index, term_id)
+        scores[doc_ids] -= np.log1p(tf / (mu * p))
+
+    return scores + background + len(query_ids) * dir_doc_norm
+
+
+def absolute_discount(query_ids, N, tp, inverted_index, doc_unique, abs_doc_norm, delta=0.7):
+    """基于背景分数和倒排表修正项的LMIR.ABS, 公式参考freq_feature.absolute_discount.
+
+    Args:
+        query_ids: 查询词的编号, 为Python列表.
+        N: 语料库中的语句条目数, 为int.
+        tp: 每个词在所有语料中的出现概率, 为numpy数组.
+        inverted_index: cal_inverted_index生成的倒排索引.
+        doc_unique: 每个文档中不重复词语的数量, 为numpy数组.
+        abs_doc_norm: cal_lmir_doc_norm生成的log(d_u / doc_len), 为numpy数组.
+        delta: 在计算LMIR.ABS特征的超参数, 默认值为0.7.
+
+    Return:
+        返回对每一个句子的LMIR.ABS查询值, 为长度为N的numpy数组.
+    """
+    scores = np.zeros(N)
+    if len(query_ids) == 0:
+        return scores
+
+    background = 0
+    for term_id in query_ids:
+        p = float(tp[term_id])
+        background -= log(delta * p)
+
+        doc_ids, tf = postings(inverted_index, term_id)
+        scores[doc_ids] -= np.log1p(np.maximum(tf - delta, 0) / (delta * doc_unique[doc_ids] * p))
+
+    return scores + background - len(query_ids) * abs_doc_norm
+
+
+# ------------------Fused scorer (BM25 + LMIR in one pass)---------------------
+# 四个模型共享同一次倒排表遍历: 每个(查询词, 文档)对只读取一次词频和文档长度,
+# 同时累加到四个分数数组中, 最后统一做z-score标准化和加权求和.
+
+MODEL_NAMES = ["BM25", "JM", "DIR", "ABS"]
+
+
+# 标准差不超过 STD_RTOL * 均方根 时视为0: 常数行的均值有舍入误差, 不能把这个误差放大成排序
+STD_RTOL = 1e-9
+
+
+def is_zero_std(sigma, mean):
+    """标准差相对于均方根 sqrt(sigma^2 + mean^2) 是否可以视为0, sigma和mean为形状相同的numpy数组."""
+    return sigma <= STD_RTOL * np.sqrt(sigma * sigma + mean * mean)
+
+
+def standardization(data):
+    """沿最后一维进行z-score标准化, 标准差为0(相对于均方根不超过STD_RTOL)的部分保持不变.
+
+    Args:
+        data: numpy数组, 最后一维是所有文档的分数. 例如 4 x N (每一行是一个模型的分数)
+            或者 4 x Q x N (多个查询).
+
+    Return:
+        标准化后的, 形状与输入相同的numpy数组.
+    """
+    mean = np.mean(data, axis=-1, keepdims=True)
+    centered = data - mean
+    sigma = np.sqrt(np.mean(centered * centered, axis=-1, keepdims=True))
+    zero = is_zero_std(sigma, mean)
+    np.divide(centered, np.where(zero, 1, sigma), out=centered)
+    return np.where(zero, data, centered) if zero.any() else centered
+
+
+def combine_scores(scores, model_weight):
+    """标准化四个模型的分数并按照model_weight加权求和.
+
+    BM25越大越好, LMIR越小越好, 所以LMIR的结果在标准化之后取负号.
+
+    Args:
+        scores: 4 x N (或 4 x Q x N) 的numpy数组, 按第一维分别为 [BM25, JM, DIR, ABS] 的原始分数.
+        model_weight: 四个模型的权重, 分别对应 [BM25, JM, DIR, ABS].
+
+    Return:
+        dict{
+            “模型名”: [标准化结果nparray]
+            “ALL”: [加权结果nparray]
+        }
+    """
+    return combine_normalized(normalize_scores(scores), model_weight)
+
+
+def normalize_scores(scores):
+    """标准化四个模型的原始分数, LMIR的结果取负号, 使得四个模型都是越大越好.
+
+    Args:
+        scores: 4 x N (或 4 x Q x N) 的numpy数组, 按第一维分别为 [BM25, JM, DIR, ABS] 的原始分数.
+
+    Return:
+        形状与输入相同的numpy数组.
+    """
+    normalized = standardization(scores)
+    normalized[1:] = -normalized[1:]
+    return normalized
+
+
+def combine_normalized(normalized, model_weight):
+    """对normalize_scores的结果按照model_weight加权求和并再次标准化, 返回值与combine_scores相同."""
+    weight_result = np.tensordot(np.asarray(model_weight, dtype=np.float64), normalized, axes=1)
+    weight_result = standardization(weight_result)
+
+    result = {name: normalized[i] for i, name in enumerate(MODEL_NAMES)}
+    result["ALL"] = weight_result
+    return result
+
+
+def fused(query_ids, N, idf, tp, inverted_index, doc_length, doc_unique,
+          dir_doc_norm, abs_doc_norm, avg_doc_length, model_weight,
+          k1=1.5, b=0.75, lamb=0.1, mu=2000, delta=0.7):
+    """一次遍历倒排表同时计算BM25, LMIR.JM, LMIR.DIR, LMIR.ABS, 并完成标准化和加权.
+
+    各个模型的公式与本文件中对应的单模型实现一致.
+
+    Args:
+        query_ids: 查询词的编号, 为Python列表.
+        N: 语料库中的语句条目数, 为int.
+        idf: 每个词的idf值, 为numpy数组.
+        tp: 每个词在所有语料中的出现概率, 为numpy数组.
+        inverted_index: cal_inverted_index生成的倒排索引.
+        doc_length: 每个文档的长度, 为numpy数组.
+        doc_unique: 每个文档中不重复词语的数量, 为numpy数组.
+        dir_doc_norm, abs_doc_norm: cal_lmir_doc_norm生成的背景分数的文档部分.
+        avg_doc_length: 语料库的平均文档长度.
+        model_weight: 四个模型的权重, 分别对应 [BM25, JM, DIR, ABS].
+        k1, b, lamb, mu, delta: 各个模型的超参数.
+
+    Return:
+        与combine_scores的返回值相同.
+    """
+    return combine_scores(fused_scores(query_ids, N, idf, tp, inverted_index, doc_length, doc_unique,
+                                       dir_doc_norm, abs_doc_norm, avg_doc_length,
+                                       k1=k1, b=b, lamb=lamb, mu=mu, delta=delta),
+                          model_weight)
+
+
+def fused_scores(query_ids, N, idf, tp, inverted_index, doc_length, doc_unique,
+                 dir_doc_norm, abs_doc_norm, avg_doc_length,
+                 k1=1.5, b=0.75, lamb=0.1, mu=2000, delta=0.7, models=None, query_counts=None):
+    """fused的打分部分, 返回四个模型未标准化的原始分数.
+
+    idf, tp和avg_doc_length可以来自比inverted_index更大的语料(例如分段索引的全局统计量),
+    这样多个索引的原始分数拼接起来后与一个完整索引的结果相同.
+
+    Args:
+        与fused相同, 没有model_weight.
+        models: 需要计算的模型, 长度为4的bool列表, 分别对应 [BM25, JM, DIR, ABS]. 默认全部计算,
+            不计算的模型对应的行为0.
+        query_counts: 每个查询词重复的次数(参考BM25_LMIR.plan), 默认每个词为1次. 一个词出现c次
+            与在query_ids中重复c次的结果相同, 但是倒排表只遍历一次.
+
+    Return:
+        4 x N 的numpy数组, 按第一维分别为 [BM25, JM, DIR, ABS] 的原始分数.
+    """
+    use_bm25, use_jm, use_dir, use_abs = [True] * 4 if models is None else [bool(m) for m in models]
+    query_counts = [1] * len(query_ids) if query_counts is None else [int(c) for c in query_counts]
+    scores = np.zeros((4, N))
+    background = np.zeros(3)
+    for term_id, count in zip(query_ids, query_counts):
+        p = float(tp[term_id])
+        background -= [count * log(lamb * p), count * log(mu * p), count * log(delta * p)]
+
+        # read the postings once for all selected models
+        doc_ids, tf = postings(inverted_index, term_id)
+        doc_len = doc_length[doc_ids]
+
+        if use_bm25:
+            scores[0, doc_ids] += count * float(idf[term_id]) * (tf * (k1 + 1) /
+                                                                 (tf + k1 * (1 - b + b * doc_len / avg_doc_length)))
+        if use_jm:
+            scores[1, doc_ids] -= count * np.log1p((1 - lamb) * tf / (doc_len * lamb * p))
+        if use_dir:
+            scores[2, doc_ids] -= count * np.log1p(tf / (mu * p))
+        if use_abs:
+            scores[3, doc_ids] -= count * np.log1p(np.maximum(tf - delta, 0) / (delta * doc_unique[doc_ids] * p))
+
+    n_terms = sum(query_counts)
+    if n_terms != 0:
+        if use_jm:
+            scores[1] += background[0]
+        if use_dir:
+            scores[2] += background[1] + n_terms * dir_doc_norm
+        if use_abs:
+            scores[3] += background[2] - n_terms * abs_doc_norm
+
+    return scores
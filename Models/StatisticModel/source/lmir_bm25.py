@@ -1,9 +1,13 @@
+import numpy as np
 import Models.StatisticModel.source.freq_feature as ff
+import Models.StatisticModel.source.inverted_index as ii
+import Models.StatisticModel.source.sparse_feature as sf
+import Models.StatisticModel.source.snapshot as ss
 from Models.StatisticModel.source.freq_feature import cal_corpus_tf, cal_corpus_tp, cal_idf_BM25, cal_all_corpus_tf
 
 
 class BM25_LMIR:
-    def __init__(self, corpora, k1=1.5, b=0.75, lamb=0.1, mu=2000, delta=0.7, epsilon=0.25):
+    def __init__(self, corpora, k1=1.5, b=0.75, lamb=0.1, mu=2000, delta=0.7, epsilon=0.25, backend="index", ranking="exhaustive", impact=None, snapshot=None, workers=1):
         """Initialize the pram that BM25 and LMIR algorithm need.
 
         BM25和LMIR算法的合集类, 实现了以下几个词与句子的相似度衡量方法:
@@ -12,16 +16,42 @@ class BM25_LMIR:
             BM25_LMIR.jelinek_mercer(query_tokens)
             BM25_LMIR.dirichlet(query_tokens)
             BM25_LMIR.absolute_discount(query_tokens)
+
+        以及一次遍历同时计算以上四个模型并加权的:
+
+            BM25_LMIR.fused(query_tokens, model_weight)
+
+        index后端的fused先用BM25_LMIR.plan(query_tokens)生成查询计划(合并重复的词, 去掉不在词表中的词,
+        按idf排序).
+
+        以及只返回前k个BM25结果的:
+
+            BM25_LMIR.BM25_topk(query_tokens, k)
+            BM25_LMIR.BM25_moments(query_tokens)        BM25分数的均值和标准差, 用于标准化前k个结果
+
+        以及一次计算多个查询的:
+
+            BM25_LMIR.score_batch(queries)
+            BM25_LMIR.fused_batch(queries, model_weight)
+
+        索引可以用BM25_LMIR.save_snapshot(root)保存为快照, 之后通过snapshot参数直接加载.
         
         Attribute:
-            需要的特征:
+            需要的特征(词语映射为整数编号, 统计量保存为扁平的numpy数组):
                 N: 语料库的总长度, 为int.              (BM25 & LMIR)
-                all_tp: 所有语料中词的出现概率          (LMIR)
-                all_idf: 所有语料中词的idf             (BM25)
-                corpus_tf: 单个语料中的词的词频         (BM25 & LMIR)
-                corpus_tp: 单个语料中的词的出现概率      (LMIR)
-                corpus_length: 语料库各个句子的长度     (BM25 & LMIR)
+                vocab: 词语到词编号的映射               (BM25 & LMIR)
+                doc_offsets, doc_terms, doc_counts: 每个文档的词频, CSR格式  (BM25 & LMIR)
+                doc_length: 语料库各个句子的长度        (BM25 & LMIR)
+                doc_unique: 每个文档中不重复词语的数量   (LMIR)
+                tp: 所有语料中词的出现概率, float32     (LMIR)
+                idf: 所有语料中词的idf, float32        (BM25)
                 avg_doc_length: 语料库的平均文档长度    (BM25)
+                inverted_index: 词到(文档编号, 词频)的倒排索引  (BM25 & LMIR)
+                bm25_upper_bound: 每个词的BM25贡献上界        (BM25: MaxScore/WAND)
+                impact_index: 预先算好每一项BM25贡献的倒排索引 (BM25: impact)
+
+            dict后端额外保存原始实现需要的字典特征:
+                all_tp, all_idf, corpus_tf, corpus_tp, corpus_length
 
             超参数的定义:
                 k1:         (BM25: algorithm)
@@ -31,7 +61,37 @@ class BM25_LMIR:
                 delta:      (LMIR.ABS: algorithm)
                 epsilon:    (BM25: idf none negative)
 
+            计算后端:
+                backend:    "index" 使用倒排索引只遍历查询词的倒排表(默认),
+                            "sparse" 使用CSR词频矩阵的numpy/scipy向量化实现,
+                            "dict" 使用freq_feature中逐文档遍历的原始实现.
+
+            排序方式(BM25_topk):
+                ranking:    "exhaustive" 计算全部文档的分数后取前k个(默认),
+                            "wand" 使用MaxScore/WAND动态剪枝, 只对可能进入前k个的候选文档打分和排序.
+
+            BM25 impact索引(index后端):
+                impact:     None 查询时计算BM25公式(默认),
+                            "float" 建立索引时预先计算每一项的BM25贡献, 查询时只做累加,
+                            "uint16"/"uint8" 同上, 并把贡献量化为整数以减少内存.
+
+            索引快照:
+                snapshot:   None 根据corpora统计(默认),
+                            snapshot.load_snapshot的返回值, 直接使用快照中的(内存映射的)数组,
+                            此时corpora不会被使用, 可以为None.
+
+            并行建立索引:
+                workers:    分词统计使用的进程数, 默认为1(单进程), None为CPU的数量.
+                            多进程的结果与单进程完全相同.
+
         """
+        assert backend in ("index", "sparse", "dict"), 'backend {} not supported'.format(backend)
+        self.backend = backend
+        assert ranking in ("exhaustive", "wand"), 'ranking {} not supported'.format(ranking)
+        self.ranking = ranking
+        assert impact in (None, "float", "uint16", "uint8"), 'impact {} not supported'.format(impact)
+        self.impact = impact
+
         # Hyper parameter
         self.b = b
         self.k1 = k1
@@ -40,18 +100,141 @@ class BM25_LMIR:
         self.delta = delta
         self.epsilon = epsilon
 
-        # Feature pre-request
-        self.N, \
-        self.all_tp, \
-        self.all_idf, \
-        self.corpus_tf, \
-        self.corpus_tp, \
-        self.corpus_length, \
-        self.avg_doc_length = self.cal_all_feature_for_BM25_lmir(corpora)
+        assert snapshot is None or backend != "dict", 'backend dict cannot be loaded from snapshot'
+        if snapshot is None:
+            # Feature pre-request: vocabulary, per-document counts & inverted index
+            self.N = len(corpora)
+            self.vocab, \
+            self.doc_offsets, \
+            self.doc_terms, \
+            self.doc_counts, \
+            self.doc_length = ii.cal_vocab_and_counts_parallel(corpora, workers=workers)
+            self.avg_doc_length = np.sum(self.doc_length) / self.N
+
+            self.inverted_index = ii.cal_inverted_index(len(self.vocab),
+                                                        self.doc_offsets,
+                                                        self.doc_terms,
+                                                        self.doc_counts)
+            self.tp, \
+            self.idf = ii.cal_term_statistics(self.N, self.inverted_index, epsilon=self.epsilon)
+
+            self.bm25_upper_bound = ii.cal_bm25_upper_bound(self.idf,
+                                                            self.inverted_index,
+                                                            self.doc_length,
+                                                            self.avg_doc_length,
+                                                            k1=self.k1,
+                                                            b=self.b)
+        else:
+            self.load_snapshot(snapshot)
+        self.doc_unique = np.diff(self.doc_offsets).astype(np.float64)
+
+        if self.impact is not None:
+            self.impact_index = ii.cal_bm25_impact_index(self.idf,
+                                                         self.inverted_index,
+                                                         self.doc_length,
+                                                         self.avg_doc_length,
+                                                         k1=self.k1,
+                                                         b=self.b,
+                                                         impact=self.impact)
+
+        # Per-document part of the LMIR background scores
+        self.dir_doc_norm, \
+        self.abs_doc_norm = ii.cal_lmir_doc_norm(self.doc_length, self.doc_unique, mu=self.mu)
+
+        if self.backend == "sparse":
+            self.doc_term, \
+            self.term_doc = sf.cal_sparse_corpus(len(self.vocab),
+                                                 self.doc_offsets,
+                                                 self.doc_terms,
+                                                 self.doc_counts)
+
+        # The original dict features, only kept as the reference implementation
+        if self.backend == "dict":
+            _, \
+            self.all_tp, \
+            self.all_idf, \
+            self.corpus_tf, \
+            self.corpus_tp, \
+            self.corpus_length, \
+            _ = self.cal_all_feature_for_BM25_lmir(corpora)
+
+        # Contribution matrices for score_batch, built on first use
+        self.batch_weights = None
 
         return None
 
 
+    def save_snapshot(self, root, arrays={}, meta={}, keep=ss.SNAPSHOT_KEEP):
+        """把索引保存为root下的一个新版本快照, 参考snapshot.save_snapshot.
+
+        Args:
+            root: 快照的根目录.
+            arrays: 需要一起保存的其它numpy数组(例如文档编号到数据集id的映射), 为Python字典.
+            meta: 需要一起保存的其它描述信息, 为Python字典.
+            keep: 保留的版本数量, 为None时不删除旧的版本.
+
+        Return:
+            新版本快照目录的路径.
+        """
+        term_offsets, post_docs, post_tfs = self.inverted_index
+        index_arrays = {
+            "doc_offsets": self.doc_offsets,
+            "doc_terms": self.doc_terms,
+            "doc_counts": self.doc_counts,
+            "doc_length": self.doc_length,
+            "term_offsets": term_offsets,
+            "post_docs": post_docs,
+            "post_tfs": post_tfs,
+            "tp": self.tp,
+            "idf": self.idf,
+            "bm25_upper_bound": self.bm25_upper_bound,
+        }
+        index_meta = {
+            "N": self.N,
+            "avg_doc_length": float(self.avg_doc_length),
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+        }
+        return ss.save_snapshot(root, self.vocab, dict(index_arrays, **arrays), dict(meta, **index_meta), keep=keep)
+
+    def load_snapshot(self, snapshot):
+        """使用snapshot.load_snapshot加载的快照初始化索引.
+
+        快照中的idf和BM25上界只在超参数epsilon, k1, b与保存时相同时直接使用, 否则根据快照中的
+        倒排索引重新计算. 分片快照(参考shard_index.cal_shard)的idf根据其中保存的全局df和文档数
+        重新计算, 与完整语料库上的idf相同.
+        """
+        self.vocab, arrays, meta = snapshot
+
+        self.N = meta["N"]
+        self.avg_doc_length = meta["avg_doc_length"]
+        self.doc_offsets = arrays["doc_offsets"]
+        self.doc_terms = arrays["doc_terms"]
+        self.doc_counts = arrays["doc_counts"]
+        self.doc_length = arrays["doc_length"]
+        self.inverted_index = (arrays["term_offsets"], arrays["post_docs"], arrays["post_tfs"])
+
+        self.tp, self.idf = arrays["tp"], arrays["idf"]
+        if meta["epsilon"] != self.epsilon and "corpus_df" in arrays:
+            self.tp, \
+            self.idf = ii.cal_term_statistics_from_counts(meta["corpus_N"],
+                                                          arrays["corpus_df"],
+                                                          arrays["corpus_cf"],
+                                                          epsilon=self.epsilon)
+        elif meta["epsilon"] != self.epsilon:
+            self.tp, \
+            self.idf = ii.cal_term_statistics(self.N, self.inverted_index, epsilon=self.epsilon)
+
+        self.bm25_upper_bound = arrays["bm25_upper_bound"]
+        if (meta["epsilon"], meta["k1"], meta["b"]) != (self.epsilon, self.k1, self.b):
+            self.bm25_upper_bound = ii.cal_bm25_upper_bound(self.idf,
+                                                            self.inverted_index,
+                                                            self.doc_length,
+                                                            self.avg_doc_length,
+                                                            k1=self.k1,
+                                                            b=self.b)
+
     def cal_all_feature_for_BM25_lmir(self, corpora):
         """计算BM25和LMIR任务需要的各种特征并返回
 
@@ -117,8 +300,74 @@ class BM25_LMIR:
 
         return N, all_tp, all_idf, corpus_tf, corpus_tp, corpus_length, avg_doc_length
 
+    def query_ids(self, query_tokens):
+        """将查询词转换为词表中的编号, 不在词表中的词直接丢弃."""
+        return [self.vocab[token] for token in query_tokens if token in self.vocab]
+
+    def plan(self, query_tokens):
+        """查询计划: 合并重复的查询词, 去掉不在词表中的词, 并按照idf从大到小排序.
+
+        jieba的全模式分词会产生互相重叠, 经常重复的词. 重复的词合并为一个带次数的词, 打分时倒排表
+        只遍历一次; 不在词表中的词对所有模型的贡献都是0, 直接去掉. idf大(文档频率小, 倒排表短)
+        的词排在前面, 便于剪枝策略提前结束.
+
+        Args:
+            query_tokens: 用来查询的句子, 默认已经进行了分词操作.
+
+        Return:
+            dict{
+                "terms": [查询词, 按执行顺序],
+                "term_ids": [词编号nparray],
+                "counts": [每个词在查询中出现的次数nparray],
+                "idf": [每个词的idf nparray],
+                "df": [每个词的文档频率(倒排表长度)nparray],
+                "dropped": [不在词表中而被去掉的词],
+            }
+        """
+        counts = {}
+        dropped = []
+        for token in query_tokens:
+            if token in self.vocab:
+                counts[token] = counts.get(token, 0) + 1
+            else:
+                dropped.append(token)
+
+        terms = list(counts)
+        term_ids = np.array([self.vocab[token] for token in terms], dtype=np.int64)
+        idf = np.asarray(self.idf[term_ids], dtype=np.float64)
+        order = np.lexsort((term_ids, -idf))
+
+        term_offsets = self.inverted_index[0]
+        return {
+            "terms": [terms[i] for i in order],
+            "term_ids": term_ids[order],
+            "counts": np.array([counts[token] for token in terms], dtype=np.int64)[order],
+            "idf": idf[order],
+            "df": (term_offsets[term_ids + 1] - term_offsets[term_ids])[order],
+            "dropped": dropped,
+        }
+
     def BM25(self, query_tokens):
         """Wrapper for BM25"""
+        if self.backend == "sparse":
+            return sf.BM25(self.query_ids(query_tokens),
+                           self.term_doc,
+                           self.idf,
+                           self.doc_length,
+                           self.avg_doc_length,
+                           k1=self.k1,
+                           b=self.b)
+        if self.backend == "index" and self.impact is not None:
+            return ii.BM25_impact(self.query_ids(query_tokens), self.N, self.impact_index)
+        if self.backend == "index":
+            return ii.BM25(self.query_ids(query_tokens),
+                           self.N,
+                           self.idf,
+                           self.inverted_index,
+                           self.doc_length,
+                           self.avg_doc_length,
+                           k1=self.k1,
+                           b=self.b)
         return ff.BM25(query_tokens, 
                        self.N, 
                        self.all_idf, 
@@ -128,8 +377,58 @@ class BM25_LMIR:
                        k1=self.k1, 
                        b=self.b)
 
+    def BM25_topk(self, query_tokens, k, ranking=None):
+        """只返回BM25分数最高的k个文档.
+
+        Args:
+            query_tokens: 用来查询的句子, 默认已经进行了分词操作.
+            k: 需要返回的结果数量.
+            ranking: "exhaustive" 或 "wand", 默认使用初始化时设定的self.ranking.
+
+        Return:
+            index: 前k个文档的编号, 为numpy数组(分数相同时文档编号小的在前).
+            scores: 前k个文档的BM25分数, 为numpy数组.
+        """
+        ranking = self.ranking if ranking is None else ranking
+        if ranking == "wand":
+            return ii.BM25_wand(self.query_ids(query_tokens),
+                                k,
+                                self.N,
+                                self.idf,
+                                self.inverted_index,
+                                self.doc_length,
+                                self.avg_doc_length,
+                                self.bm25_upper_bound,
+                                k1=self.k1,
+                                b=self.b)
+        return ii.rank_top_k(self.BM25(query_tokens), k)
+
+    def BM25_moments(self, query_tokens):
+        """BM25分数在全部文档上的均值和标准差, 参考inverted_index.BM25_moments."""
+        return ii.BM25_moments(self.query_ids(query_tokens),
+                               self.N,
+                               self.idf,
+                               self.inverted_index,
+                               self.doc_length,
+                               self.avg_doc_length,
+                               k1=self.k1,
+                               b=self.b)
+
     def jelinek_mercer(self, query_tokens):
         """Wrapper for LMIR.JM"""
+        if self.backend == "index":
+            return ii.jelinek_mercer(self.query_ids(query_tokens),
+                                     self.N,
+                                     self.tp,
+                                     self.inverted_index,
+                                     self.doc_length,
+                                     lamb=self.lamb)
+        if self.backend == "sparse":
+            return sf.jelinek_mercer(self.query_ids(query_tokens),
+                                     self.term_doc,
+                                     self.tp,
+                                     self.doc_length,
+                                     lamb=self.lamb)
         return ff.jelinek_mercer(query_tokens, 
                                  self.N, 
                                  self.all_tp, 
@@ -138,6 +437,20 @@ class BM25_LMIR:
     
     def dirichlet(self, query_tokens):
         """Wrapper for LMIR.DIR"""
+        if self.backend == "index":
+            return ii.dirichlet(self.query_ids(query_tokens),
+                                self.N,
+                                self.tp,
+                                self.inverted_index,
+                                self.dir_doc_norm,
+                                mu=self.mu)
+        if self.backend == "sparse":
+            return sf.dirichlet(self.query_ids(query_tokens),
+                                self.term_doc,
+                                self.tp,
+                                self.doc_length,
+                                self.dir_doc_norm,
+                                mu=self.mu)
         return ff.dirichlet(query_tokens, 
                             self.N, 
                             self.all_tp, 
@@ -147,6 +460,22 @@ class BM25_LMIR:
 
     def absolute_discount(self, query_tokens):
         """Wrapper for LMIR.ABS"""
+        if self.backend == "index":
+            return ii.absolute_discount(self.query_ids(query_tokens),
+                                        self.N,
+                                        self.tp,
+                                        self.inverted_index,
+                                        self.doc_unique,
+                                        self.abs_doc_norm,
+                                        delta=self.delta)
+        if self.backend == "sparse":
+            return sf.absolute_discount(self.query_ids(query_tokens),
+                                        self.term_doc,
+                                        self.tp,
+                                        self.doc_length,
+                                        self.doc_unique,
+                                        self.abs_doc_norm,
+                                        delta=self.delta)
         return ff.absolute_discount(query_tokens, 
                                     self.N, 
                                     self.all_tp, 
@@ -154,6 +483,115 @@ class BM25_LMIR:
                                     self.corpus_length, 
                                     delta=self.delta)
 
+    def fused(self, query_tokens, model_weight=[0.25, 0.25, 0.25, 0.25]):
+        """同时计算BM25, JM, DIR, ABS四个模型, 标准化后按model_weight加权求和.
+
+        index后端只遍历一次查询词的倒排表, 其它后端依次调用四个模型后再合并.
+
+        Args:
+            query_tokens: 用来查询的句子, 默认已经进行了分词操作.
+            model_weight: 四个模型的权重, 分别对应 [BM25, JM, DIR, ABS].
+
+        Return:
+            dict{
+                “模型名”: [标准化结果nparray]
+                “ALL”: [加权结果nparray]
+            }
+        """
+        return ii.combine_scores(self.fused_scores(query_tokens), model_weight)
 
-            
+    def fused_scores(self, query_tokens, models=None):
+        """fused的打分部分, 返回BM25, JM, DIR, ABS四个模型未标准化的原始分数.
+
+        Args:
+            query_tokens: 用来查询的句子, 默认已经进行了分词操作.
+            models: 需要计算的模型, 长度为4的bool列表, 默认全部计算. 不计算的模型对应的行为0.
+
+        Return:
+            4 x N 的numpy数组, 按第一维分别为 [BM25, JM, DIR, ABS] 的原始分数.
+        """
+        if self.backend == "index":
+            plan = self.plan(query_tokens)
+            return ii.fused_scores(plan["term_ids"],
+                                   self.N,
+                                   self.idf,
+                                   self.tp,
+                                   self.inverted_index,
+                                   self.doc_length,
+                                   self.doc_unique,
+                                   self.dir_doc_norm,
+                                   self.abs_doc_norm,
+                                   self.avg_doc_length,
+                                   k1=self.k1,
+                                   b=self.b,
+                                   lamb=self.lamb,
+                                   mu=self.mu,
+                                   delta=self.delta,
+                                   models=models,
+                                   query_counts=plan["counts"])
+
+        scores = np.zeros((4, self.N))
+        scorers = [self.BM25, self.jelinek_mercer, self.dirichlet, self.absolute_discount]
+        for i, scorer in enumerate(scorers):
+            if models is None or models[i]:
+                scores[i] = scorer(query_tokens)
+        return scores
+
+    def cal_batch_weights(self):
+        """生成score_batch和fused_batch需要的贡献矩阵, 只在第一次批量查询时计算."""
+        if self.batch_weights is None:
+            self.batch_weights = sf.cal_batch_weights(self.inverted_index,
+                                                      self.N,
+                                                      self.idf,
+                                                      self.tp,
+                                                      self.doc_length,
+                                                      self.doc_unique,
+                                                      self.avg_doc_length,
+                                                      k1=self.k1,
+                                                      b=self.b,
+                                                      lamb=self.lamb,
+                                                      mu=self.mu,
+                                                      delta=self.delta)
+        return self.batch_weights
+
+    def score_batch(self, queries):
+        """一次计算多个查询的BM25, JM, DIR, ABS原始分数.
+
+        所有查询组成一个 Q x V 的稀疏查询词矩阵, 与预先算好的 V x N 贡献矩阵相乘, 一次得到全部结果.
+
+        Args:
+            queries: 多个分好词的查询, 为嵌套的Python列表. For example:
+
+                [["There", "cat"], ["a", "dog"]]
+
+        Return:
+            4 x Q x N 的numpy数组, 按第一维分别为 [BM25, JM, DIR, ABS] 的原始分数.
+        """
+        return sf.score_batch(sf.cal_query_matrix(queries, self.vocab),
+                              self.cal_batch_weights(),
+                              self.dir_doc_norm,
+                              self.abs_doc_norm)
+
+    def fused_batch(self, queries, model_weight=[0.25, 0.25, 0.25, 0.25], all_models=False):
+        """与fused相同, 但是一次计算多个查询.
+
+        Args:
+            queries: 多个分好词的查询, 为嵌套的Python列表.
+            model_weight: 四个模型的权重, 分别对应 [BM25, JM, DIR, ABS].
+            all_models: 是否返回每个模型各自标准化后的结果. 为False时不生成每个模型的
+                Q x N 稠密结果, 只返回加权结果, 速度更快.
+
+        Return:
+            dict{
+                “模型名”: [Q x N 标准化结果nparray] (只在all_models为True时返回)
+                “ALL”: [Q x N 加权结果nparray]
+            }
+        """
+        if all_models:
+            return ii.combine_scores(self.score_batch(queries), model_weight)
 
+        return {"ALL": sf.fused_batch(sf.cal_query_matrix(queries, self.vocab),
+                                      self.cal_batch_weights(),
+                                      self.dir_doc_norm,
+                                      self.abs_doc_norm,
+                                      model_weight)}
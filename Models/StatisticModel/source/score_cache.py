@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+# ------------------Per-term score cache (LRU)---------------------
+# 热门关键词(例如 图书馆, 博物馆, 平面图)几乎出现在每一次查询中, 而它们的分数向量只和词本身有关.
+# 缓存按照最近最少使用(LRU)的顺序淘汰, 总大小不超过max_bytes. 缓存的numpy数组被设置为只读,
+# 调用者原地修改时会直接报错, 而不是悄悄地改坏缓存.
+
+class ScoreCache:
+    def __init__(self, max_bytes=256 * 2 ** 20):
+        """有内存上限的LRU缓存, 值为numpy数组.
+
+        实现了以下几个方法:
+
+            ScoreCache.get(key, compute)    命中时直接返回, 否则调用compute()计算并缓存
+            ScoreCache.stats()              命中, 未命中, 淘汰的次数以及当前的大小
+            ScoreCache.clear()              清空缓存(计数器保留)
+
+        Args:
+            max_bytes: 缓存中所有数组的总字节数上限, 为0时不缓存.
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, compute):
+        """取出key对应的数组, 没有缓存时调用compute()计算.
+
+        Args:
+            key: 缓存的键, 例如查询词.
+            compute: 没有参数的函数, 返回需要缓存的numpy数组.
+
+        Return:
+            只读的numpy数组.
+        """
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        # compute without holding the lock, two threads may both compute a missing key
+        value = compute()
+        value.setflags(write=False)
+        if value.nbytes > self.max_bytes:
+            return value
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = value
+                self.bytes += value.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        """返回缓存的统计信息, 为Python字典."""
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def clear(self):
+        """清空缓存, 命中和未命中的计数保留."""
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
@@ -0,0 +1,384 @@
+import threading
+import numpy as np
+import Models.StatisticModel.source.inverted_index as ii
+
+# ------------------Segmented index (LSM-style incremental update)---------------------
+# 新增的文档写入一个新的小段(segment), 删除的文档只在所在的段中标记为无效(tombstone), 已有的段
+# 从不原地修改倒排表. 所有段共享同一个词表, 全局统计量(df, cf, 文档数, 总长度)在增删时增量维护,
+# 查询时每个段使用全局的idf/tp/平均长度打分, 拼接后与对全部有效文档重新建立索引的结果相同.
+#
+# 段按有效文档数分层(size-tiered): 第t层为有效文档数在[merge_factor^t, merge_factor^(t+1))之间的段.
+# 某一层积累了merge_factor个段时, 后台线程只把这一层的段合并为一个(落到上一层), 并丢弃已经删除的
+# 文档. 大段很少被重写, 每个文档被重写的次数约为log(N)/log(merge_factor).
+#
+# 模型层的包装为TestModel/segmentLmirBm25Model.py, 提供与lmirBm25Model相同的forward, forwardWords和
+# forwardTopK(结果按文档的外部编号返回)以及文档的增删. WAND, 批量查询, 单词缓存, 索引快照和按位置
+# 过滤(docs)依赖固定的文档位置, 不支持分段索引; archLmirBm25Model和检索服务仍然使用完整重建的索引.
+
+class Segment:
+    def __init__(self, keys, doc_offsets, doc_terms, doc_counts, doc_length, V, mu=2000):
+        """一个不可修改的索引段, 只有live标记会在删除文档时改变.
+
+        Args:
+            keys: 每个文档的外部编号(例如annotationId), 为numpy数组.
+            doc_offsets, doc_terms, doc_counts, doc_length: inverted_index.cal_vocab_and_counts生成的文档词频数组.
+            V: 建立段时共享词表的大小.
+            mu: LMIR.DIR的超参数, 用于预先计算背景分数.
+        """
+        self.keys = keys
+        self.doc_offsets = doc_offsets
+        self.doc_terms = doc_terms
+        self.doc_counts = doc_counts
+        self.doc_length = doc_length
+        self.doc_unique = np.diff(doc_offsets).astype(np.float64)
+        self.live = np.ones(len(keys), dtype=bool)
+
+        self.inverted_index = ii.cal_inverted_index(V, doc_offsets, doc_terms, doc_counts)
+        self.dir_doc_norm, \
+        self.abs_doc_norm = ii.cal_lmir_doc_norm(self.doc_length, self.doc_unique, mu=mu)
+
+    def doc_terms_of(self, pos):
+        """返回段中第pos个文档的(词编号, 词频)."""
+        start, end = self.doc_offsets[pos], self.doc_offsets[pos + 1]
+        return self.doc_terms[start:end], self.doc_counts[start:end]
+
+
+def merge_segments(segments, lives, V, mu=2000):
+    """把多个段中的有效文档合并为一个新的段.
+
+    Args:
+        segments: 需要合并的段, 为Python列表.
+        lives: 每个段在合并时的有效文档标记, 为Python列表.
+        V: 共享词表的大小.
+        mu: LMIR.DIR的超参数.
+
+    Return:
+        合并后的段, 文档的顺序与合并前一致.
+    """
+    keys, terms, counts, lengths, sizes = [], [], [], [], []
+    for segment, live in zip(segments, lives):
+        # expand the doc mask to the doc-term entries
+        entry_live = np.repeat(live, np.diff(segment.doc_offsets))
+        keys.append(segment.keys[live])
+        terms.append(segment.doc_terms[entry_live])
+        counts.append(segment.doc_counts[entry_live])
+        lengths.append(segment.doc_length[live])
+        sizes.append(segment.doc_unique[live].astype(np.int64))
+
+    sizes = np.concatenate(sizes)
+    doc_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=doc_offsets[1:])
+    return Segment(np.concatenate(keys),
+                   doc_offsets,
+                   np.concatenate(terms).astype(np.int32),
+                   np.concatenate(counts).astype(np.int32),
+                   np.concatenate(lengths),
+                   V,
+                   mu=mu)
+
+
+class SegmentIndex:
+    def __init__(self, keys=[], corpora=[], k1=1.5, b=0.75, lamb=0.1, mu=2000, delta=0.7, epsilon=0.25,
+                 merge_factor=8, background_merge=True):
+        """支持增量增删文档的BM25和LMIR索引.
+
+        实现了以下几个方法:
+
+            SegmentIndex.add(keys, corpora)         新增(或更新)文档, 写入一个新的段
+            SegmentIndex.remove(keys)               删除文档
+            SegmentIndex.fused(query_tokens, model_weight)
+                                                    与BM25_LMIR.fused相同, 同时返回文档的外部编号
+            SegmentIndex.fused_scores(queries, models)
+                                                    在同一个视图上计算多个查询的原始分数
+            SegmentIndex.merge()                    立即合并所有段(或者给出的段)
+            SegmentIndex.pick_merge()               按层选择需要合并的段
+            SegmentIndex.close()                    停止后台合并线程
+
+        Attribute:
+            vocab: 所有段共享的词语到词编号的映射, 只增不减.
+            segments: 当前所有的段, 为Python列表. 合并时整体替换, 不会原地修改.
+            locations: 文档的外部编号到(段, 段中位置)的映射.
+            df, cf: 每个词在有效文档中的文档频率和总词频, 增删文档时增量更新.
+            N, total_length: 有效文档的数量和总长度.
+
+            超参数的定义与BM25_LMIR相同:
+                k1, b, lamb, mu, delta, epsilon
+
+            段合并:
+                merge_factor:       同一层的段达到这个数量时合并这一层, 同时也是相邻两层的大小之比.
+                background_merge:   True 在后台线程中合并(默认), False 在add中同步合并.
+
+        Args:
+            keys: 初始文档的外部编号, 为Python列表.
+            corpora: 初始文档, 为嵌套的Python列表(已经分好词).
+        """
+        # Hyper parameter
+        self.b = b
+        self.k1 = k1
+        self.mu = mu
+        self.lamb = lamb
+        self.delta = delta
+        self.epsilon = epsilon
+        assert merge_factor >= 2, 'merge_factor should be at least 2'
+        self.merge_factor = merge_factor
+
+        # shared vocabulary & global statistics over live documents
+        self.vocab = {}
+        self.segments = []
+        self.locations = {}
+        self.df = np.zeros(0, dtype=np.int64)
+        self.cf = np.zeros(0, dtype=np.int64)
+        self.N = 0
+        self.total_length = 0
+        self.statistics = None
+
+        # writers hold lock, merges are serialized by merge_lock
+        self.lock = threading.Lock()
+        self.merge_lock = threading.Lock()
+        self.merge_needed = threading.Condition(self.lock)
+        self.closed = False
+        self.merge_thread = None
+
+        if len(corpora) != 0:
+            self.add(keys, corpora)
+
+        if background_merge:
+            self.merge_thread = threading.Thread(target=self.merge_loop, daemon=True)
+            self.merge_thread.start()
+
+    # ------------------Write path---------------------
+
+    def add(self, keys, corpora):
+        """新增文档, 已经存在的外部编号视为更新(先删除旧的文档).
+
+        Args:
+            keys: 文档的外部编号, 为Python列表.
+            corpora: 分好词的文档, 为嵌套的Python列表, 与keys一一对应.
+        """
+        assert len(keys) == len(corpora), 'keys and corpora should have the same length'
+        assert len(set(keys)) == len(keys), 'keys should be unique'
+        if len(keys) == 0:
+            return
+
+        with self.lock:
+            self.remove_locked([key for key in keys if key in self.locations])
+
+            # tokenize into the shared vocabulary, then build the segment
+            _, doc_offsets, doc_terms, doc_counts, doc_length = ii.cal_vocab_and_counts(corpora, vocab=self.vocab)
+            segment = Segment(np.array(keys), doc_offsets, doc_terms, doc_counts, doc_length, len(self.vocab), mu=self.mu)
+
+            self.grow(len(self.vocab))
+            self.df += np.bincount(doc_terms, minlength=len(self.vocab))
+            self.cf += np.bincount(doc_terms, weights=doc_counts, minlength=len(self.vocab)).astype(np.int64)
+            self.N += len(keys)
+            self.total_length += int(np.sum(doc_length))
+            self.statistics = None
+
+            self.segments = self.segments + [segment]
+            for pos, key in enumerate(keys):
+                self.locations[key] = (segment, pos)
+
+            merge_now = self.pick_merge_locked() is not None
+            if merge_now:
+                self.merge_needed.notify()
+
+        # without the background thread, merge tier by tier until no tier is full
+        while merge_now and self.merge_thread is None:
+            self.merge(self.pick_merge())
+            merge_now = self.pick_merge() is not None
+
+    def remove(self, keys):
+        """删除文档, 不存在的外部编号会被忽略.
+
+        Args:
+            keys: 需要删除的文档的外部编号, 为Python列表.
+        """
+        with self.lock:
+            self.remove_locked([key for key in keys if key in self.locations])
+
+    def remove_locked(self, keys):
+        """在持有self.lock时删除文档, 并从全局统计量中减去它们的贡献."""
+        for key in keys:
+            segment, pos = self.locations.pop(key)
+            segment.live[pos] = False
+
+            terms, counts = segment.doc_terms_of(pos)
+            self.df[terms] -= 1
+            self.cf[terms] -= counts
+            self.N -= 1
+            self.total_length -= int(segment.doc_length[pos])
+        if len(keys) != 0:
+            self.statistics = None
+
+    def grow(self, V):
+        """词表变大时扩展全局统计量的数组."""
+        if V > len(self.df):
+            self.df = np.concatenate((self.df, np.zeros(V - len(self.df), dtype=np.int64)))
+            self.cf = np.concatenate((self.cf, np.zeros(V - len(self.cf), dtype=np.int64)))
+
+    # ------------------Merge---------------------
+
+    def tier(self, segment):
+        """段所在的层, 由段中有效文档的数量决定."""
+        size, tier = int(np.sum(segment.live)), 0
+        while size >= self.merge_factor:
+            size //= self.merge_factor
+            tier += 1
+        return tier
+
+    def pick_merge(self):
+        """返回最低的一个已满(至少merge_factor个段)的层中的所有段, 没有已满的层时返回None."""
+        with self.lock:
+            return self.pick_merge_locked()
+
+    def pick_merge_locked(self):
+        """在持有self.lock时调用的pick_merge."""
+        tiers = {}
+        for segment in self.segments:
+            tiers.setdefault(self.tier(segment), []).append(segment)
+        full = [tier for tier, segments in tiers.items() if len(segments) >= self.merge_factor]
+        return tiers[min(full)] if len(full) != 0 else None
+
+    def merge(self, segments=None):
+        """把给出的段(默认为当前所有的段)合并为一个, 合并期间仍然可以查询和增删文档.
+
+        合并后的段放在被合并的段中第一个的位置, 没有被合并的段不受影响.
+
+        Args:
+            segments: 需要合并的段, 为self.segments中的段组成的Python列表, 默认为None(所有的段).
+        """
+        with self.merge_lock:
+            with self.lock:
+                # segments are only removed by merges, which are serialized by merge_lock,
+                # so a stale pick only loses the segments an earlier merge already replaced
+                installed = {id(segment) for segment in self.segments}
+                segments = [segment for segment in (self.segments if segments is None else segments)
+                            if id(segment) in installed]
+                lives = [segment.live.copy() for segment in segments]
+                V = len(self.vocab)
+            if len(segments) == 0 or (len(segments) == 1 and np.all(lives[0])):
+                return
+
+            # the expensive part runs without blocking writers
+            merged = merge_segments(segments, lives, V, mu=self.mu)
+
+            with self.lock:
+                # documents removed while merging
+                offset = 0
+                for segment, live in zip(segments, lives):
+                    removed = live & ~segment.live
+                    if np.any(removed):
+                        merged.live[offset + np.cumsum(live)[removed] - 1] = False
+                    offset += int(np.sum(live))
+
+                # the merged segment takes the place of the first merged one
+                merged_ids = {id(segment) for segment in segments}
+                installed = []
+                for segment in self.segments:
+                    if id(segment) not in merged_ids:
+                        installed.append(segment)
+                    elif id(segment) == id(segments[0]):
+                        installed.append(merged)
+                self.segments = installed
+                for pos, key in enumerate(merged.keys.tolist()):
+                    if merged.live[pos]:
+                        self.locations[key] = (merged, pos)
+
+    def merge_loop(self):
+        """后台合并线程, 有已满的层时合并这一层."""
+        while True:
+            with self.lock:
+                while not self.closed and self.pick_merge_locked() is None:
+                    self.merge_needed.wait()
+                if self.closed:
+                    return
+                segments = self.pick_merge_locked()
+            self.merge(segments)
+
+    def close(self):
+        """停止后台合并线程."""
+        with self.lock:
+            self.closed = True
+            self.merge_needed.notify()
+        if self.merge_thread is not None:
+            self.merge_thread.join()
+
+    # ------------------Read path---------------------
+
+    def cal_statistics(self):
+        """根据增量维护的df, cf计算全局的tp, idf和平均文档长度, 在下一次增删之前缓存结果.
+
+        需要在持有self.lock时调用.
+        """
+        if self.statistics is None:
+            tp, idf = ii.cal_term_statistics_from_counts(self.N, self.df, self.cf, epsilon=self.epsilon)
+            avg_doc_length = self.total_length / self.N if self.N != 0 else 0
+            self.statistics = (tp, idf, avg_doc_length)
+        return self.statistics
+
+    def fused_scores(self, queries, models=None):
+        """在同一个一致的视图上计算多个查询在所有段上的BM25, JM, DIR, ABS原始分数.
+
+        所有查询使用同一组段和同一份全局统计量, 查询期间并发的增删只影响之后的查询, 所以每个查询的
+        分数都与keys一一对应(例如forwardWords对每个词分别打分后再加权求和).
+
+        Args:
+            queries: 多个分好词的查询, 为嵌套的Python列表.
+            models: 需要计算的模型, 长度为4的bool列表, 默认全部计算. 不计算的模型对应的行为0.
+
+        Return:
+            keys: 有效文档的外部编号, 为numpy数组.
+            scores: 每个查询一个 4 x len(keys) 的numpy数组, 与BM25_LMIR.fused_scores相同(未标准化).
+        """
+        # a consistent view: concurrent writes only affect later queries
+        with self.lock:
+            tp, idf, avg_doc_length = self.cal_statistics()
+            segments = self.segments
+            lives = [segment.live.copy() for segment in segments]
+            query_ids = [[self.vocab[token] for token in query_tokens
+                          if token in self.vocab and self.df[self.vocab[token]] > 0]
+                         for query_tokens in queries]
+
+        keys = [segment.keys[live] for segment, live in zip(segments, lives)]
+        scores = [[] for _ in queries]
+        for segment, live in zip(segments, lives):
+            for i, term_ids in enumerate(query_ids):
+                segment_scores = ii.fused_scores(term_ids,
+                                                 len(segment.keys),
+                                                 idf,
+                                                 tp,
+                                                 segment.inverted_index,
+                                                 segment.doc_length,
+                                                 segment.doc_unique,
+                                                 segment.dir_doc_norm,
+                                                 segment.abs_doc_norm,
+                                                 avg_doc_length,
+                                                 k1=self.k1,
+                                                 b=self.b,
+                                                 lamb=self.lamb,
+                                                 mu=self.mu,
+                                                 delta=self.delta,
+                                                 models=models)
+                scores[i].append(segment_scores[:, live])
+
+        if len(segments) == 0:
+            return np.zeros(0), [np.zeros((len(ii.MODEL_NAMES), 0)) for _ in queries]
+        return np.concatenate(keys), [np.concatenate(score, axis=1) for score in scores]
+
+    def fused(self, query_tokens, model_weight=[0.25, 0.25, 0.25, 0.25]):
+        """在所有段上同时计算BM25, JM, DIR, ABS四个模型, 标准化后按model_weight加权求和.
+
+        与对当前全部有效文档建立BM25_LMIR并调用fused的结果相同.
+
+        Args:
+            query_tokens: 用来查询的句子, 默认已经进行了分词操作.
+            model_weight: 四个模型的权重, 分别对应 [BM25, JM, DIR, ABS].
+
+        Return:
+            keys: 每个结果对应的文档外部编号, 为numpy数组.
+            result: 与BM25_LMIR.fused的返回值相同, 与keys一一对应.
+        """
+        keys, (scores,) = self.fused_scores([query_tokens])
+        if len(keys) == 0:
+            return keys, {name: np.zeros(0) for name in ii.MODEL_NAMES + ["ALL"]}
+        return keys, ii.combine_scores(scores, model_weight)
@@ -0,0 +1,300 @@
+import os
+import json
+import threading
+import multiprocessing
+import numpy as np
+import Models.StatisticModel.source.inverted_index as ii
+import Models.StatisticModel.source.snapshot as ss
+from Models.StatisticModel.source.lmir_bm25 import BM25_LMIR
+
+# ------------------Sharded index (scatter-gather)---------------------
+# 文档按顺序切分为若干个分片(shard), 每个分片是一个只包含这部分文档的BM25_LMIR快照, 但是idf, tp和
+# 平均文档长度使用整个语料库的全局值, 所以分片上的原始分数与完整索引中对应的部分完全相同.
+# 每个分片由一个工作进程内存映射并打分, 协调进程(ShardCoordinator)分两轮完成一次查询:
+#
+#     1. 每个分片计算四个模型的原始分数, 返回文档数, 均值以及中心化的4 x 4 Gram矩阵. 协调进程
+#        按照并行方差公式合并, 得到与完整索引相同的全局均值和标准差.
+#     2. 每个分片按全局的标准化系数计算加权结果, 返回自己的前k个. 协调进程合并后取前k个,
+#        再用(由第一轮的统计量直接算出的)加权结果的全局均值和标准差做最后一次标准化.
+#
+# 分片同时保存全局的df, cf和文档数(corpus_df, corpus_cf, corpus_N), 加载时epsilon与保存时不同也能
+# 重新算出全局的idf, 而不是只根据分片自己的倒排表.
+#
+# 加权结果只在z-score之前合并统计量, 所以与lmirBm25Model.forwardTopK的结果一致
+# (浮点求和顺序不同, 分数可能有1e-12量级的差别).
+#
+# 工作进程退出(或者超过timeout没有回复)时, 查询抛出ShardError而不是一直等待, 之后协调进程不再可用.
+#
+# 目前ShardCoordinator是一个独立的组件, 只提供search(前k个加权结果), 没有接入lmirBm25Model,
+# archLmirBm25Model和检索服务(它们仍然在一个进程中对整个语料库打分). 使用时需要先用save_shards
+# 保存分片, 再自己创建ShardCoordinator.
+
+MODEL_SIGNS = np.array([1, -1, -1, -1])
+
+
+class ShardError(RuntimeError):
+    """分片工作进程退出或者没有按时回复."""
+
+
+def cal_shard(model, start, end):
+    """从一个完整的BM25_LMIR中取出第start到end个文档组成的分片.
+
+    Args:
+        model: 完整语料库上的BM25_LMIR.
+        start, end: 分片的文档范围[start, end).
+
+    Return:
+        (vocab, arrays, meta), 与snapshot.load_snapshot的返回值格式相同, 可以直接作为
+        BM25_LMIR的snapshot参数, 也可以用snapshot.save_snapshot保存.
+    """
+    doc_offsets = np.asarray(model.doc_offsets[start:end + 1]) - model.doc_offsets[start]
+    entries = slice(model.doc_offsets[start], model.doc_offsets[end])
+    doc_terms = np.asarray(model.doc_terms[entries])
+    doc_counts = np.asarray(model.doc_counts[entries])
+    doc_length = np.asarray(model.doc_length[start:end])
+
+    # global vocabulary, so term ids and idf/tp are shared by every shard
+    term_offsets, post_docs, post_tfs = ii.cal_inverted_index(len(model.vocab), doc_offsets, doc_terms, doc_counts)
+    # corpus wide df and cf, so idf can be recomputed for another epsilon
+    global_offsets, _, global_tfs = model.inverted_index
+    V = len(global_offsets) - 1
+    corpus_df = np.diff(global_offsets)
+    corpus_cf = np.bincount(np.repeat(np.arange(V), corpus_df), weights=global_tfs, minlength=V)
+
+    bm25_upper_bound = ii.cal_bm25_upper_bound(model.idf,
+                                               (term_offsets, post_docs, post_tfs),
+                                               doc_length,
+                                               model.avg_doc_length,
+                                               k1=model.k1,
+                                               b=model.b)
+    arrays = {
+        "doc_offsets": doc_offsets,
+        "doc_terms": doc_terms,
+        "doc_counts": doc_counts,
+        "doc_length": doc_length,
+        "term_offsets": term_offsets,
+        "post_docs": post_docs,
+        "post_tfs": post_tfs,
+        "tp": model.tp,
+        "idf": model.idf,
+        "bm25_upper_bound": bm25_upper_bound,
+        "corpus_df": corpus_df,
+        "corpus_cf": corpus_cf,
+    }
+    meta = {
+        "N": end - start,
+        "corpus_N": model.N,
+        "doc_start": start,
+        "avg_doc_length": float(model.avg_doc_length),
+        "k1": model.k1,
+        "b": model.b,
+        "epsilon": model.epsilon,
+    }
+    return model.vocab, arrays, meta
+
+
+def save_shards(model, root, n_shards):
+    """把完整的BM25_LMIR切分为n_shards个分片快照, 保存在root/shard000, root/shard001, ...
+
+    Args:
+        model: 完整语料库上的BM25_LMIR.
+        root: 分片快照的根目录.
+        n_shards: 分片的数量.
+
+    Return:
+        每个分片的快照根目录, 为Python列表.
+    """
+    bounds = np.linspace(0, model.N, n_shards + 1).astype(np.int64)
+    paths = []
+    for i in range(n_shards):
+        path = os.path.join(root, "shard{:03d}".format(i))
+        ss.save_snapshot(path, *cal_shard(model, int(bounds[i]), int(bounds[i + 1])))
+        paths.append(path)
+
+    with open(os.path.join(root, "shards.json"), "w", encoding="utf-8") as f:
+        json.dump({"N": model.N, "shards": [os.path.basename(path) for path in paths]}, f, indent=4)
+    return paths
+
+
+def merge_moments(moments):
+    """合并每个分片的(文档数, 均值, 中心化Gram矩阵), 参考Chan et al.的并行方差公式.
+
+    Return:
+        N: 总文档数.
+        mean: 全局均值.
+        gram: 全局的中心化Gram矩阵, 对角线除以N即为方差.
+    """
+    N = sum(n for n, _, _ in moments)
+    mean = sum(n * shard_mean for n, shard_mean, _ in moments) / N
+    gram = sum(shard_gram + n * np.outer(shard_mean - mean, shard_mean - mean)
+               for n, shard_mean, shard_gram in moments)
+    return N, mean, gram
+
+
+def local_top_k(scores, k):
+    """取出分数最大的k个位置(分数相同时位置小的在前), k为0时返回全部."""
+    if 0 < k < len(scores):
+        # every score tied with the k'th one is a candidate
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        candidates = np.nonzero(scores >= kth)[0]
+    else:
+        candidates = np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k] if k > 0 else order]
+
+
+def shard_worker(conn, path, hyper_parameter):
+    """分片工作进程: 内存映射一个分片快照, 然后按协调进程的请求打分.
+
+    请求:
+        ("moments", query_tokens): 计算原始分数并返回(文档数, 均值, 中心化Gram矩阵).
+        ("top_k", coef, center, k): 返回加权结果 sum(coef * (原始分数 - center)) 的前k个
+            (全局文档编号, 加权结果).
+        ("close",): 退出.
+    """
+    snapshot = ss.load_snapshot(path)
+    doc_start = snapshot[2]["doc_start"]
+    model = BM25_LMIR(None, snapshot=snapshot, **hyper_parameter)
+
+    scores = None
+    while True:
+        request = conn.recv()
+        if request[0] == "moments":
+            scores = model.fused_scores(request[1])
+            mean = np.mean(scores, axis=1)
+            centered = scores - mean[:, None]
+            conn.send((model.N, mean, centered @ centered.T))
+        elif request[0] == "top_k":
+            _, coef, center, k = request
+            # elementwise in a fixed order, so equal docs get equal results in every shard
+            weighted = np.zeros(model.N)
+            for m in range(len(coef)):
+                weighted += coef[m] * (scores[m] - center[m])
+            index = local_top_k(weighted, k)
+            conn.send((index + doc_start, weighted[index]))
+        else:
+            conn.close()
+            return
+
+
+class ShardCoordinator:
+    def __init__(self, root, model_weight=[0.25, 0.25, 0.25, 0.25], k1=1.5, b=0.75, lamb=0.1, mu=2000, delta=0.7, epsilon=0.25,
+                 timeout=None):
+        """为save_shards保存的每个分片启动一个工作进程, 并把查询分发给它们.
+
+            ShardCoordinator.search(query_tokens, k)    前k个加权结果, 与lmirBm25Model.forwardTopK相同
+            ShardCoordinator.close()                    关闭所有工作进程
+
+        Args:
+            root: save_shards的根目录.
+            model_weight: 四个模型的权重, 分别对应 [BM25, JM, DIR, ABS].
+            k1, b, lamb, mu, delta, epsilon: 各个模型的超参数, 与BM25_LMIR相同.
+            timeout: 等待每个分片回复的最长秒数, 默认为None(一直等待, 工作进程退出时仍然会抛出ShardError).
+        """
+        with open(os.path.join(root, "shards.json"), encoding="utf-8") as f:
+            shards = json.load(f)
+        self.N = shards["N"]
+        self.model_weight = np.asarray(model_weight, dtype=np.float64)
+        self.timeout = timeout
+        self.error = None
+
+        hyper_parameter = {"k1": k1, "b": b, "lamb": lamb, "mu": mu, "delta": delta, "epsilon": epsilon}
+        self.conns = []
+        self.workers = []
+        for name in shards["shards"]:
+            conn, worker_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=shard_worker,
+                                             args=(worker_conn, os.path.join(root, name), hyper_parameter),
+                                             daemon=True)
+            worker.start()
+            # only the worker holds its end, so recv() sees EOF when the worker dies
+            worker_conn.close()
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+        # one query at a time, the workers keep the raw scores between the two rounds
+        self.lock = threading.Lock()
+
+    def scatter(self, request):
+        """把同一个请求发给所有分片, 并按分片顺序收集结果.
+
+        某个分片的工作进程退出或者超过timeout没有回复时, 其它分片的管道中可能还有没有读取的回复,
+        所以终止所有的工作进程并抛出ShardError, 之后的查询也抛出同一个错误.
+        """
+        if self.error is not None:
+            raise ShardError("shard coordinator is unusable: {}".format(self.error))
+        try:
+            for conn in self.conns:
+                conn.send(request)
+            results = []
+            for i, conn in enumerate(self.conns):
+                if self.timeout is not None and not conn.poll(self.timeout):
+                    raise ShardError("shard {} did not reply within {}s".format(i, self.timeout))
+                results.append(conn.recv())
+            return results
+        except (EOFError, OSError, ShardError) as e:
+            self.error = e if isinstance(e, ShardError) else ShardError("shard worker exited ({!r})".format(e))
+            self.terminate()
+            raise self.error
+
+    def search(self, query_tokens, k=0):
+        """在所有分片上查询, 返回加权结果最高的k个文档.
+
+        Args:
+            query_tokens: 用来查询的句子, 默认已经进行了分词操作.
+            k: 需要返回的结果数量, 0表示返回全部结果.
+
+        Return:
+            dict{
+                "index": [前k个结果的全局位置nparray]
+                "score": [前k个结果的加权结果nparray, 与forward的"ALL"相同]
+            }
+        """
+        with self.lock:
+            N, mean, gram = merge_moments(self.scatter(("moments", list(query_tokens))))
+
+            # z-score of every model, rows with zero std are kept as is (see standardization)
+            sigma = np.sqrt(np.diag(gram) / N)
+            zero = ii.is_zero_std(sigma, mean)
+            coef = MODEL_SIGNS * self.model_weight / np.where(zero, 1, sigma)
+            center = np.where(zero, 0, mean)
+
+            # mean and std of the weighted sum follow from the same moments
+            weighted_mean = coef @ (mean - center)
+            weighted_sigma = np.sqrt(max(coef @ gram @ coef / N, 0))
+
+            parts = self.scatter(("top_k", coef, center, k))
+
+        index = np.concatenate([part[0] for part in parts])
+        score = np.concatenate([part[1] for part in parts])
+        order = local_top_k(score, k)
+        index, score = index[order], score[order]
+
+        if not ii.is_zero_std(weighted_sigma, weighted_mean):
+            score = (score - weighted_mean) / weighted_sigma
+        return {
+            "index": index,
+            "score": score,
+        }
+
+    def terminate(self):
+        """强制结束所有工作进程并关闭管道."""
+        for conn, worker in zip(self.conns, self.workers):
+            if worker.is_alive():
+                # SIGKILL, a stopped (hung) worker would not handle SIGTERM
+                worker.kill()
+            worker.join()
+            conn.close()
+
+    def close(self):
+        """关闭所有工作进程."""
+        if self.error is not None:
+            return
+        for conn, worker in zip(self.conns, self.workers):
+            try:
+                conn.send(("close",))
+            except OSError:
+                pass
+            worker.join()
+            conn.close()
+        self.error = ShardError("shard coordinator is closed")
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import shutil
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks (Windows), mapped files cannot be removed there anyway
+    fcntl = None
+
+# ------------------Index snapshot (Persist & mmap load)---------------------
+# 离线把索引保存为一个快照目录, 服务启动时直接用np.load(mmap_mode='r')映射到内存, 不再重新分词和统计.
+# 多个进程映射同一个快照时共享操作系统的页缓存. 快照目录的结构:
+#
+#     <root>/
+#         CURRENT               最新的完整快照版本号
+#         00001/
+#             meta.json         格式版本, 超参数以及其它描述信息
+#             vocab.json        按词编号排列的词语列表
+#             <name>.npy        各个numpy数组
+#         00002/
+#             ...
+#
+# 每次保存都会写一个新的版本目录, 写完之后才更新CURRENT, 所以正在使用旧版本的进程不受影响.
+#
+# 发布新版本之后只保留最新的keep个版本, 更旧的版本会被删除, 但是仍然被映射的版本不会被删除:
+# load_snapshot在版本目录的LOCK文件上加共享锁(fcntl.flock), 直到release_snapshot或者进程退出,
+# 删除时需要先拿到这个文件的排它锁.
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_KEEP = 3
+
+# version directories mapped by this process, path -> open LOCK file holding a shared lock
+_leases = {}
+
+
+def version_name(version):
+    """版本号对应的目录名, version可以是int或者目录名(例如 2, "2", "00002"), 都得到 "00002"."""
+    name = str(version)
+    if not name.isdigit():
+        raise ValueError("snapshot version {!r} is not a version number".format(version))
+    return "{:05d}".format(int(name))
+
+
+def version_path(root, version):
+    """版本目录的绝对路径, 也是_leases的键."""
+    return os.path.abspath(os.path.join(root, version_name(version)))
+
+
+def lease(path):
+    """在版本目录path的LOCK文件上加共享锁, 表示这个版本正在被使用."""
+    if path in _leases:
+        return
+    lock = open(os.path.join(path, "LOCK"), "a")
+    if fcntl is not None:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+    _leases[path] = lock
+
+
+def release_snapshot(root, version):
+    """释放load_snapshot对一个版本加的共享锁, 调用之前应该已经不再使用这个版本的数组.
+
+    version与load_snapshot相同, 可以是int或者目录名(参考version_name).
+    """
+    lock = _leases.pop(version_path(root, version), None)
+    if lock is not None:
+        lock.close()
+
+
+def prune_snapshots(root, keep=SNAPSHOT_KEEP):
+    """删除root下除了最新的keep个版本(以及CURRENT指向的版本)之外的版本, 跳过仍然被映射的版本.
+
+    Args:
+        root: 快照的根目录.
+        keep: 保留的版本数量, 不小于1.
+
+    Return:
+        被删除的版本号, 为Python列表.
+    """
+    assert keep >= 1, 'keep should be at least 1'
+    with open(os.path.join(root, "CURRENT")) as f:
+        current = f.read().strip()
+    versions = sorted((name for name in os.listdir(root) if name.isdigit()), key=int)
+
+    removed = []
+    for version in versions[:-keep]:
+        path = version_path(root, version)
+        if version == current or path in _leases:
+            continue
+        with open(os.path.join(path, "LOCK"), "a") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # still mapped by another process
+                    continue
+            try:
+                shutil.rmtree(path)
+            except OSError:
+                continue
+        removed.append(version)
+    return removed
+
+
+def save_snapshot(root, vocab, arrays, meta, keep=SNAPSHOT_KEEP):
+    """把词表和numpy数组保存为root下的一个新版本快照, 发布之后删除旧的版本(参考prune_snapshots).
+
+    Args:
+        root: 快照的根目录, 不存在时会自动创建.
+        vocab: 词语到词编号的映射, 为Python字典.
+        arrays: 数组名到numpy数组的映射, 为Python字典.
+        meta: 需要一起保存的描述信息, 为可以序列化为json的Python字典.
+        keep: 保留的版本数量(包括新版本), 默认为SNAPSHOT_KEEP, 为None时不删除旧的版本.
+
+    Return:
+        新版本快照目录的路径.
+    """
+    os.makedirs(root, exist_ok=True)
+    versions = [int(name) for name in os.listdir(root) if name.isdigit()]
+    version = version_name(max(versions, default=0) + 1)
+    path = os.path.join(root, version)
+    os.makedirs(path)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + ".npy"), np.ascontiguousarray(array))
+
+    # vocab is stored in term id order
+    tokens = [None] * len(vocab)
+    for token, term_id in vocab.items():
+        tokens[term_id] = token
+    with open(os.path.join(path, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(tokens, f, ensure_ascii=False)
+
+    meta = dict(meta, format=SNAPSHOT_FORMAT, version=version, arrays=sorted(arrays), created=time.time())
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=4)
+
+    # publish the new version atomically
+    current = os.path.join(root, "CURRENT")
+    with open(current + ".tmp", "w") as f:
+        f.write(version)
+    os.replace(current + ".tmp", current)
+
+    if keep is not None:
+        prune_snapshots(root, keep)
+    return path
+
+
+def load_snapshot(root, version=None):
+    """加载快照, numpy数组以只读的方式映射到内存.
+
+    这个版本在release_snapshot或者进程退出之前不会被prune_snapshots删除.
+
+    Args:
+        root: 快照的根目录.
+        version: 需要加载的版本号(int或者目录名, 参考version_name), 默认加载CURRENT指向的最新版本.
+
+    Return:
+        vocab: 词语到词编号的映射, 为Python字典.
+        arrays: 数组名到numpy.memmap的映射, 为Python字典.
+        meta: 保存快照时的描述信息, 为Python字典.
+    """
+    if version is None:
+        with open(os.path.join(root, "CURRENT")) as f:
+            version = f.read().strip()
+    path = version_path(root, version)
+    lease(path)
+
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    assert meta["format"] == SNAPSHOT_FORMAT, 'snapshot format {} not supported'.format(meta["format"])
+
+    with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+        vocab = {token: term_id for term_id, token in enumerate(json.load(f))}
+
+    arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in meta["arrays"]}
+
+    return vocab, arrays, meta
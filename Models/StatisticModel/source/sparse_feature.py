@@ -0,0 +1,389 @@
+import numpy as np
+from scipy import sparse
+from Models.StatisticModel.source.inverted_index import standardization, is_zero_std, cal_lmir_doc_norm, MODEL_NAMES
+
+# fused_batch中方差的各部分相互抵消(小于 CANCEL_RTOL 倍的各部分之和), 或者标准差小于 CANCEL_RTOL 倍的均值
+# (接近常数的行)时, 舍入误差可能大于真实的方差, 这些行重新用稠密的两遍公式计算
+CANCEL_RTOL = 1e-6
+
+# ------------------Sparse corpus (Preprocessing)---------------------
+# 将语料库保存为 N x V 的CSR词频矩阵(行为文档, 列为词语).
+# 查询时只取出查询词对应的列, 每个模型都变成若干个numpy数组运算.
+
+def cal_sparse_corpus(V, doc_offsets, doc_terms, doc_counts):
+    """根据文档的CSR词频数组生成稀疏矩阵形式的语料库, 直接复用这些数组而不复制.
+
+    Args:
+        V: 词表的大小, 为int.
+        doc_offsets, doc_terms, doc_counts: inverted_index.cal_vocab_and_counts生成的文档词频数组.
+
+    Return:
+        函数返回值, 分别对应:
+
+        doc_term: N x V 的词频矩阵, 为scipy.sparse.csr_matrix.
+        term_doc: 与doc_term内容相同的CSC矩阵, 用来快速取出查询词对应的列.
+    """
+    doc_term = sparse.csr_matrix((doc_counts, doc_terms, doc_offsets),
+                                 shape=(len(doc_offsets) - 1, V))
+    term_doc = doc_term.tocsc()
+    return doc_term, term_doc
+
+
+def query_columns(term_doc, query_ids):
+    """取出查询词对应的列, 返回 N x len(query_ids) 的稠密词频矩阵.
+
+    重复的查询词会得到重复的列, 与原始实现中重复计算查询词的行为一致.
+    """
+    return term_doc[:, query_ids].toarray()
+
+
+# ------------------Statistical feature cal (vectorized)---------------------
+# 公式与freq_feature中的实现一一对应, 输入的query_ids应当已经去掉了不在词表中的词.
+# idf和tp可以是float32数组, 计算时统一转换为float64.
+
+def BM25(query_ids, term_doc, idf, doc_length, avg_doc_length, k1=1.5, b=0.75):
+    """BM25算法的向量化实现, 公式参考freq_feature.BM25.
+
+    Args:
+        query_ids: 查询词在词表中的列编号, 为Python列表.
+        term_doc: cal_sparse_corpus生成的CSC词频矩阵.
+        idf: 按列编号排列的idf值, 为numpy数组.
+        doc_length: 每个文档的长度, 为numpy数组.
+        avg_doc_length: 语料库的平均文档长度.
+        k1: 计算时公式参数, 默认为: 1.5
+        b: 计算时公式参数, 默认为: 0.75
+
+    Return:
+        返回对每一个句子的BM25查询值, 为长度为N的numpy数组.
+    """
+    q_freq = query_columns(term_doc, query_ids).astype(np.float64)
+    norm = k1 * (1 - b + b * doc_length / avg_doc_length)
+    scores = idf[query_ids] * (q_freq * (k1 + 1) / (q_freq + norm[:, None]))
+    return scores.sum(axis=1)
+
+
+def query_postings(term_doc, query_ids):
+    """取出查询词对应列中的非零元素, 即查询词的倒排表.
+
+    Return:
+        doc_ids: 非零元素所在的文档编号.
+        query_pos: 非零元素对应的是第几个查询词.
+        tf: 非零元素的词频.
+    """
+    postings = term_doc[:, query_ids].tocoo()
+    return postings.row, postings.col, postings.data.astype(np.float64)
+
+
+# LMIR使用"背景分数 + 修正项"的分解(参考inverted_index中的说明):
+# 背景分数只和文档长度以及不重复词数有关, 修正项只在查询词的非零元素上计算.
+
+def jelinek_mercer(query_ids, term_doc, tp, doc_length, lamb=0.1):
+    """LMIR.JM的向量化实现, 公式参考freq_feature.jelinek_mercer.
+
+    Args:
+        query_ids: 查询词在词表中的列编号, 为Python列表.
+        term_doc: cal_sparse_corpus生成的CSC词频矩阵.
+        tp: 按列编号排列的词语出现概率, 为numpy数组.
+        doc_length: 每个文档的长度, 为numpy数组.
+        lamb: 在计算LMIR.JM特征的超参数, 默认值为0.1.
+
+    Return:
+        返回对每一个句子的LMIR.JM查询值, 为长度为N的numpy数组.
+    """
+    p = tp[query_ids].astype(np.float64)
+    doc_ids, query_pos, tf = query_postings(term_doc, query_ids)
+    correction = -np.log1p((1 - lamb) * tf / (doc_length[doc_ids] * lamb * p[query_pos]))
+    background = -np.log(lamb * p).sum()
+    return np.bincount(doc_ids, weights=correction, minlength=len(doc_length)) + background
+
+
+def dirichlet(query_ids, term_doc, tp, doc_length, dir_doc_norm, mu=2000):
+    """LMIR.DIR的向量化实现, 公式参考freq_feature.dirichlet.
+
+    Args:
+        query_ids: 查询词在词表中的列编号, 为Python列表.
+        term_doc: cal_sparse_corpus生成的CSC词频矩阵.
+        tp: 按列编号排列的词语出现概率, 为numpy数组.
+        doc_length: 每个文档的长度, 为numpy数组.
+        dir_doc_norm: inverted_index.cal_lmir_doc_norm生成的log(doc_len + mu), 为numpy数组.
+        mu: 在计算LMIR.DIR特征的超参数, 默认值为2000.
+
+    Return:
+        返回对每一个句子的LMIR.DIR查询值, 为长度为N的numpy数组.
+    """
+    if len(query_ids) == 0:
+        return np.zeros(len(doc_length))
+
+    p = tp[query_ids].astype(np.float64)
+    doc_ids, query_pos, tf = query_postings(term_doc, query_ids)
+    correction = -np.log1p(tf / (mu * p[query_pos]))
+    background = -np.log(mu * p).sum() + len(query_ids) * dir_doc_norm
+    return np.bincount(doc_ids, weights=correction, minlength=len(doc_length)) + background
+
+
+def absolute_discount(query_ids, term_doc, tp, doc_length, doc_unique, abs_doc_norm, delta=0.7):
+    """LMIR.ABS的向量化实现, 公式参考freq_feature.absolute_discount.
+
+    Args:
+        query_ids: 查询词在词表中的列编号, 为Python列表.
+        term_doc: cal_sparse_corpus生成的CSC词频矩阵.
+        tp: 按列编号排列的词语出现概率, 为numpy数组.
+        doc_length: 每个文档的长度, 为numpy数组.
+        doc_unique: 每个文档中不重复词语的数量, 为numpy数组.
+        abs_doc_norm: inverted_index.cal_lmir_doc_norm生成的log(d_u / doc_len), 为numpy数组.
+        delta: 在计算LMIR.ABS特征的超参数, 默认值为0.7.
+
+    Return:
+        返回对每一个句子的LMIR.ABS查询值, 为长度为N的numpy数组.
+    """
+    if len(query_ids) == 0:
+        return np.zeros(len(doc_length))
+
+    p = tp[query_ids].astype(np.float64)
+    doc_ids, query_pos, tf = query_postings(term_doc, query_ids)
+    correction = -np.log1p(np.maximum(tf - delta, 0) / (delta * doc_unique[doc_ids] * p[query_pos]))
+    background = -np.log(delta * p).sum() - len(query_ids) * abs_doc_norm
+    return np.bincount(doc_ids, weights=correction, minlength=len(doc_length)) + background
+
+
+# ------------------Batch scoring (many queries at once)---------------------
+# 把每个(词, 文档)对四个模型的贡献预先保存为 V x N 的稀疏矩阵(LMIR只保存修正项), 多个查询
+# 组成 Q x V 的查询词矩阵(值为查询词出现的次数), 一次稀疏矩阵乘法即可得到所有查询的分数:
+#
+#     BM25 = Q @ W_bm25
+#     JM   = Q @ C_jm  + Q @ bg_jm
+#     DIR  = Q @ C_dir + Q @ bg_dir + |q| * log(doc_len + mu)
+#     ABS  = Q @ C_abs + Q @ bg_abs - |q| * log(d_u / doc_len)
+
+def cal_batch_weights(inverted_index, N, idf, tp, doc_length, doc_unique, avg_doc_length,
+                      k1=1.5, b=0.75, lamb=0.1, mu=2000, delta=0.7):
+    """预先计算批量查询需要的每个(词, 文档)对的贡献矩阵和每个词的背景分数.
+
+    Args:
+        inverted_index: inverted_index.cal_inverted_index生成的倒排索引, 即 V x N 词频矩阵的
+            (indptr, indices, data).
+        N: 语料库中的语句条目数, 为int.
+        idf: 按词编号排列的idf值, 为numpy数组.
+        tp: 按词编号排列的词语出现概率, 为numpy数组.
+        doc_length: 每个文档的长度, 为numpy数组.
+        doc_unique: 每个文档中不重复词语的数量, 为numpy数组.
+        avg_doc_length: 语料库的平均文档长度.
+        k1, b, lamb, mu, delta: 各个模型的超参数.
+
+    Return:
+        Python字典, "BM25", "JM", "DIR", "ABS"为 V x N 的CSR贡献矩阵(LMIR为修正项),
+        "JM_background", "DIR_background", "ABS_background"为每个词的背景分数.
+        fused_batch使用的: "stacked"为每个倒排项四个模型的贡献(nnz x 4), "term_sum"为每个词的贡献的和,
+        "term_var"为每个词的贡献(作为长度为N的向量)的中心化平方和(4 x V), "term_doc"为DIR和ABS的贡献与
+        中心化的文档向量的内积.
+    """
+    indptr, doc_ids, tf = inverted_index
+    V = len(indptr) - 1
+    term_ids = np.repeat(np.arange(V), np.diff(indptr))
+    tf = tf.astype(np.float64)
+    doc_len = doc_length[doc_ids]
+    tp = tp.astype(np.float64)
+    p = tp[term_ids]
+
+    def to_matrix(data):
+        return sparse.csr_matrix((data, doc_ids, indptr), shape=(V, N))
+
+    def per_term(values):
+        # sum over the postings of every term, empty terms are 0
+        return np.bincount(term_ids, weights=values, minlength=V)
+
+    contributions = {
+        "BM25": idf.astype(np.float64)[term_ids] * (tf * (k1 + 1) /
+                                                    (tf + k1 * (1 - b + b * doc_len / avg_doc_length))),
+        "JM": -np.log1p((1 - lamb) * tf / (doc_len * lamb * p)),
+        "DIR": -np.log1p(tf / (mu * p)),
+        "ABS": -np.log1p(np.maximum(tf - delta, 0) / (delta * doc_unique[doc_ids] * p)),
+    }
+
+    # per term moments of the contributions for fused_batch, DIR/ABS also against the centered document vectors
+    dir_doc_norm, abs_doc_norm = cal_lmir_doc_norm(doc_length, doc_unique, mu=mu)
+    doc_vectors = {"DIR": dir_doc_norm, "ABS": -abs_doc_norm}
+    doc_centered = {name: vector - np.mean(vector) for name, vector in doc_vectors.items()}
+
+    term_mean = {name: per_term(data) / N for name, data in contributions.items()}
+
+    weights = {name: to_matrix(data) for name, data in contributions.items()}
+    weights.update({
+        "JM_background": -np.log(lamb * tp),
+        "DIR_background": -np.log(mu * tp),
+        "ABS_background": -np.log(delta * tp),
+        "stacked": np.column_stack([contributions[name] for name in MODEL_NAMES]),
+        "term_sum": np.stack([per_term(contributions[name]) for name in MODEL_NAMES]),
+        "term_var": np.stack([per_term((contributions[name] - term_mean[name][term_ids]) ** 2) +
+                              (N - np.diff(indptr)) * term_mean[name] ** 2 for name in MODEL_NAMES]),
+        "term_doc": {name: per_term(contributions[name] * doc_centered[name][doc_ids]) for name in doc_vectors},
+    })
+    return weights
+
+
+def cal_query_matrix(queries, vocab):
+    """把多个查询转换为 Q x V 的CSR查询词矩阵, 值为每个词在查询中出现的次数, 不在词表中的词丢弃.
+
+    Args:
+        queries: 多个分好词的查询, 为嵌套的Python列表. For example:
+
+            [["cat", "dog"], ["wolf", "wolf"]]
+
+        vocab: 词语到词编号的映射, 为Python字典.
+
+    Return:
+        Q x V 的scipy.sparse.csr_matrix.
+    """
+    indptr = [0]
+    indices = []
+    for query in queries:
+        indices += [vocab[token] for token in query if token in vocab]
+        indptr.append(len(indices))
+
+    # duplicated entries are summed up, so repeated tokens are counted repeatedly
+    query_matrix = sparse.csr_matrix((np.ones(len(indices)), indices, indptr),
+                                     shape=(len(queries), len(vocab)))
+    query_matrix.sum_duplicates()
+    return query_matrix
+
+
+def score_batch(query_matrix, batch_weights, dir_doc_norm, abs_doc_norm):
+    """使用稀疏矩阵乘法一次计算所有查询的四个模型的分数.
+
+    Args:
+        query_matrix: cal_query_matrix生成的 Q x V 查询词矩阵.
+        batch_weights: cal_batch_weights生成的贡献矩阵和背景分数.
+        dir_doc_norm, abs_doc_norm: inverted_index.cal_lmir_doc_norm生成的背景分数的文档部分.
+
+    Return:
+        4 x Q x N 的numpy数组, 按第一维分别为 [BM25, JM, DIR, ABS] 的原始分数, 与对每个查询
+        分别调用单个模型的结果一致.
+    """
+    n_terms = np.asarray(query_matrix.sum(axis=1)).ravel()
+    has_terms = (n_terms > 0)[:, None]
+
+    def background(name, doc_norm):
+        per_query = query_matrix @ batch_weights[name + "_background"]
+        if doc_norm is None:
+            return per_query[:, None]
+        return np.where(has_terms, per_query[:, None] + n_terms[:, None] * doc_norm, 0)
+
+    return np.stack([
+        (query_matrix @ batch_weights["BM25"]).toarray(),
+        (query_matrix @ batch_weights["JM"]).toarray() + background("JM", None),
+        (query_matrix @ batch_weights["DIR"]).toarray() + background("DIR", dir_doc_norm),
+        (query_matrix @ batch_weights["ABS"]).toarray() + background("ABS", -abs_doc_norm),
+    ])
+
+
+def fused_batch(query_matrix, batch_weights, dir_doc_norm, abs_doc_norm, model_weight, block_size=64):
+    """一次计算所有查询的加权结果, 与对每个查询调用inverted_index.fused得到的"ALL"一致.
+
+    每个模型的分数都可以写成 稀疏部分 + 每个查询的常数 + |q| * 文档向量. z-score需要的均值和方差
+    由稀疏部分的和, 中心化的平方和以及与文档向量的内积得到: 只有一个词的查询直接使用cal_batch_weights
+    中预先算好的每个词的统计量, 多个词的查询把稀疏部分累加到一个 4 x N 的临时数组中, 只在有倒排项的文档上用两遍公式计算.
+    不需要生成每个模型的 Q x N 稠密结果, 四个模型标准化后的加权和只需要把倒排表一次性散射(bincount)
+    到结果矩阵中. 方差中稀疏部分与文档向量相互抵消的行(接近常数)重新用稠密的两遍公式计算, 标准差为0的
+    判断与standardization相同. 查询按block_size分块计算, 以限制中间结果占用的内存.
+
+    Args:
+        query_matrix: cal_query_matrix生成的 Q x V 查询词矩阵.
+        batch_weights: cal_batch_weights生成的贡献矩阵和背景分数.
+        dir_doc_norm, abs_doc_norm: inverted_index.cal_lmir_doc_norm生成的背景分数的文档部分.
+        model_weight: 四个模型的权重, 分别对应 [BM25, JM, DIR, ABS].
+        block_size: 每一块的查询数量, 默认为64.
+
+    Return:
+        Q x N 的numpy数组, 每一行为一个查询的加权结果.
+    """
+    N = len(dir_doc_norm)
+    Q = query_matrix.shape[0]
+    doc_vectors = {"DIR": dir_doc_norm, "ABS": -abs_doc_norm}
+    doc_means = {name: np.mean(vector) for name, vector in doc_vectors.items()}
+    doc_vars = np.array([np.mean((vector - doc_means[name]) ** 2) for name, vector in doc_vectors.items()])
+    dense_vectors = np.vstack([np.ones(N), doc_vectors["DIR"], doc_vectors["ABS"]])
+    model_signs = np.array([1, -1, -1, -1])
+    model_weight = np.asarray(model_weight, dtype=np.float64)
+
+    # all four matrices share the sparsity pattern of the term matrix
+    indptr, indices = batch_weights["BM25"].indptr, batch_weights["BM25"].indices
+    stacked = batch_weights["stacked"]
+    model_data = [batch_weights[name].data for name in MODEL_NAMES]
+    sparse_part = np.zeros((4, N))
+    touched = np.zeros(N, dtype=bool)
+
+    result = np.empty((Q, N))
+    for start in range(0, Q, block_size):
+        block = query_matrix[start:start + block_size]
+        B = block.shape[0]
+        n_terms = np.asarray(block.sum(axis=1)).ravel()
+        runs = [(q, block.indices[k], block.data[k]) for q in range(B) for k in range(block.indptr[q], block.indptr[q + 1])]
+
+        # moments of the sparse part: mean, centered E[x^2] and the product with the centered document vectors
+        part_mean = (block @ batch_weights["term_sum"].T) / N
+        part_var = np.zeros((B, 4))
+        part_doc = np.column_stack([block @ batch_weights["term_doc"][name] for name in doc_vectors]) / N
+        for q in range(B):
+            begin, end = block.indptr[q], block.indptr[q + 1]
+            if end - begin == 1:
+                part_var[q] = block.data[begin] ** 2 * batch_weights["term_var"][:, block.indices[begin]] / N
+            elif end - begin > 1:
+                for term, count in zip(block.indices[begin:end], block.data[begin:end]):
+                    docs = indices[indptr[term]:indptr[term + 1]]
+                    for m in range(4):
+                        sparse_part[m, docs] += count * model_data[m][indptr[term]:indptr[term + 1]]
+                    touched[docs] = True
+                # documents without postings are all equal to 0
+                docs = np.flatnonzero(touched)
+                for m in range(4):
+                    centered = sparse_part[m, docs] - part_mean[q, m]
+                    part_var[q, m] = (centered @ centered + (N - len(docs)) * part_mean[q, m] ** 2) / N
+                    sparse_part[m, docs] = 0
+                touched[docs] = False
+
+        const = np.zeros((B, 4))
+        for m, name in enumerate(MODEL_NAMES[1:], 1):
+            const[:, m] = block @ batch_weights[name + "_background"]
+        mean = part_mean + const
+        var = part_var.copy()
+        mean[:, 2:] += n_terms[:, None] * np.array([doc_means["DIR"], doc_means["ABS"]])
+        var[:, 2:] += n_terms[:, None] ** 2 * doc_vars + 2 * n_terms[:, None] * part_doc
+        scale = part_var.copy()
+        scale[:, 2:] += n_terms[:, None] ** 2 * doc_vars + 2 * n_terms[:, None] * np.abs(part_doc)
+
+        # the sparse part and the document vector cancel for (nearly) constant rows, these rows are
+        # computed again densely with the two-pass formula of standardization, so are the rows whose std is
+        # close to the rounding error of the mean
+        suspect = (var <= CANCEL_RTOL * scale) | (var <= CANCEL_RTOL ** 2 * mean * mean)
+        for q, m in zip(*np.nonzero(suspect)):
+            x = np.zeros(N) + const[q, m]
+            for run_q, term, count in runs:
+                if run_q == q:
+                    x[indices[indptr[term]:indptr[term + 1]]] += count * stacked[indptr[term]:indptr[term + 1], m]
+            if m >= 2:
+                x += n_terms[q] * dense_vectors[m - 1]
+            mean[q, m] = np.mean(x)
+            var[q, m] = np.mean((x - mean[q, m]) ** 2)
+        sigma = np.sqrt(np.maximum(var, 0))
+
+        # rows with zero std are kept as is by standardization
+        zero = is_zero_std(sigma, mean)
+        coef = model_signs * model_weight / np.where(zero, 1, sigma)
+        constant = (coef * (const - np.where(zero, 0, mean))).sum(axis=1)
+
+        # every (query, term) pair is a contiguous run of postings, weighted by the coefficients of the query
+        lengths = np.array([indptr[term + 1] - indptr[term] for _, term, _ in runs], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        keys = np.empty(ends[-1] if len(ends) else 0, dtype=np.int64)
+        posting_weight = np.empty(len(keys))
+        for (q, term, count), end, length in zip(runs, ends, lengths):
+            np.add(indices[indptr[term]:indptr[term + 1]], q * N, out=keys[end - length:end])
+            np.dot(stacked[indptr[term]:indptr[term + 1]], coef[q] * count, out=posting_weight[end - length:end])
+
+        # sparse part by one bincount, constant and document vectors of all four models in one product
+        out = result[start:start + B]
+        out[:] = np.bincount(keys, weights=posting_weight, minlength=B * N).reshape(B, N)
+        out += np.column_stack([constant, coef[:, 2] * n_terms, coef[:, 3] * n_terms]) @ dense_vectors
+        out[:] = standardization(out)
+
+    return result
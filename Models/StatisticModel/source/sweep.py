@@ -0,0 +1,254 @@
+import os
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import Models.StatisticModel.source.inverted_index as ii
+
+# ------------------Hyper parameter sweep---------------------
+# 语料库的统计量(词表, 倒排索引, 文档长度, df, cf, tp)与超参数无关, 只需要建立一次. 超参数中只有
+# epsilon会改变idf, 其它参数(k1, b, lamb, mu, delta)只出现在打分公式中. 所以对一个查询, 倒排表
+# 只读取一次, 然后把参数网格作为新的一维, 对所有参数组合同时做向量化的计算:
+#
+#     贡献(S x P) = f(参数(S x 1), 倒排表中的词频和文档长度(1 x P))
+#
+# 再按(参数组合, 文档)散列求和得到 4 x S x N 的原始分数, 与BM25_LMIR.fused_scores逐个参数计算的
+# 结果相同. 参数网格按块分给多个进程, 每个进程只在启动时接收一次统计量.
+
+SWEEP_PARAMETERS = ["k1", "b", "lamb", "mu", "delta", "epsilon"]
+SWEEP_DEFAULTS = {"k1": 1.5, "b": 0.75, "lamb": 0.1, "mu": 2000, "delta": 0.7, "epsilon": 0.25}
+
+
+def cal_grid(grid, defaults=SWEEP_DEFAULTS):
+    """把参数网格展开为参数组合的列表.
+
+    Args:
+        grid: 参数名到取值列表的Python字典, 没有给出的参数使用defaults. For example:
+
+            {"k1": [1.2, 1.5], "b": [0.5, 0.75]}
+
+        defaults: 没有给出的参数的取值, 默认为SWEEP_DEFAULTS(BM25_LMIR的默认超参数).
+
+    Return:
+        参数组合组成的列表, 每个元素是包含全部SWEEP_PARAMETERS的字典, 顺序与itertools.product相同.
+    """
+    unknown = set(grid) - set(SWEEP_PARAMETERS)
+    assert not unknown, 'unknown hyper parameters {}'.format(sorted(unknown))
+    values = [list(grid.get(name, [defaults[name]])) for name in SWEEP_PARAMETERS]
+    return [dict(zip(SWEEP_PARAMETERS, setting)) for setting in itertools.product(*values)]
+
+
+def query_postings(query_ids, inverted_index):
+    """把所有查询词的倒排表拼接起来, 每个查询只读取一次.
+
+    Return:
+        positions: 每一项属于第几个查询词, 为numpy数组.
+        doc_ids: 每一项的文档编号, 为numpy数组.
+        tf: 每一项的词频, 为numpy数组.
+    """
+    positions, doc_ids, tf = [], [], []
+    for position, term_id in enumerate(query_ids):
+        docs, freqs = ii.postings(inverted_index, term_id)
+        positions.append(np.full(len(docs), position, dtype=np.int64))
+        doc_ids.append(docs)
+        tf.append(freqs)
+    if len(positions) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    return np.concatenate(positions), np.concatenate(doc_ids).astype(np.int64), np.concatenate(tf).astype(np.float64)
+
+
+def sweep_scores(query_ids, N, idf, tp, inverted_index, doc_length, doc_unique, abs_doc_norm, avg_doc_length, settings,
+                 query_counts=None):
+    """对一组参数组合同时计算四个模型的原始分数.
+
+    Args:
+        query_ids: 查询词的编号, 为Python列表.
+        N: 语料库中的语句条目数, 为int.
+        idf: 每个参数组合对应的idf, S x V 的numpy数组(由各自的epsilon决定).
+        tp: 每个词在所有语料中的出现概率, 为numpy数组.
+        inverted_index: cal_inverted_index生成的倒排索引.
+        doc_length, doc_unique: 每个文档的长度和不重复词语的数量, 为numpy数组.
+        abs_doc_norm: cal_lmir_doc_norm生成的log(d_u / doc_len), 与超参数无关.
+        avg_doc_length: 语料库的平均文档长度.
+        settings: cal_grid生成的参数组合, 长度为S.
+        query_counts: 每个查询词重复的次数(参考BM25_LMIR.plan), 默认每个词为1次.
+
+    Return:
+        4 x S x N 的numpy数组, 第s行与BM25_LMIR(**settings[s]).fused_scores的结果相同.
+    """
+    S = len(settings)
+    scores = np.zeros((4, S, N))
+    if len(query_ids) == 0:
+        return scores
+
+    def column(name):
+        return np.array([setting[name] for setting in settings], dtype=np.float64)[:, None]
+
+    k1, b, lamb, mu, delta = [column(name) for name in ["k1", "b", "lamb", "mu", "delta"]]
+    positions, doc_ids, tf = query_postings(query_ids, inverted_index)
+    p = tp[query_ids].astype(np.float64)
+    counts = np.ones(len(query_ids)) if query_counts is None else np.asarray(query_counts, dtype=np.float64)
+    n_terms = np.sum(counts)
+    doc_len = doc_length[doc_ids]
+
+    # scatter S x P contributions into S x N scores
+    flat = (np.arange(S)[:, None] * N + doc_ids).ravel()
+
+    def scatter(contribution):
+        return np.bincount(flat, weights=contribution.ravel(), minlength=S * N).reshape(S, N)
+
+    term_idf = idf[:, query_ids].astype(np.float64)[:, positions]
+    c = counts[positions]
+    scores[0] = scatter(c * term_idf * (tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len / avg_doc_length))))
+    scores[1] = -scatter(c * np.log1p((1 - lamb) * tf / (doc_len * lamb * p[positions])))
+    scores[2] = -scatter(c * np.log1p(tf / (mu * p[positions])))
+    scores[3] = -scatter(c * np.log1p(np.maximum(tf - delta, 0) / (delta * doc_unique[doc_ids] * p[positions])))
+
+    # background scores, only the DIR one has a per-document part depending on mu
+    scores[1] += -np.sum(counts * np.log(lamb * p), axis=1, keepdims=True)
+    scores[2] += -np.sum(counts * np.log(mu * p), axis=1, keepdims=True) + n_terms * np.log(doc_length + mu)
+    scores[3] += -np.sum(counts * np.log(delta * p), axis=1, keepdims=True) - n_terms * abs_doc_norm
+    return scores
+
+
+def evaluate(result, k, relevant=None):
+    """对一个查询在S个参数组合下的加权结果取前k个, 给出相关文档时计算RR和Recall@k.
+
+    Args:
+        result: S x N 的加权结果.
+        k: 需要返回的结果数量.
+        relevant: 相关文档的编号, 为Python集合, None表示没有标注.
+
+    Return:
+        index: S x k 的前k个文档编号(分数相同时编号小的在前).
+        rr: 长度为S的倒数排名(第一个相关文档排名的倒数), 没有标注时为None.
+        recall: 长度为S的Recall@k, 没有标注时为None.
+    """
+    S, N = result.shape
+    k = min(k, N)
+    index = np.stack([np.lexsort((np.arange(N), -row))[:k] for row in result]) if S > 0 else np.zeros((0, k), dtype=np.int64)
+    if not relevant:
+        return index, None, None
+
+    relevant_ids = np.array(sorted(relevant), dtype=np.int64)
+    best = np.max(result[:, relevant_ids], axis=1, keepdims=True)
+    # the best relevant document ranks after every better document (and equal ones with smaller ids)
+    first = relevant_ids[np.argmax(result[:, relevant_ids] == best, axis=1)]
+    rank = 1 + np.sum(result > best, axis=1) + np.sum((result == best) & (np.arange(N) < first[:, None]), axis=1)
+    recall = np.array([len(relevant.intersection(row.tolist())) for row in index]) / len(relevant_ids)
+    return index, 1 / rank, recall
+
+
+# state of the sweep workers, set once per process by init_sweep_worker
+_sweep_state = None
+
+
+def init_sweep_worker(state):
+    global _sweep_state
+    _sweep_state = state
+
+
+def sweep_chunk(settings):
+    """在一个进程中计算一块参数组合在所有查询上的结果, 统计量来自init_sweep_worker."""
+    (N, df, cf, tp, inverted_index, doc_length, doc_unique, abs_doc_norm, avg_doc_length,
+     queries, model_weight, k, relevant) = _sweep_state
+
+    # only epsilon changes the idf, compute it once per distinct value
+    idf_of = {}
+    for setting in settings:
+        if setting["epsilon"] not in idf_of:
+            idf_of[setting["epsilon"]] = ii.cal_term_statistics_from_counts(N, df, cf, epsilon=setting["epsilon"])[1]
+    idf = np.stack([idf_of[setting["epsilon"]] for setting in settings])
+
+    top_k, rr, recall = [], [], []
+    for q, (query_ids, query_counts) in enumerate(queries):
+        scores = sweep_scores(query_ids, N, idf, tp, inverted_index, doc_length, doc_unique,
+                              abs_doc_norm, avg_doc_length, settings, query_counts=query_counts)
+        index, query_rr, query_recall = evaluate(ii.combine_scores(scores, model_weight)["ALL"], k,
+                                                 None if relevant is None else relevant[q])
+        top_k.append(index)
+        rr.append(query_rr)
+        recall.append(query_recall)
+    return top_k, rr, recall
+
+
+def sweep(model, queries, grid, model_weight=[0.25, 0.25, 0.25, 0.25], k=10, relevant=None, workers=1, chunk_size=None):
+    """在参数网格上对一组查询重新打分, 语料库的统计量只使用model中已经建立好的.
+
+    每个参数组合的结果与用该组参数重新建立BM25_LMIR并调用fused的结果相同.
+
+    Args:
+        model: 已经建立好的BM25_LMIR, grid中没有给出的参数使用它自己的超参数.
+        queries: 多个分好词的查询, 为嵌套的Python列表.
+        grid: 参数名到取值列表的Python字典, 参考cal_grid. 例如只给出{"mu": [...]}时, k1等其它参数
+            与model相同.
+        model_weight: 四个模型的权重, 分别对应 [BM25, JM, DIR, ABS].
+        k: 每个查询返回的结果数量.
+        relevant: 每个查询的相关文档编号(Python集合)组成的列表, 为None时只返回排序结果.
+        workers: 进程数量, 默认为1(单进程), None为CPU的数量.
+        chunk_size: 每个进程一次计算的参数组合数量, 默认把网格平均分给每个进程的4块.
+
+    Return:
+        每个参数组合一行的表, 为Python列表. 每一行是一个字典:
+
+            {"k1": 1.5, "b": 0.75, ..., "epsilon": 0.25,
+             "top_k": [每个查询前k个文档编号的nparray],
+             "MRR": 平均倒数排名, "Recall@k": 平均召回率}  (MRR和Recall@k只在给出relevant时存在)
+    """
+    settings = cal_grid(grid, defaults={name: getattr(model, name) for name in SWEEP_PARAMETERS})
+    # the same query plans as BM25_LMIR.fused_scores
+    plans = [model.plan(query) for query in queries]
+    query_plans = [(plan["term_ids"], plan["counts"]) for plan in plans]
+    df = np.diff(model.inverted_index[0])
+    term_ids = np.repeat(np.arange(len(df)), df)
+    cf = np.bincount(term_ids, weights=model.inverted_index[2], minlength=len(df))
+    state = (model.N, df, cf, model.tp, model.inverted_index, model.doc_length, model.doc_unique,
+             model.abs_doc_norm, model.avg_doc_length, query_plans, model_weight, k, relevant)
+
+    workers = os.cpu_count() if workers is None else workers
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(settings) // (max(workers, 1) * 4)))
+    chunks = [settings[start:start + chunk_size] for start in range(0, len(settings), chunk_size)]
+
+    if workers <= 1:
+        init_sweep_worker(state)
+        parts = [sweep_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_sweep_worker, initargs=(state,)) as executor:
+            parts = list(executor.map(sweep_chunk, chunks))
+
+    table = []
+    for chunk, (top_k, rr, recall) in zip(chunks, parts):
+        for s, setting in enumerate(chunk):
+            row = dict(setting)
+            row["top_k"] = [index[s] for index in top_k]
+            if relevant is not None:
+                row["MRR"] = float(np.mean([query_rr[s] for query_rr in rr if query_rr is not None]))
+                row["Recall@{}".format(k)] = float(np.mean([query_recall[s] for query_recall in recall if query_recall is not None]))
+            table.append(row)
+    return table
+
+
+def format_table(table, sort_by=None):
+    """把sweep的结果格式化为文本表格, 每个参数组合一行.
+
+    Args:
+        table: sweep的返回值.
+        sort_by: 按这一列从大到小排序(例如"MRR"), 默认保持网格的顺序.
+
+    Return:
+        表格字符串, 没有评价指标时最后一列为第一个查询的前k个文档编号.
+    """
+    metrics = [name for name in table[0] if name not in SWEEP_PARAMETERS and name != "top_k"] if table else []
+    if sort_by is not None:
+        table = sorted(table, key=lambda row: -row[sort_by])
+
+    header = SWEEP_PARAMETERS + (metrics if metrics else ["top_k[0]"])
+    lines = ["\t".join(header)]
+    for row in table:
+        cells = ["{:g}".format(row[name]) for name in SWEEP_PARAMETERS]
+        if metrics:
+            cells += ["{:.4f}".format(row[name]) for name in metrics]
+        else:
+            cells.append(" ".join(str(doc) for doc in row["top_k"][0].tolist()) if row["top_k"] else "")
+        lines.append("\t".join(cells))
+    return "\n".join(lines)
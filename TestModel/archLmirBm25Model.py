@@ -1,11 +1,13 @@
 import jieba
 import numpy as np
 from numpy.core.records import array
-from Dataloader.Arch.arch import Arch
+from Dataloader.Arch.corpusRegistry import getCorpus
+from utils.Ranking.ranking import topK
+from Models.StatisticModel.source.snapshot import load_snapshot, SNAPSHOT_KEEP
 from TestModel.lmirBm25Model import lmirBm25Model
 
 class archLmirBm25Model():
-    def __init__(self, archPath, model_weight=[0.25, 0.25, 0.25, 0.25]):
+    def __init__(self, archPath, model_weight=[0.25, 0.25, 0.25, 0.25], snapshotPath=None, workers=1, tokenCachePath=None):
         """
         初始化模型, 初始化一个: 
             lmirBM25Model
@@ -13,57 +15,140 @@ class archLmirBm25Model():
         Input:
             archPath: archtectureDataset的数据位置
             modelWeight: list of model weight [BM25, JM, DIR, ABS]
+            snapshotPath: 索引快照的根目录(由TestModel/buildSnapshot.py生成), 为None时重新分词并统计.
+                使用快照时只加载数据集用来显示标注, 不再分词和计算统计量.
+            workers: 分词和统计使用的进程数, 默认为1(单进程), None为CPU的数量.
+            tokenCachePath: 分词缓存(sqlite文件)的位置, 默认为None(不使用), 参考Arch.reverseCharForAllContext.
+
+        数据集通过corpusRegistry.getCorpus加载, 同一个进程中使用同一个数据集的模型共享一份只读的
+        Arch, annIdList, corporaList和notCutCorporaList. 结果的imageId和文本从列式表示(corpus.columns,
+        参考columnar.ArchColumns)中按文档的位置读取.
     
         """
-        self.archDataset = Arch(annotationFile=archPath)
-        self.archDataset.reverseCharForAllContext()
-
-        # generate annotation and corpora list
-        self.annIdList = []
-        self.corporaList = []
-        self.notCutCorporaList = []
-        for annotation, content in self.archDataset.anns.items():
-            self.annIdList.append(annotation)
-            self.corporaList.append(content["cutConcateText"])
-            self.notCutCorporaList.append(content["concateText"])
+        # the dataset and its tokens are shared with the other models of this process
+        corpus = getCorpus(archPath, cut=snapshotPath is None, workers=workers, cachePath=tokenCachePath)
+        self.archDataset = corpus.archDataset
+
+        # ids and texts of the documents, the i'th document is the i'th row
+        self.columns = corpus.columns
+
+        # label / project filters over the documents, see searchSentence(docFilter=...)
+        self.facets = corpus.facets
 
         # model weight [staticModel, featureModel]
         self.model_weight = model_weight
 
-        self.model = lmirBm25Model(self.corporaList, modelWeight=self.model_weight)
+        if snapshotPath is not None:
+            snapshot = load_snapshot(snapshotPath)
+            _, arrays, _ = snapshot
+
+            # the documents of the snapshot must be the annotations of the dataset
+            self.annIdList = corpus.annIdList
+            if arrays["ann_ids"].tolist() != list(self.annIdList):
+                raise ValueError("snapshot {} was not built from {}".format(snapshotPath, archPath))
+            self.corporaList = None
+            self.notCutCorporaList = corpus.notCutCorporaList
+
+            self.model = lmirBm25Model(None, modelWeight=self.model_weight, snapshot=snapshot)
+            return
+
+        # annotation and corpora list, read-only
+        self.annIdList = corpus.annIdList
+        self.corporaList = corpus.corporaList
+        self.notCutCorporaList = corpus.notCutCorporaList
+
+        self.model = lmirBm25Model(self.corporaList, modelWeight=self.model_weight, workers=workers)
+
+    def saveSnapshot(self, snapshotPath, archPath=None, keep=SNAPSHOT_KEEP):
+        """
+        把索引和annotationId/imageId的映射保存为snapshotPath下的一个新版本快照.
+
+        Input:
+            snapshotPath: 快照的根目录
+            archPath: 数据集的位置, 只作为描述信息保存
+            keep: 保留的版本数量, 更旧的版本(没有被服务进程映射时)会被删除, 为None时不删除
+
+        Return:
+            新版本快照目录的路径.
+        """
+        arrays = {
+            "ann_ids": np.array(self.annIdList),
+            "image_ids": self.columns.annImageIds,
+        }
+        meta = {
+            "dataset": archPath,
+            "tokenizer": "jieba.cut(cut_all=True)",
+        }
+        return self.model.saveSnapshot(snapshotPath, arrays=arrays, meta=meta, keep=keep)
 
     def standardization(self, data):
         minValue = np.min(data)
         maxValue = np.max(data)
         return (data - minValue) / (maxValue - minValue) if (maxValue - minValue) != 0 else data
 
-    def searchSentence(self, listWords):
+    def planSentence(self, listWords):
+        """
+        查看一个句子查询的查询计划, 用于调试: 分词后重复的词被合并, 不在词表中的词被去掉.
+
+        Input:
+            listWords: 未分好词的查询部分, 是一个或几个字符串的数组
+
+        Return:
+            与BM25_LMIR.plan的返回值相同.
+        """
+        to_search = []
+        for i in listWords:
+            to_search += list(jieba.cut(i, True))
+        return self.model.plan(to_search)
+
+    def filterDocs(self, docFilter):
+        """docFilter(Facet或者长度为N的bool数组)允许的文档的位置, docFilter为None时返回None."""
+        if docFilter is None:
+            return None
+        mask = np.asarray(docFilter, dtype=bool)
+        if len(mask) != len(self.annIdList):
+            raise ValueError("docFilter has {} entries, the model has {} documents".format(len(mask), len(self.annIdList)))
+        return np.flatnonzero(mask)
+
+    def searchSentence(self, listWords, top_k=0, docFilter=None, collapse=None):
         """
         Search a sentence contains keyword
 
         Input:
             listWords: 未分好词的查询部分, 是一个或几个字符串的数组
+            top_k: 只返回最相似的top_k个结果, 0表示返回全部结果
+            docFilter: 只在被允许的文档中搜索, 为self.facets生成的Facet(可以用 & | ~ 组合)或者长度为N的bool数组,
+                例如 self.facets.label("文化建筑") & ~self.facets.project(projectId). 默认为None(所有文档).
+                模型的分数(forward的"ALL")仍然按整个语料库标准化, 与不过滤时对应文档的分数相同; 返回的
+                sortedResult按被允许的文档的最大最小值归一化到0-1区间(参考ranking.topK), 顺序与不过滤时
+                相同, 数值不同. 注意: 加权结果的z-score需要整个语料库, 所以句子查询仍然对整个语料库打分
+                和标准化, 过滤只减少排序的文档数量, 不会变快; 只有searchWords只对被允许的文档做加权求和.
+            collapse: "image" 或 "project", 每个image(project)只返回分数最高的annotation, 默认为None(不折叠).
         """
         # cut words
         to_search = []
         for i in listWords:
             to_search += list(jieba.cut(i, True))
 
-        # search
-        result = self.model.forward(to_search)
-
-        # get index
-        index = np.argsort(result["ALL"])[::-1]
-        sortedResult = self.standardization(np.sort(result["ALL"])[::-1])
+        # search, scored over the whole corpus, only the allowed documents are ranked
+        docs = self.filterDocs(docFilter)
+        result = self.model.forward(to_search, docs=docs)
+
+        # get top k index, only the winners are sorted (after collapsing)
+        groups = self.facets.groups(collapse)
+        if groups is not None and docs is not None:
+            groups = groups[docs]
+        sortedResult, index = topK(result["ALL"], top_k, groups=groups)
+        if docs is not None:
+            index = docs[index]
         
         # result
-        imageId = []
+        imageId = self.columns.annImageIds[index].tolist()
         annoId = []
         copora = []
         for i in index:
             annoId.append(self.annIdList[i])
             copora.append(self.notCutCorporaList[i])
-            imageId.append(self.archDataset.anns[self.annIdList[i]]["imageId"])
 
         return sortedResult, index, copora, annoId, imageId
 
@@ -96,31 +181,38 @@ class archLmirBm25Model():
         return cutWords, newWeight
 
 
-    def searchWords(self, listWords, weights):
+    def searchWords(self, listWords, weights, top_k=0, docFilter=None, collapse=None):
         """
         Search a list of keyword
 
         Input:
             listWords: 未分好词的查询部分, 是一个或几个字符串的数组
+            top_k: 只返回最相似的top_k个结果, 0表示返回全部结果
+            docFilter: 只在被允许的文档中搜索, 参考searchSentence.
+            collapse: "image" 或 "project", 参考searchSentence.
         """
         # cut words
         listWords, weights = self.cut_words(listWords, weights)
 
-        # search
-        result = self.model.forwardWords(listWords, weights)
+        # search, only the allowed documents are scored
+        docs = self.filterDocs(docFilter)
+        result = self.model.forwardWords(listWords, weights, docs=docs)
 
-        # get index
-        index = np.argsort(result["ALL"])[::-1]
-        sortedResult = self.standardization(np.sort(result["ALL"])[::-1])
+        # get top k index, only the winners are sorted (after collapsing)
+        groups = self.facets.groups(collapse)
+        if groups is not None and docs is not None:
+            groups = groups[docs]
+        sortedResult, index = topK(result["ALL"], top_k, groups=groups)
+        if docs is not None:
+            index = docs[index]
 
         # result
-        imageId = []
+        imageId = self.columns.annImageIds[index].tolist()
         annoId = []
         copora = []
         for i in index:
             annoId.append(self.annIdList[i])
             copora.append(self.notCutCorporaList[i])
-            imageId.append(self.archDataset.anns[self.annIdList[i]]["imageId"])
 
         # result
         return sortedResult, index, copora, annoId, imageId
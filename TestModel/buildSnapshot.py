@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+
+# solve path problem
+abs_path = os.path.abspath(__file__)
+father_path = os.path.abspath(os.path.dirname(abs_path) + os.path.sep + ".")
+project_path = os.path.abspath(os.path.dirname(father_path) + os.path.sep + ".")
+sys.path.append(project_path)
+
+from TestModel.archLmirBm25Model import archLmirBm25Model
+from Models.StatisticModel.source.shard_index import save_shards
+
+if __name__ == '__main__':
+    """
+    离线生成archLmirBm25Model的索引快照.
+
+        读取数据集, 分词并统计BM25/LMIR需要的特征, 然后把词表, 倒排索引, 文档长度, idf/tp以及
+        annotationId/imageId的映射写到快照根目录下的一个新版本目录中. testServer启动时直接内存映射
+        最新的快照, 不需要重新分词和统计.
+
+        python TestModel/buildSnapshot.py -a ./Dataset/Arch/DemoData_20201228.json -o ./Dataset/Arch/snapshot -w 8
+
+        加上 -c ./Dataset/Arch/segments.sqlite 时使用持久化的分词缓存, 没有改变的文本不会再次分词.
+        每次生成新版本后只保留最新的3个版本(-k), 正在被服务进程映射的旧版本不会被删除.
+        加上 -s 4 时另外把索引切分为4个分片快照(保存在 <output>/shards), 供shard_index.ShardCoordinator使用.
+    """
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-a", "--arch", default="./Dataset/Arch/DemoData_20201228.json", help="path of arch dataset json", required=False)
+    parser.add_argument("-o", "--output", default="./Dataset/Arch/snapshot", help="root folder of the snapshots", required=False)
+    parser.add_argument("-c", "--cache", default=None, help="sqlite file of the jieba segmentation cache, default to no cache", required=False)
+    parser.add_argument("-s", "--shards", type=int, default=0, help="also save the index as this many shards, default to 0 (no shards)", required=False)
+    parser.add_argument("-k", "--keep", type=int, default=3, help="number of snapshot versions to keep, default to 3", required=False)
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of build processes, default to the number of cpus", required=False)
+    args = parser.parse_args()
+
+    tic = time.time()
+    model = archLmirBm25Model(archPath=args.arch, workers=args.workers, tokenCachePath=args.cache)
+    path = model.saveSnapshot(args.output, archPath=args.arch, keep=args.keep)
+    print('Snapshot saved to {} (t={:0.2f}s)'.format(path, time.time() - tic))
+
+    if args.shards > 0:
+        tic = time.time()
+        shardRoot = os.path.join(args.output, "shards")
+        save_shards(model.model.model, shardRoot, args.shards)
+        print('{} shards saved to {} (t={:0.2f}s)'.format(args.shards, shardRoot, time.time() - tic))
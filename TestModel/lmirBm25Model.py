@@ -1,6 +1,23 @@
 from typing import OrderedDict
 import numpy as np
+import Models.StatisticModel.source.inverted_index as ii
 from Models.StatisticModel.source.lmir_bm25 import BM25_LMIR
+from Models.StatisticModel.source.score_cache import ScoreCache
+from Models.StatisticModel.source.snapshot import SNAPSHOT_KEEP
+from Models.StatisticModel.source.sweep import sweep, format_table
+from utils.Ranking.ranking import topKIndex
+
+# adaptive model selection (forward with adaptive=True):
+#   shortLength: 查询中不重复的(在词表中的)词不超过这个数量时为短查询
+#   short, long: 短查询和长查询允许使用的模型, DIR适合短查询, JM适合长查询, ABS默认视为冗余
+#   rareDf, rare: 所有查询词的文档频率都不超过rareDf时, 只使用rare中的模型(rareDf为None时不启用)
+ADAPTIVE_POLICY = {
+    "shortLength": 2,
+    "short": ["BM25", "DIR"],
+    "long": ["BM25", "JM"],
+    "rareDf": None,
+    "rare": ["BM25"],
+}
 
 class lmirBm25Model():
     """BM25 and LMIR algorithm model.
@@ -16,9 +33,17 @@ class lmirBm25Model():
             BM25_LMIR.dirichlet(query_tokens)
             BM25_LMIR.absolute_discount(query_tokens)
 
+        forward使用BM25_LMIR.fused(query_tokens, model_weight)一次遍历完成四个模型的计算.
+
+        adaptive为True时, forward和forwardWords根据查询的长度和查询词的统计量(参考ADAPTIVE_POLICY)选择
+        需要计算的模型, 权重为0或者被策略视为冗余的模型不会被计算, 它们的结果为0.
+
+        单个词的标准化分数向量缓存在一个有内存上限的LRU缓存中(ScoreCache), forwardWords和只有一个词的
+        forward共享这个缓存, 多关键词查询只是缓存向量的加权求和.
+
     """
 
-    def __init__(self, corpora, modelWeight=[0.25, 0.25, 0.25, 0.25], k1=1.5, b=0.75, lamb=0.1, mu=2000, delta=0.7, epsilon=0.25):
+    def __init__(self, corpora, modelWeight=[0.25, 0.25, 0.25, 0.25], k1=1.5, b=0.75, lamb=0.1, mu=2000, delta=0.7, epsilon=0.25, ranking="exhaustive", snapshot=None, workers=1, cacheBytes=256 * 2 ** 20, adaptive=False, adaptivePolicy=None):
         """
         初始化BM25-LMIR的模型以及需要的参数.
         Input:
@@ -31,6 +56,12 @@ class lmirBm25Model():
                 mu:         (LMIR.DIR: algorithm)
                 delta:      (LMIR.ABS: algorithm)
                 epsilon:    (BM25: idf none negative)
+            ranking: "exhaustive" 或 "wand", forwardTopK在只使用BM25时的排序方式.
+            snapshot: snapshot.load_snapshot加载的索引快照, 不为None时corpora不会被使用.
+            workers: 建立索引使用的进程数, 默认为1(单进程), None为CPU的数量.
+            cacheBytes: 单词分数向量缓存的内存上限(字节), 默认256MB, 0表示不缓存.
+            adaptive: 是否根据查询选择需要计算的模型, 默认为False(总是使用modelWeight计算四个模型).
+            adaptivePolicy: dict 模型选择策略, 默认为ADAPTIVE_POLICY, 只需要给出需要修改的部分.
         """
         self.b = b
         self.k1 = k1
@@ -39,21 +70,135 @@ class lmirBm25Model():
         self.delta = delta
         self.epsilon = epsilon
 
-        self.model = BM25_LMIR(corpora, k1=self.k1, b=self.b, lamb=self.lamb, mu=self.mu, delta=self.delta, epsilon=self.epsilon)
+        self.ranking = ranking
+
+        self.model = BM25_LMIR(corpora, k1=self.k1, b=self.b, lamb=self.lamb, mu=self.mu, delta=self.delta, epsilon=self.epsilon, ranking=self.ranking, snapshot=snapshot, workers=workers)
         self.modelList = [self.model.BM25, self.model.jelinek_mercer, self.model.dirichlet, self.model.absolute_discount]
         self.modelWeight = modelWeight
+        self.termCache = ScoreCache(max_bytes=cacheBytes)
+        self.adaptive = adaptive
+        self.adaptivePolicy = dict(ADAPTIVE_POLICY, **(adaptivePolicy or {}))
+
+    def saveSnapshot(self, snapshotPath, arrays={}, meta={}, keep=SNAPSHOT_KEEP):
+        """
+        把索引保存为snapshotPath下的一个新版本快照.
+
+        Input:
+            snapshotPath: 快照的根目录.
+            arrays: dict 需要一起保存的其它numpy数组.
+            meta: dict 需要一起保存的其它描述信息.
+            keep: int 保留的版本数量(更旧的, 没有被映射的版本会被删除), 为None时不删除.
+
+        Return:
+            新版本快照目录的路径.
+        """
+        return self.model.save_snapshot(snapshotPath, arrays=arrays, meta=meta, keep=keep)
+
+    def sweep(self, X, grid, k=10, relevant=None, workers=1):
+        """
+        超参数搜索, 复用已经建立好的语料库统计量, 在参数网格上对一组查询重新打分.
+
+        只有epsilon会重新计算idf, 其它参数只改变打分公式, 不需要重新统计语料库.
+
+        Input:
+            X: list 多个分好词的查询, 每个元素是一个forward的输入.
+            grid: dict 参数名到取值列表的字典, 例如 {"k1": [1.2, 1.5], "mu": [500, 2000]}.
+            k: int 每个查询返回的结果数量.
+            relevant: list 每个查询的相关结果位置(set), 给出时计算MRR和Recall@k.
+            workers: int 进程数量, 默认为1(单进程), None为CPU的数量.
+
+        Return:
+            (table, text): 每个参数组合一行的结果(参考sweep.sweep), 以及格式化后的表格字符串
+            (给出relevant时按MRR从大到小排序).
+        """
+        table = sweep(self.model, X, grid, model_weight=self.modelWeight, k=k, relevant=relevant, workers=workers)
+        return table, format_table(table, sort_by="MRR" if relevant is not None else None)
+
+    def adaptiveWeight(self, X):
+        """
+        根据查询的形状选择模型, 返回这个查询实际使用的权重.
+
+        未被选择的模型的权重置为0. 如果选择的模型在modelWeight中的权重全部为0, 则保持modelWeight不变.
+
+        Input:
+            X: list 分好词的查询部分.
+
+        Return:
+            list 四个模型的权重, 分别对应 [BM25, JM, DIR, ABS].
+        """
+        policy = self.adaptivePolicy
+        termIds = set(self.model.query_ids(X))
+        if len(termIds) == 0:
+            return list(self.modelWeight)
+
+        allowed = set(policy["short"] if len(termIds) <= policy["shortLength"] else policy["long"])
+        if policy["rareDf"] is not None:
+            termOffsets = self.model.inverted_index[0]
+            if all(termOffsets[t + 1] - termOffsets[t] <= policy["rareDf"] for t in termIds):
+                allowed &= set(policy["rare"])
+
+        weight = [w if name in allowed else 0 for name, w in zip(ii.MODEL_NAMES, self.modelWeight)]
+        return weight if any(weight) else list(self.modelWeight)
+
+    def plan(self, X):
+        """
+        查询计划: 合并重复的词, 去掉不在词表中的词, 按idf从大到小排序. forward按照这个计划打分.
+
+        Input:
+            X: list 分好词的查询部分.
+
+        Return:
+            与BM25_LMIR.plan的返回值相同.
+        """
+        return self.model.plan(X)
+
+    def termScores(self, term, models=None):
+        """
+        单个词在四个模型上的标准化分数(LMIR已经取负号), 优先从缓存中读取.
+
+        只计算部分模型时缓存的键包含models, 与计算全部模型的结果分开缓存.
+
+        Input:
+            term: str 一个查询词.
+            models: list 四个bool, 分别对应 [BM25, JM, DIR, ABS] 是否需要计算, 默认为None(全部计算).
+                不计算的模型的结果为0.
+
+        Return:
+            只读的 4 x N nparray, 按第一维分别为 [BM25, JM, DIR, ABS].
+        """
+        if models is None or all(models):
+            return self.termCache.get(term, lambda: ii.normalize_scores(self.model.fused_scores([term])))
+        models = tuple(bool(m) for m in models)
+        return self.termCache.get((term, models),
+                                  lambda: ii.normalize_scores(self.model.fused_scores([term], models=list(models))))
+
+    def modelMask(self, weight):
+        """adaptive为True时需要计算的模型(权重不为0), 否则为None(全部计算)."""
+        return [w != 0 for w in weight] if self.adaptive else None
+
+    def cacheStats(self):
+        """
+        单词分数向量缓存的统计信息.
+
+        Return:
+            dict 包含 hits, misses, evictions, entries, bytes, max_bytes.
+        """
+        return self.termCache.stats()
 
     def standardization(self, data):
         mu = np.mean(data, axis=0)
         sigma = np.std(data, axis=0)
         return (data - mu) / sigma if sigma != 0 else data
 
-    def forward(self, X):
+    def forward(self, X, docs=None):
         """
         查询部分, 由于可以整个句子输入, 所以不加weight.
 
         Input:
             X: list 分好词的查询部分, 一个元素是一个词, 多个词组合在一起查询.
+            docs: nparray 只返回这些位置的文档的结果(例如Facet.indices()), 默认为None(所有文档).
+                加权结果的z-score需要整个语料库, 所以仍然对所有文档打分(一个词时从缓存读取)和标准化,
+                再取出这些文档, 不会更快. 结果与不给出docs时对应位置的结果相同.
         
         Return:
             dict{
@@ -62,45 +207,110 @@ class lmirBm25Model():
             }
         """
 
-        # for BM25 (larger is better)
-        bm25Result = np.array(self.model.BM25(X))
+        weight = self.adaptiveWeight(X) if self.adaptive else self.modelWeight
+
+        # a single word is served from the per-term cache
+        if len(X) == 1:
+            normalized = self.termScores(X[0], models=self.modelMask(weight))
+            result = ii.combine_normalized(normalized, weight)
+            if docs is None:
+                return result
+            return {name: value[docs] for name, value in result.items()}
+
+        # BM25 (larger is better) and LMIR (smaller is better) in one pass:
+        # JM for long queries, DIR for short queries, ABS less efficent
+        if self.adaptive:
+            # models with zero weight are skipped, their rows stay 0
+            scores = self.model.fused_scores(X, models=self.modelMask(weight))
+            result = ii.combine_scores(scores, weight)
+        else:
+            result = self.model.fused(X, self.modelWeight)
+        if docs is None:
+            return result
+        return {name: value[docs] for name, value in result.items()}
+
+    def forward_batch(self, X, top_k=0, allModels=False):
+        """
+        批量查询部分, 一次计算多个查询, 每个查询的结果与forward相同.
+
+        Input:
+            X: list 多个分好词的查询, 每个元素是一个forward的输入.
+            top_k: int 大于0时只返回每个查询加权结果最高的top_k个结果, 分数相同时位置小的在前
+                (参考ranking.topKIndex), 与forwardTopK的顺序相同. 大于N时只返回N个结果.
+            allModels: bool 是否同时返回每个模型的结果, 默认只计算加权结果("ALL").
+
+        Return:
+            top_k为0时:
+                dict{
+                    “模型名”: [Q x N 结果nparray] (只在allModels为True时返回)
+                    “ALL”: [Q x N 加权结果nparray]
+                }
+            top_k大于0时:
+                dict{
+                    "index": [Q x min(top_k, N) 结果位置nparray]
+                    "score": [Q x min(top_k, N) 加权结果nparray]
+                }
+        """
+        result = self.model.fused_batch(X, self.modelWeight, all_models=allModels)
+        if top_k <= 0:
+            return result
+        top_k = min(top_k, self.model.N)
+
+        weightResult = result["ALL"]
+        index = np.array([topKIndex(row, top_k) for row in weightResult], dtype=np.int64).reshape(-1, top_k)
 
-        bm25ResultNorm = self.standardization(bm25Result)
+        return {
+            "index": index,
+            "score": np.take_along_axis(weightResult, index, axis=1),
+        }
 
-        # for lmir (smaller is better)
-        # for long queries
-        lmirJmResult = np.array(self.model.jelinek_mercer(X))
-        lmirJmResultNorm = -self.standardization(lmirJmResult)
-        # for short queries
-        lmirDirResult = np.array(self.model.dirichlet(X))
-        lmirDirResultNorm = -self.standardization(lmirDirResult)
-        # less efficent
-        lmirAbsResult = np.array(self.model.absolute_discount(X))
-        lmirAbsResultNorm = -self.standardization(lmirAbsResult)
+    def forwardTopK(self, X, k):
+        """
+        查询部分, 只返回最相似的k个结果.
 
-        weightResult = bm25ResultNorm * self.modelWeight[0] + \
-                    lmirJmResultNorm * self.modelWeight[1] + \
-                    lmirDirResultNorm * self.modelWeight[2] + \
-                    lmirAbsResultNorm * self.modelWeight[3]
+        当ranking为"wand"并且只有BM25的weight不为0时, 使用MaxScore/WAND动态剪枝直接得到BM25的前k个结果
+        (z-score标准化不改变排序), 再用BM25分数在整个语料库上的均值和标准差(只遍历查询词的倒排表)
+        标准化. 其它情况下计算全部的加权结果后取前k个. 两种方式返回的分数都与forward的"ALL"相同.
 
-        weightResult = self.standardization(weightResult)
+        Input:
+            X: list 分好词的查询部分, 一个元素是一个词, 多个词组合在一起查询.
+            k: int 需要返回的结果数量.
+
+        Return:
+            dict{
+                "index": [前k个结果的位置nparray]
+                "score": [前k个结果的加权结果nparray]
+            }
+        """
+        weight = self.adaptiveWeight(X) if self.adaptive else self.modelWeight
+        bm25Only = weight[0] > 0 and not any(weight[1:])
+        if self.ranking == "wand" and bm25Only:
+            index, score = self.model.BM25_topk(X, k, ranking="wand")
+            # same scale as forward: the weighted z-score of BM25 alone is its z-score
+            mean, sigma = self.model.BM25_moments(X)
+            if ii.is_zero_std(np.float64(sigma), np.float64(mean)):
+                score = score * weight[0]
+            else:
+                score = (score - mean) / sigma
+        else:
+            result = self.forward(X)["ALL"]
+            index = np.argsort(-result, kind="stable")[:k]
+            score = result[index]
 
-                
         return {
-            "BM25": bm25ResultNorm,
-            "JM": lmirJmResultNorm,
-            "DIR": lmirDirResultNorm,
-            "ABS": lmirAbsResultNorm,
-            "ALL": weightResult
+            "index": index,
+            "score": score,
         }
 
-    def forwardWords(self, X, weight):
+    def forwardWords(self, X, weight, docs=None):
         """
         查询部分, 输入为一系列的关键词, 无多余字符.
 
         Input:
             X: list 分好词的查询部分, 每一个元素是一个词.
             wordWeight: (list) 对于每一个词占算法重要性的比例, 在算法计算完成后最终融合时, 将会按照权重进行加权求和.
+            docs: nparray 只对这些位置的文档做加权求和并返回结果, 默认为None(所有文档).
+            adaptive为True时按adaptiveWeight(X)选择模型和模型的权重, 没有被选择的模型不会被计算.
         Return:
             dict{
                 "1": {
@@ -118,35 +328,26 @@ class lmirBm25Model():
                 }
         """
         allResult = OrderedDict()
+        modelWeight = self.adaptiveWeight(X) if self.adaptive else self.modelWeight
+        models = self.modelMask(modelWeight)
+
+        # every word from the cache, then weighted sum of the cached vectors
+        if docs is None:
+            tosum = [self.termScores(X[i], models) * weight[i] for i in range(len(X))]
+        else:
+            tosum = [self.termScores(X[i], models)[:, docs] * weight[i] for i in range(len(X))]
+        if len(tosum) == 0:
+            tosum = [np.zeros((len(ii.MODEL_NAMES), self.model.N if docs is None else len(docs)))]
+        wordSum = np.sum(tosum, 0)
 
-        # cal every word
-        for i in range(len(X)):
-            wordResult = self.forward([X[i]])
-            allResult[i] = wordResult
-
-        def weightedSum(diction:dict, key, weight):
-            """
-            calculate part result in dict
-            """
-            tosum = []
-            for k, v in diction.items():
-                tosum.append(v[key]*weight[k])
-        
-            return np.sum(tosum, 0)
-            
         # sum all word
-        allResult["ALL"] = {
-            "BM25": weightedSum(allResult, "BM25", weight),
-            "JM": weightedSum(allResult, "JM", weight),
-            "DIR": weightedSum(allResult, "DIR", weight),
-            "ABS": weightedSum(allResult, "ABS", weight),
-        }
+        allResult["ALL"] = {name: wordSum[i] for i, name in enumerate(ii.MODEL_NAMES)}
 
         # sum all model
-        weightResult = allResult["ALL"]["BM25"] * self.modelWeight[0] + \
-                    allResult["ALL"]["JM"] * self.modelWeight[1] + \
-                    allResult["ALL"]["DIR"] * self.modelWeight[2] + \
-                    allResult["ALL"]["ABS"] * self.modelWeight[3]
+        weightResult = allResult["ALL"]["BM25"] * modelWeight[0] + \
+                    allResult["ALL"]["JM"] * modelWeight[1] + \
+                    allResult["ALL"]["DIR"] * modelWeight[2] + \
+                    allResult["ALL"]["ABS"] * modelWeight[3]
 
         allResult["ALL"]["ALL"] = weightResult
 
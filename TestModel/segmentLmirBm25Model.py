@@ -0,0 +1,139 @@
+import numpy as np
+import Models.StatisticModel.source.inverted_index as ii
+from Models.StatisticModel.source.segment_index import SegmentIndex
+from utils.Ranking.ranking import topKIndex
+
+class segmentLmirBm25Model():
+    """BM25 and LMIR algorithm model over a segmented, incrementally updated index.
+
+        与lmirBm25Model相同的混合查询, 但是底层为SegmentIndex: 可以随时新增, 更新和删除文档, 不需要
+        重新建立整个索引, 合并在后台线程中进行.
+
+        文档用外部编号(例如annotationId)标识, 增删文档之后文档的位置会改变, 所以查询结果总是和文档的
+        外部编号一起返回, 而不是只返回位置:
+
+            segmentLmirBm25Model.add(keys, corpora)          新增(或更新)文档
+            segmentLmirBm25Model.remove(keys)                删除文档
+            segmentLmirBm25Model.forward(X)                  与lmirBm25Model.forward相同, 同时返回keys
+            segmentLmirBm25Model.forwardWords(X, weight)     与lmirBm25Model.forwardWords相同, 同时返回keys
+            segmentLmirBm25Model.forwardTopK(X, k)           与lmirBm25Model.forwardTopK相同, 返回前k个keys
+
+        单词分数缓存, WAND, 批量查询和按位置过滤(docs)依赖固定的文档位置, 这里不支持.
+
+    """
+
+    def __init__(self, keys=[], corpora=[], modelWeight=[0.25, 0.25, 0.25, 0.25], k1=1.5, b=0.75, lamb=0.1, mu=2000, delta=0.7, epsilon=0.25, mergeFactor=8, backgroundMerge=True):
+        """
+        初始化分段索引以及需要的参数.
+        Input:
+            keys: list 初始文档的外部编号.
+            corpora: list 分好词的句子, 与keys一一对应.
+            modelWeight: list 和为1的四个weight, 分别对应 [BM25, JM, DIR, ABS] 的weight.
+            超参数(与lmirBm25Model相同):
+                k1, b, lamb, mu, delta, epsilon
+            mergeFactor: int 同一层的段达到这个数量时合并, 参考SegmentIndex.
+            backgroundMerge: bool 是否在后台线程中合并段, 默认为True. False时在add中同步合并.
+        """
+        self.modelWeight = modelWeight
+        self.index = SegmentIndex(keys, corpora, k1=k1, b=b, lamb=lamb, mu=mu, delta=delta, epsilon=epsilon,
+                                  merge_factor=mergeFactor, background_merge=backgroundMerge)
+
+    def add(self, keys, corpora):
+        """
+        新增文档, 已经存在的外部编号视为更新. 之后的查询立即使用新的文档和全局统计量.
+
+        Input:
+            keys: list 文档的外部编号.
+            corpora: list 分好词的句子, 与keys一一对应.
+        """
+        self.index.add(keys, corpora)
+
+    def remove(self, keys):
+        """
+        删除文档, 不存在的外部编号会被忽略.
+
+        Input:
+            keys: list 需要删除的文档的外部编号.
+        """
+        self.index.remove(keys)
+
+    def merge(self):
+        """立即把所有的段合并为一个."""
+        self.index.merge()
+
+    def close(self):
+        """停止后台合并线程."""
+        self.index.close()
+
+    def combine(self, scores, weight):
+        """标准化原始分数并加权求和(参考inverted_index.combine_scores), 没有文档时返回空的结果."""
+        if scores.shape[1] == 0:
+            return {name: np.zeros(0) for name in ii.MODEL_NAMES + ["ALL"]}
+        return ii.combine_scores(scores, weight)
+
+    def forward(self, X):
+        """
+        查询部分, 由于可以整个句子输入, 所以不加weight.
+
+        Input:
+            X: list 分好词的查询部分, 一个元素是一个词, 多个词组合在一起查询.
+
+        Return:
+            keys: nparray 每个结果对应的文档外部编号.
+            dict{
+                “模型名”: [结果nparray]
+                “ALL”: [加权结果nparray]
+            } 与keys一一对应, 与对当前的文档建立lmirBm25Model后forward的结果相同.
+        """
+        keys, (scores,) = self.index.fused_scores([X])
+        return keys, self.combine(scores, self.modelWeight)
+
+    def forwardTopK(self, X, k):
+        """
+        查询部分, 只返回最相似的k个结果.
+
+        Input:
+            X: list 分好词的查询部分, 一个元素是一个词, 多个词组合在一起查询.
+            k: int 需要返回的结果数量.
+
+        Return:
+            dict{
+                "keys": [前k个结果的文档外部编号nparray]
+                "score": [前k个结果的加权结果nparray]
+            } 分数相同时在forward的结果中位置靠前的在前(参考ranking.topKIndex).
+        """
+        keys, result = self.forward(X)
+        index = topKIndex(result["ALL"], k) if k > 0 else np.zeros(0, dtype=np.int64)
+
+        return {
+            "keys": keys[index],
+            "score": result["ALL"][index],
+        }
+
+    def forwardWords(self, X, weight):
+        """
+        查询部分, 输入为一系列的关键词, 无多余字符.
+
+        每个词在同一个索引视图上分别打分和标准化, 再按weight加权求和, 与lmirBm25Model.forwardWords相同.
+
+        Input:
+            X: list 分好词的查询部分, 每一个元素是一个词.
+            weight: list 对于每一个词占算法重要性的比例.
+
+        Return:
+            keys: nparray 每个结果对应的文档外部编号.
+            dict{
+                “模型名”: [结果nparray]
+                “ALL”: [加权结果nparray]
+            } 与keys一一对应.
+        """
+        keys, scores = self.index.fused_scores([[word] for word in X])
+
+        wordSum = np.zeros((len(ii.MODEL_NAMES), len(keys)))
+        if len(keys) != 0:
+            for wordScores, wordWeight in zip(scores, weight):
+                wordSum += ii.normalize_scores(wordScores) * wordWeight
+
+        result = {name: wordSum[i] for i, name in enumerate(ii.MODEL_NAMES)}
+        result["ALL"] = np.tensordot(np.asarray(self.modelWeight, dtype=np.float64), wordSum, axes=1)
+        return keys, result
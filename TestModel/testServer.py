@@ -24,6 +24,8 @@ class PostHandler(BaseHTTPRequestHandler):
                     "query": ["图书馆", "苏州"],
                     "weight": [0.1, 0.9]
                 }
+            可选的输入内容: "limit" 返回结果的数量, "collapse" 为 "image" 或 "project" 时每个image(project)
+            只返回分数最高的标注.
             返回的json文件格式如下:
                 {
                     "result":{
@@ -47,16 +49,21 @@ class PostHandler(BaseHTTPRequestHandler):
         5. 增加状态码. [Done]
     """
     # 在实例化之前加载的全局变量(查询类)
+    # 如果存在TestModel/buildSnapshot.py生成的索引快照, 直接内存映射快照, 不再重新分词和统计
     archPath = "./Dataset/Arch/DemoData_20201228.json"
-    model = archLmirBm25Model(archPath=archPath)
+    snapshotPath = "./Dataset/Arch/snapshot"
+    model = archLmirBm25Model(archPath=archPath,
+                              snapshotPath=snapshotPath if os.path.isdir(snapshotPath) else None)
 
-    def _information_retrieval(self, query, weight, limit=0):
+    def _information_retrieval(self, query, weight, limit=0, collapse=None):
         """
         使用weight(或者不用)和query进行信息检索的方法.
 
         Input:
             query: 处理好的字符串列表.
             weight: 处理好的权重列表, 可以留空.
+            limit: 返回结果的数量, 只有前limit个结果会被排序和生成, 0表示返回全部结果.
+            collapse: "image" 或 "project", 折叠重复的image(project), None表示不折叠.
         
         Return:
             返回格式如下的python字典:
@@ -92,9 +99,9 @@ class PostHandler(BaseHTTPRequestHandler):
         # search a list of word/sentence
         try:
             if useWeight:
-                sortedResult, index, copora, annoIds, imageIds = self.model.searchWords(listWords=query, weights=weight)
+                sortedResult, index, copora, annoIds, imageIds = self.model.searchWords(listWords=query, weights=weight, top_k=limit, collapse=collapse)
             else:
-                sortedResult, index, copora, annoIds, imageIds = self.model.searchSentence(listWords=query)
+                sortedResult, index, copora, annoIds, imageIds = self.model.searchSentence(listWords=query, top_k=limit, collapse=collapse)
         except Exception as e:
             result["status"]["statusCode"] = 1
             result["status"]["statusMsg"] = "Fail, catch exception: {} when retrieving".format(e)
@@ -196,8 +203,11 @@ class PostHandler(BaseHTTPRequestHandler):
         except Exception as e:
             limit = 0
 
+        # collapse duplicated images / projects, default not collapsed
+        collapse = message.get('collapse', None)
+
         # generate result
-        result = self._information_retrieval(query, weight, limit=limit)
+        result = self._information_retrieval(query, weight, limit=limit, collapse=collapse)
 
         # send the message back
         self._set_headers()
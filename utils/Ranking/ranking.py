@@ -0,0 +1,88 @@
+import numpy as np
+
+
+def collapseBest(scores, groups):
+    """每个group只保留分数最高的一个文档(分数相同时保留位置靠前的).
+
+    按(group, -score)排序后取每个group的第一个, 全部是向量化的numpy操作, 不需要遍历结果.
+
+    Args:
+        scores: 所有文档的分数, 为numpy数组, 越大越相似.
+        groups: 每个文档所属的group(例如imageId或projectId的编号), 与scores等长的int数组.
+
+    Return:
+        保留下来的文档的位置, 为按group排列的numpy数组.
+    """
+    scores = np.asarray(scores)
+    groups = np.asarray(groups)
+    order = np.lexsort((np.arange(len(scores)), -scores, groups))
+    sortedGroups = groups[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sortedGroups[1:] != sortedGroups[:-1]
+    return order[first]
+
+
+def topKIndex(scores, k=0):
+    """分数最高的k个结果的位置, 分数从大到小, 分数相同时位置小的在前.
+
+    顺序是确定的, 所以前k个结果总是全部结果的前缀. 与第k个分数相同的结果只保留位置最小的几个,
+    再对这k个结果排序.
+
+    Args:
+        scores: 所有文档的分数, 为numpy数组, 越大越相似.
+        k: 需要返回的结果数量, k <= 0 或者 k >= N 时返回全部结果.
+
+    Return:
+        结果的位置, 为numpy数组.
+    """
+    scores = np.asarray(scores)
+    if 0 < k < len(scores):
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = np.flatnonzero(scores > kth)
+        tied = np.flatnonzero(scores == kth)[:k - len(above)]
+        candidates = np.concatenate((above, tied))
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+def topK(scores, k=0, mask=None, groups=None):
+    """取出分数最高的k个结果, 只对这k个结果进行排序.
+
+    使用np.partition在O(N)内选出前k个结果, 再对这k个结果排序, 避免对所有N个分数做完整的
+    argsort. 分数相同时位置小的在前(参考topKIndex), 所以前k个结果是全部结果的前缀. 返回的相似度
+    按照所有N个分数的最大最小值归一化到0-1区间, 与对全部结果排序后再归一化得到的数值一致.
+
+    给出mask时只在被允许的文档中选择和排序, 相似度按照被允许的文档的最大最小值归一化.
+    给出groups时先折叠结果(参考collapseBest), 每个group只有分数最高的文档参与前k个结果的选择.
+
+    Args:
+        scores: 所有文档的分数, 为numpy数组, 越大越相似.
+        k: 需要返回的结果数量, k <= 0 或者 k >= N 时返回全部结果.
+        mask: 长度为N的bool数组(或者Facet), 只返回为True的文档, 默认为None(所有文档).
+        groups: 长度为N的int数组, 每个文档所属的group, 默认为None(不折叠).
+
+    Return:
+        sortedResult: 从大到小排列的前k个归一化分数, 为numpy数组.
+        index: 前k个结果在scores中的位置, 为numpy数组.
+    """
+    scores = np.asarray(scores)
+    if mask is not None:
+        allowed = np.flatnonzero(np.asarray(mask, dtype=bool))
+        sortedResult, index = topK(scores[allowed], k, groups=None if groups is None else np.asarray(groups)[allowed])
+        return sortedResult, allowed[index]
+    if groups is not None:
+        best = collapseBest(scores, groups)
+        sortedResult, index = topK(scores[best], k)
+        return sortedResult, best[index]
+
+    index = topKIndex(scores, k)
+    sortedResult = scores[index]
+    if len(scores) == 0:
+        return sortedResult, index
+
+    minValue = np.min(scores)
+    maxValue = np.max(scores)
+    if (maxValue - minValue) != 0:
+        sortedResult = (sortedResult - minValue) / (maxValue - minValue)
+    return sortedResult, index